@@ -1,15 +1,26 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, g, Response
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, g, Response, stream_with_context
 import os
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.http import quote_etag
+import hashlib
 import json
-import re
+import math
 from datetime import datetime, timedelta
-import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from cerebras.cloud.sdk import Cerebras
 from datetime import timedelta
 from dotenv import load_dotenv
-from database import Database
+from database import Database, MAP_DATA_CACHE_TTL
+from utils.llm_cache import LLMCache
+from utils.geocoding import Geocoder, GeocodingProvider, LocalGeocoder, nominatim_lookup
+from utils.itinerary_parser import extract_json_itinerary, render_markdown_itinerary
+from models.distance_model import DistanceMatrixBuilder
+from models.place_model import CovisitRecommender, DestinationClusters, PlaceRecommender
+from models.user_model import TravelerIndex
+from utils.graph_utils import cluster_days, optimize_route
+from utils.geo import encode_polyline
 
 load_dotenv()
 
@@ -20,7 +31,9 @@ app.secret_key = os.environ.get('SECRET_KEY', os.urandom(24))
 # Cerebras API configuration
 CEREBRAS_API_KEY = os.getenv("CEREBRAS_API_KEY")
 
-client = Cerebras(api_key=CEREBRAS_API_KEY)
+# Skip the SDK's warm-up request so importing the app does no network I/O
+client = Cerebras(api_key=CEREBRAS_API_KEY, warm_tcp_connection=False)
+LLM_MODEL = "llama3.1-8b"
 # Upload folder configuration
 UPLOAD_FOLDER = "uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -29,6 +42,44 @@ app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 # Initialize database
 db = Database()
 
+# Cache LLM responses in a SQLite file next to the main database
+llm_cache = LLMCache(
+    db_path=os.path.join(os.path.dirname(os.path.abspath(db.db_path)), 'llm_cache.db'),
+    ttl_seconds=int(os.getenv("LLM_CACHE_TTL", 24 * 3600)),
+    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", 5000))
+)
+
+# Geocoder with an in-process LRU in front of the geocode_cache table. The local
+# gazetteer and places index is tried first; Nominatim is only the fallback.
+# Nominatim's usage policy allows one request per second.
+local_geocoder = LocalGeocoder(db)
+geocoder = Geocoder(
+    db,
+    providers=[
+        GeocodingProvider('local', local_geocoder.lookup, cache=False),
+        GeocodingProvider('nominatim', nominatim_lookup, rate=1.0, timeout=10)
+    ],
+    ttl=int(os.getenv("GEOCODE_CACHE_TTL", 90 * 24 * 3600)),
+    negative_ttl=int(os.getenv("GEOCODE_NEGATIVE_TTL", 24 * 3600)),
+    batch_deadline=int(os.getenv("GEOCODE_BATCH_DEADLINE", 30))
+)
+
+distance_builder = DistanceMatrixBuilder(db)
+place_recommender = PlaceRecommender(db)
+covisit_recommender = CovisitRecommender(db)
+map_clusters = DestinationClusters(db)
+traveler_index = TravelerIndex(db)
+
+# Minutes of visits and travel that fit into one day of a dynamic plan
+DAY_PLAN_BUDGET_MINUTES = int(os.getenv("DAY_PLAN_BUDGET_MINUTES", 8 * 60))
+
+# Bounded worker pool for the finalize pipeline; job state lives in the database
+FINALIZE_WORKERS = int(os.getenv("FINALIZE_WORKERS", 2))
+FINALIZE_JOB_STALE_SECONDS = int(os.getenv("FINALIZE_JOB_STALE_SECONDS", 300))
+# Running jobs touch updated_at this often, so a slow LLM call never looks stale
+FINALIZE_HEARTBEAT_SECONDS = max(1, FINALIZE_JOB_STALE_SECONDS // 5)
+finalize_executor = ThreadPoolExecutor(max_workers=FINALIZE_WORKERS, thread_name_prefix='finalize')
+
 # Global variables for storing temporary itineraries
 user_itinerary = []  # Stores user inputs for refining the itinerary
 final_markdown = ""  # Stores the finalized itinerary in markdown format
@@ -36,7 +87,7 @@ final_json = {}     # Stores the finalized itinerary as JSON
 
 @app.teardown_appcontext
 def close_db(error):
-    """Close the database connection at the end of each request."""
+    """Return the request's database connection to the pool."""
     if hasattr(g, 'db'):
         g.db.close_connection()
 
@@ -56,102 +107,157 @@ def login_required(f):
     return decorated_function
 
 def get_current_user():
-    """Get the current logged-in user."""
-    if 'user_id' in session:
-        return db.get_user_by_id(session['user_id'])
-    return None
+    """Get the current logged-in user, memoized for the rest of the request."""
+    user_id = session.get('user_id')
+    if user_id is None:
+        return None
+
+    cached = g.get('current_user')
+    if cached is not None and cached[0] == user_id:
+        return cached[1]
+
+    user = db.get_user_by_id(user_id)
+    g.current_user = (user_id, user)
+    return user
+
+def call_cerebras_api(messages, use_cache=True):
+    """Calls the Cerebras API with the given messages array.
+
+    Responses are cached by a hash of the normalized messages and model name.
+    Pass use_cache=False to always go to the provider.
+    """
+    cache_key = LLMCache.make_key(messages, LLM_MODEL)
+    if use_cache:
+        cached_response = llm_cache.get(cache_key)
+        if cached_response is not None:
+            return cached_response
 
-def call_cerebras_api(messages):
-    """Calls the Cerebras API with the given messages array."""
     try:
         chat_completion = client.chat.completions.create(
             messages=messages,
-            model="llama3.1-8b"
+            model=LLM_MODEL
         )
-        return chat_completion.choices[0].message.content
+        response = chat_completion.choices[0].message.content
     except Exception as e:
         return f"Error: {str(e)}"
 
-def store_json_itinerary(json_data, user_id=None):
-    """Store the JSON itinerary in the database."""
-    try:
-        trip = json_data.get('trip', {})
-        destination = trip.get('destination', 'Unknown')
-        dates = trip.get('dates', {})
-        start_date = dates.get('start')
-        end_date = dates.get('end')
-
-        # Create trip in database
-        trip_id = db.create_trip(
-            user_id=user_id,
-            title=f"Trip to {destination}",
-            destination=destination,
-            start_date=start_date,
-            end_date=end_date,
-            status='upcoming'
-        )
-
-        # Store itinerary items
-        for day in trip.get('itinerary', []):
-            day_num = day['day']
-            for activity in day.get('activities', []):
-                # Create or get place
-                place_data = {
-                    'name': activity['place'],
-                    'description': activity['description'],
-                    'latitude': 0.0,  # You would need to get real coordinates
-                    'longitude': 0.0,  # You would need to get real coordinates
-                }
-                place_id = db.create_place(**place_data)
-
-                # Add itinerary item
-                db.add_itinerary_item(
-                    trip_id=trip_id,
-                    place_id=place_id,
-                    day=day_num,
-                    start_time=activity['time'],
-                    end_time=activity['time'],  # You would calculate this from expected_time
-                    notes=activity['description'],
-                    order_index=day_num
-                )
-
-        return trip_id
-    except Exception as e:
-        print(f"Error storing itinerary: {str(e)}")
-        return None
+    if use_cache:
+        llm_cache.set(cache_key, LLM_MODEL, response)
+    return response
+
+def stream_cerebras_api(messages, use_cache=True):
+    """Yields response tokens from the Cerebras API as they are generated.
+
+    A cached response is yielded as a single token. Errors are raised to the
+    caller instead of being returned as text, and are never cached.
+    """
+    cache_key = LLMCache.make_key(messages, LLM_MODEL)
+    if use_cache:
+        cached_response = llm_cache.get(cache_key)
+        if cached_response is not None:
+            yield cached_response
+            return
+
+    tokens = []
+    stream = client.chat.completions.create(
+        messages=messages,
+        model=LLM_MODEL,
+        stream=True
+    )
+    for chunk in stream:
+        choices = getattr(chunk, 'choices', None)
+        if not choices:
+            continue
+        token = choices[0].delta.content
+        if token:
+            tokens.append(token)
+            yield token
+
+    if use_cache:
+        llm_cache.set(cache_key, LLM_MODEL, "".join(tokens))
+
+def sse_event(event, data):
+    """Format a Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-# Add this new function
 def geocode_address(address):
     """Convert an address to geographic coordinates (latitude and longitude)."""
-    url = "https://nominatim.openstreetmap.org/search"
-    params = {
-        'q': address,
-        'format': 'json'
-    }
-    
-    headers = {
-        'User-Agent': 'Musafir Travel App (your_email@example.com)'  # Replace with your app name and email
-    }
-    
-    try:
-        response = requests.get(url, params=params, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        
-        if data:
-            latitude = float(data[0]['lat'])
-            longitude = float(data[0]['lon'])
-            return latitude, longitude
-        else:
-            print(f"No geocoding results found for address: {address}")
-            return None, None
-    
-    except requests.exceptions.RequestException as e:
-        print(f"Error: Unable to connect to the geocoding service. Details: {e}")
-        return None, None
-    except ValueError as ve:
-        print(f"Error: {ve}")
-        return None, None
+    return geocoder.geocode(address)
+
+def optimize_day_routes(itinerary_json, travel_mode='walking'):
+    """Reorder each day's activities to minimize estimated travel time.
+
+    Activities are given the day's original time slots in order, so the first
+    stop of the new route takes the first slot. Days with an activity that has
+    no coordinates are left as they are. Returns the total minutes saved.
+    """
+    minutes_saved = 0.0
+    for day in itinerary_json.get('trip', {}).get('itinerary', []):
+        activities = day.get('activities', [])
+        if len(activities) < 3 or not all(
+            activity.get('latitude') and activity.get('longitude') for activity in activities
+        ):
+            continue
+
+        _, durations = distance_builder.matrix(
+            [activity['latitude'] for activity in activities],
+            [activity['longitude'] for activity in activities],
+            travel_mode
+        )
+        result = optimize_route(durations)
+        if result['saved'] <= 0:
+            continue
+
+        time_slots = [activity.get('time') for activity in activities]
+        day['activities'] = [activities[i] for i in result['order']]
+        for activity, time_slot in zip(day['activities'], time_slots):
+            activity['time'] = time_slot
+        minutes_saved += result['saved']
+
+    return minutes_saved
+
+def strip_empty(value):
+    """Drop None, empty strings, lists and dicts from nested dicts and lists."""
+    if isinstance(value, dict):
+        value = {key: strip_empty(item) for key, item in value.items()}
+        return {key: item for key, item in value.items() if item not in (None, '', [], {})}
+    if isinstance(value, list):
+        return [strip_empty(item) for item in value]
+    return value
+
+def compact_map_data(map_data):
+    """Shrink map data for the JSON API.
+
+    Each day's coordinates move into a single encoded polyline ('route', one
+    point per place in order), and empty fields are dropped.
+    """
+    days = []
+    for day in map_data['days']:
+        places = [{key: value for key, value in place.items() if key not in ('lat', 'lng')}
+                  for place in day['places']]
+        days.append({
+            'date': day['date'],
+            'route': encode_polyline((place['lat'], place['lng']) for place in day['places']),
+            'places': places
+        })
+    return strip_empty({'trip': map_data['trip'], 'days': days})
+
+def map_data_payload(trip):
+    """Return the JSON body of a trip's map data and its ETag.
+
+    The payload is cached per trip version; its ETag hashes the content, so
+    refreshed visitors lists change it even when the version does not.
+    """
+    cache_key = ('map_payload', trip['id'], trip['version'])
+    cached = db.render_cache.get(cache_key)
+    if cached is None:
+        map_data = db.get_trip_map_data(trip['id'], trip=trip)
+        body = json.dumps({"success": True, "mapData": compact_map_data(map_data)},
+                          separators=(',', ':'))
+        digest = hashlib.sha1(body.encode('utf-8')).hexdigest()[:16]
+        cached = (body, f"{trip['id']}-{trip['version']}-{digest}")
+        db.render_cache.set(cache_key, cached, ttl=MAP_DATA_CACHE_TTL)
+    return cached
 
 # Add this new route to handle placeholder images
 @app.route('/placeholder.svg')
@@ -232,6 +338,13 @@ def travel_planner():
     user = get_current_user()
     return render_template('travelPlanner.html', user=user)
 
+def build_refine_messages(user_text):
+    """Build the chat messages used to refine the itinerary from user input."""
+    return [
+        {"role": "system", "content": "You are a travel assistant helping users plan a structured travel itinerary. Format your responses using Markdown for better readability. Use headers, bullet points, and emphasis where appropriate."},
+        {"role": "user", "content": f"Refine this trip itinerary based on the following user input:\n\n{user_text}\n\nEnsure clarity and keep a structured format with proper Markdown formatting."}
+    ]
+
 @app.route("/process_text", methods=["POST"])
 def process_text():
     """Handles user messages to refine the itinerary."""
@@ -241,14 +354,34 @@ def process_text():
 
     user_itinerary.append(user_text)
 
-    messages = [
-        {"role": "system", "content": "You are a travel assistant helping users plan a structured travel itinerary. Format your responses using Markdown for better readability. Use headers, bullet points, and emphasis where appropriate."},
-        {"role": "user", "content": f"Refine this trip itinerary based on the following user input:\n\n{user_text}\n\nEnsure clarity and keep a structured format with proper Markdown formatting."}
-    ]
-
-    itinerary_response = call_cerebras_api(messages)
+    itinerary_response = call_cerebras_api(build_refine_messages(user_text))
     return jsonify({"response": itinerary_response})
 
+@app.route("/process_text_stream", methods=["POST"])
+def process_text_stream():
+    """Streams the refined itinerary to the chat as Server-Sent Events."""
+    user_text = request.json.get("message", "")
+    if not user_text:
+        return jsonify({"error": "No message provided"}), 400
+
+    user_itinerary.append(user_text)
+    messages = build_refine_messages(user_text)
+
+    def generate():
+        try:
+            for token in stream_cerebras_api(messages):
+                yield sse_event("token", {"token": token})
+            yield sse_event("done", {})
+        except Exception as e:
+            print(f"Error in process_text_stream: {str(e)}")
+            yield sse_event("error", {"error": "An error occurred processing your request"})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.route("/upload_pdf", methods=["POST"])
 def upload_pdf():
     """Handles PDF uploads and extracts structured itinerary."""
@@ -285,99 +418,301 @@ def upload_pdf():
         print(f"Error in upload_pdf: {str(e)}")
         return jsonify({"error": "An error occurred processing your PDF"}), 500
 
-# Update the finalize_trip function
+def build_finalize_messages(combined_itinerary):
+    """Build the chat messages that ask the LLM for the JSON itinerary."""
+    json_prompt = (
+        "Generate a JSON itinerary with full addresses. Output format:\n"
+        "{\n"
+        "  \"trip\": {\n"
+        "    \"destination\": \"<city, country>\",\n"
+        "    \"dates\": {\"start\": \"YYYY-MM-DD\", \"end\": \"YYYY-MM-DD\"},\n"
+        "    \"itinerary\": [\n"
+        "      {\n"
+        "        \"day\": <number>,\n"
+        "        \"date\": \"YYYY-MM-DD\",\n"
+        "        \"activities\": [\n"
+        "          {\n"
+        "            \"time\": \"<time>\",\n"
+        "            \"place\": \"<place name>\",\n"
+        "            \"address\": \"<full address>\",\n"
+        "            \"description\": \"<details>\",\n"
+        "            \"expected_time\": \"<duration>\"\n"
+        "          }\n"
+        "        ]\n"
+        "      }\n"
+        "    ]\n"
+        "  }\n"
+        "}\n\n"
+        f"Based on this plan:\n\n{combined_itinerary}"
+    )
+
+    return [
+        {"role": "system", "content": (
+            "You are an expert travel planner. "
+            "For each place, include its full address.  Also in the itinerary only include the place which has an actual address otherwise skip the places which have generic named addresses. SO FOR THE ADDRESS ATTRIBUTE IN THE JSON FOR EACH OF THE LOCATION IF THE LOCATION THAT YOU HAVE THOUGHT OF DOESNT HAVE AN ADDRESS THAT WOULD BE VIABLE TO DETECT THEN JUST SKIP THAT AND USE SOME OTHER PLACE THAT WOUDL AHVE A PERFECT. THESE PLACES wouldnt work for geocoding because we also need to extract the lat long ahead so places like statue of liberty would be difficult because theres no official address of the liberty island. "
+            "Example address: 'Central Park, New York, NY 10022, USA'"
+        )},
+        {"role": "user", "content": json_prompt}
+    ]
+
+def plan_dynamic_days(places, num_days=None):
+    """Group dynamic-plan places into days and order each day's stops.
+
+    Places need 'lat' and 'lng'; 'timeSpent' is the visit length in hours.
+    num_days is capped at the number of places; without it, days are added
+    until every place fits the daily budget.
+    Returns the itinerary text for the finalize prompt, or None if any place
+    has no coordinates.
+    """
+    try:
+        latitudes = [float(place['lat']) for place in places]
+        longitudes = [float(place['lng']) for place in places]
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not places:
+        return None
+
+    visit_minutes = []
+    for place in places:
+        try:
+            visit_minutes.append(max(15, round(float(place.get('timeSpent') or 1) * 60)))
+        except (TypeError, ValueError, OverflowError):
+            visit_minutes.append(60)
+
+    if num_days:
+        # More days than places would only add empty days
+        days, unassigned = cluster_days(latitudes, longitudes, visit_minutes, min(num_days, len(places)),
+                                        day_budget_minutes=DAY_PLAN_BUDGET_MINUTES)
+    else:
+        # Start from the fewest days the total time allows (20 minutes of travel per stop)
+        num_days = max(1, math.ceil(sum(minutes + 20 for minutes in visit_minutes) / DAY_PLAN_BUDGET_MINUTES))
+        while True:
+            days, unassigned = cluster_days(latitudes, longitudes, visit_minutes, num_days,
+                                            day_budget_minutes=DAY_PLAN_BUDGET_MINUTES)
+            if not unassigned or num_days >= len(places):
+                break
+            num_days += 1
+
+    itinerary_text = "Here's your trip itinerary:\n\n"
+    day_number = 0
+    for stops in days:
+        if not stops:
+            continue
+        day_number += 1
+        _, durations = distance_builder.matrix(
+            [latitudes[i] for i in stops], [longitudes[i] for i in stops], 'walking'
+        )
+        order = optimize_route(durations)['order']
+
+        itinerary_text += f"Day {day_number}:\n\n"
+        clock = datetime.strptime("09:00", "%H:%M")
+        for position, index in enumerate(order):
+            place = places[stops[index]]
+            if position > 0:
+                clock += timedelta(minutes=round(durations[order[position - 1]][index]))
+            end = clock + timedelta(minutes=visit_minutes[stops[index]])
+            itinerary_text += f"- Visit {place['name']}\n"
+            itinerary_text += f"  * {place.get('description', '')}\n"
+            itinerary_text += f"  * Time: {clock.strftime('%H:%M')} - {end.strftime('%H:%M')}\n\n"
+            clock = end
+
+    if unassigned:
+        itinerary_text += "If there is time, also consider:\n\n"
+        for index in unassigned:
+            itinerary_text += f"- Visit {places[index]['name']}\n"
+            itinerary_text += f"  * {places[index].get('description', '')}\n\n"
+
+    return itinerary_text
+
+def finalize_heartbeat(job_id, stop):
+    """Touch a running job's updated_at until stop is set."""
+    try:
+        while not stop.wait(FINALIZE_HEARTBEAT_SECONDS):
+            db.update_finalize_job(job_id)
+    except Exception as e:
+        print(f"Error in heartbeat for finalize job {job_id}: {str(e)}")
+    finally:
+        db.close_connection()
+
+def run_finalize_job(job_id):
+    """Run the finalize pipeline for a job: LLM, geocoding, then storage."""
+    global final_markdown, final_json
+
+    stop_heartbeat = threading.Event()
+    try:
+        if not db.claim_finalize_job(job_id):
+            return
+        threading.Thread(target=finalize_heartbeat, args=(job_id, stop_heartbeat), daemon=True).start()
+
+        job = db.get_finalize_job(job_id)
+        db.update_finalize_job(job_id, stage='llm')
+
+        # Generate the JSON itinerary with addresses; the Markdown is rendered from it locally
+        json_response = call_cerebras_api(build_finalize_messages(job['itinerary_text']))
+        parsed_json = extract_json_itinerary(json_response)
+        if not parsed_json:
+            db.update_finalize_job(job_id, status='failed', error='Failed to generate itinerary')
+            return
+
+        activities = [
+            activity
+            for day in parsed_json['trip']['itinerary']
+            for activity in day['activities']
+        ]
+        db.update_finalize_job(job_id, stage='geocoding', activities_total=len(activities))
+
+        # Geocode every activity concurrently; duplicate addresses are looked up once
+        coordinates = geocoder.geocode_batch(
+            [activity.get('address') for activity in activities],
+            on_progress=lambda done: db.update_finalize_job(job_id, activities_geocoded=done)
+        )
+        for activity, (lat, lon) in zip(activities, coordinates):
+            if lat and lon:
+                activity['latitude'] = lat
+                activity['longitude'] = lon
+
+        # Reorder each day's stops to cut travel time
+        minutes_saved = optimize_day_routes(parsed_json)
+        if minutes_saved:
+            print(f"Route optimization saved {minutes_saved:.0f} minutes for finalize job {job_id}")
+
+        final_json = parsed_json
+        final_markdown = render_markdown_itinerary(final_json)
+
+        # Store in database if user is logged in
+        if job['user_id'] is None:
+            db.update_finalize_job(job_id, status='failed', error='Failed to generate itinerary')
+            return
+
+        db.update_finalize_job(job_id, stage='storing')
+        trip_id = db.store_json_itinerary(final_json, job['user_id'])
+        if not trip_id:
+            db.update_finalize_job(job_id, status='failed', error='Failed to store itinerary')
+            return
+
+        # Extend the destination's distance matrix with any new places
+        try:
+            distance_builder.build_destination(final_json.get('trip', {}).get('destination', ''))
+        except Exception as e:
+            print(f"Error updating distances for trip {trip_id}: {str(e)}")
+
+        # Refresh the user's similar-traveler signature with the new trip's places
+        try:
+            traveler_index.update_user(job['user_id'])
+        except Exception as e:
+            print(f"Error updating traveler index for user {job['user_id']}: {str(e)}")
+
+        db.update_finalize_job(job_id, status='done', stage='done', trip_id=trip_id)
+
+    except Exception as e:
+        print(f"Error in finalize job {job_id}: {str(e)}")
+        db.update_finalize_job(job_id, status='failed', error='An error occurred finalizing your trip')
+    finally:
+        stop_heartbeat.set()
+        db.close_connection()
+
+def resume_finalize_jobs():
+    """Resubmit queued jobs and jobs orphaned by a restart to the worker pool."""
+    try:
+        db.requeue_stale_finalize_jobs(FINALIZE_JOB_STALE_SECONDS)
+        for job_id in db.get_queued_finalize_job_ids():
+            finalize_executor.submit(run_finalize_job, job_id)
+    except Exception as e:
+        print(f"Error resuming finalize jobs: {str(e)}")
+
+def describe_finalize_job(job):
+    """Format a finalize job as a progress report for the client."""
+    geocoded = job['activities_geocoded']
+    total = job['activities_total']
+
+    if job['status'] == 'done':
+        progress = "Itinerary ready"
+    elif job['status'] == 'failed':
+        progress = job['error'] or "Failed to generate itinerary"
+    elif job['stage'] == 'llm':
+        progress = "Generating itinerary"
+    elif job['stage'] == 'geocoding':
+        progress = f"LLM done, {geocoded}/{total} activities geocoded"
+    elif job['stage'] == 'storing':
+        progress = f"{geocoded}/{total} activities geocoded, saving trip"
+    else:
+        progress = "Waiting for a worker"
+
+    return {
+        "job_id": job['id'],
+        "status": job['status'],
+        "stage": job['stage'],
+        "progress": progress,
+        "activities_geocoded": geocoded,
+        "activities_total": total,
+        "finalized": job['status'] == 'done',
+        "trip_id": job['trip_id'],
+        "error": job['error']
+    }
+
 @app.route("/finalize_trip", methods=["POST"])
 def finalize_trip():
-    """Generates final itinerary in both Markdown and JSON formats."""
+    """Queues the finalize pipeline and returns a job ID to poll."""
     try:
-        global final_markdown, final_json
-        
         # If this is a dynamic plan submission
         if request.json.get('dynamic_plan'):
             places = request.json.get('places', [])
-            # Convert dynamic plan to itinerary format
-            itinerary_text = "Here's your trip itinerary:\n\n"
-            for place in places:
-                itinerary_text += f"- Visit {place['name']}\n"
-                itinerary_text += f"  * {place['description']}\n"
-                itinerary_text += f"  * Time: {place['time']}\n\n"
+            num_days = request.json.get('num_days')
+            if num_days is not None:
+                try:
+                    num_days = int(num_days)
+                except (TypeError, ValueError, OverflowError):
+                    num_days = 0
+                if num_days < 1:
+                    return jsonify({"error": "num_days must be a positive whole number"}), 400
+            # Split the places into days locally when we know where they are
+            itinerary_text = plan_dynamic_days(places, num_days)
+            if itinerary_text is None:
+                # Convert dynamic plan to itinerary format
+                itinerary_text = "Here's your trip itinerary:\n\n"
+                for place in places:
+                    itinerary_text += f"- Visit {place['name']}\n"
+                    itinerary_text += f"  * {place['description']}\n"
+                    itinerary_text += f"  * Time: {place['time']}\n\n"
             
             combined_itinerary = itinerary_text
         else:
             combined_itinerary = "\n".join(user_itinerary)
 
-        # Generate Markdown itinerary with addresses
-        messages_markdown = [
-            {"role": "system", "content": (
-                "You are an expert travel planner. Generate a structured markdown itinerary. "
-                "For each place, include its full address in parentheses after the place name.  Also in the itinerary only include the place which has an actual address otherwise skip the places which have generic named addresses. SO FOR THE ADDRESS ATTRIBUTE IN THE JSON FOR EACH OF THE LOCATION IF THE LOCATION THAT YOU HAVE THOUGHT OF DOESNT HAVE AN ADDRESS THAT WOULD BE VIABLE TO DETECT THEN JUST SKIP THAT AND USE SOME OTHER PLACE THAT WOUDL AHVE A PERFECT. THESE PLACES wouldnt work for geocoding because we also need to extract the lat long ahead so places like statue of liberty would be difficult because theres no official address of the liberty island. "
-                "Example: '## Central Park (Central Park, New York, NY 10022, USA)'"
-            )},
-            {"role": "user", "content": f"Create a detailed itinerary with addresses for:\n\n{combined_itinerary}"}
-        ]
-
-        final_markdown = call_cerebras_api(messages_markdown)
-
-        # Generate JSON itinerary with addresses
-        json_prompt = (
-            "Generate a JSON itinerary with full addresses. Output format:\n"
-            "{\n"
-            "  \"trip\": {\n"
-            "    \"destination\": \"<city, country>\",\n"
-            "    \"dates\": {\"start\": \"YYYY-MM-DD\", \"end\": \"YYYY-MM-DD\"},\n"
-            "    \"itinerary\": [\n"
-            "      {\n"
-            "        \"day\": <number>,\n"
-            "        \"date\": \"YYYY-MM-DD\",\n"
-            "        \"activities\": [\n"
-            "          {\n"
-            "            \"time\": \"<time>\",\n"
-            "            \"place\": \"<place name>\",\n"
-            "            \"address\": \"<full address>\",\n"
-            "            \"description\": \"<details>\",\n"
-            "            \"expected_time\": \"<duration>\"\n"
-            "          }\n"
-            "        ]\n"
-            "      }\n"
-            "    ]\n"
-            "  }\n"
-            "}\n\n"
-            f"Based on this plan:\n\n{combined_itinerary}"
-        )
-
-        messages_json = [
-            {"role": "system", "content": "You are an expert travel planner."},
-            {"role": "user", "content": json_prompt}
-        ]
-        
-        json_response = call_cerebras_api(messages_json)
-        if json_response:
-            json_match = re.search(r'(\{[\s\S]*\})', json_response)
-            if json_match:
-                json_str = json_match.group(1)
-                final_json = json.loads(json_str)
-                
-                # Add geocoding for each activity
-                for day in final_json['trip']['itinerary']:
-                    for activity in day['activities']:
-                        lat, lon = geocode_address(activity['address'])
-                        if lat and lon:
-                            activity['latitude'] = lat
-                            activity['longitude'] = lon
-                
-                # Store in database if user is logged in
-                if 'user_id' in session:
-                    trip_id = db.store_json_itinerary(final_json, session['user_id'])
-                    if trip_id:
-                        session['current_trip_id'] = trip_id
-                        return jsonify({"finalized": True, "trip_id": trip_id})
+        job_id = db.create_finalize_job(session.get('user_id'), combined_itinerary)
+        finalize_executor.submit(run_finalize_job, job_id)
 
-        return jsonify({"error": "Failed to generate itinerary"}), 500
+        return jsonify({
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": url_for('finalize_trip_status', job_id=job_id)
+        }), 202
 
     except Exception as e:
         print(f"Error in finalize_trip: {str(e)}")
         return jsonify({"error": "An error occurred finalizing your trip"}), 500
 
+@app.route("/finalize_trip/<job_id>")
+def finalize_trip_status(job_id):
+    """Reports per-stage progress of a finalize job."""
+    job = db.get_finalize_job(job_id)
+    if not job or job['user_id'] != session.get('user_id'):
+        return jsonify({"error": "Job not found"}), 404
+
+    # A job left running by a worker that died is picked up again
+    stale_cutoff = (datetime.now() - timedelta(seconds=FINALIZE_JOB_STALE_SECONDS)).strftime('%Y-%m-%d %H:%M:%S')
+    if job['status'] == 'running' and job['updated_at'] < stale_cutoff:
+        for stale_id in db.requeue_stale_finalize_jobs(FINALIZE_JOB_STALE_SECONDS, job_id=job_id):
+            finalize_executor.submit(run_finalize_job, stale_id)
+        job = db.get_finalize_job(job_id)
+
+    if job['status'] == 'done' and job['trip_id']:
+        session['current_trip_id'] = job['trip_id']
+
+    return jsonify(describe_finalize_job(job))
+
+resume_finalize_jobs()
+
 @app.route("/view_itinerary")
 def view_itinerary():
     """Displays the finalized itinerary."""
@@ -386,8 +721,8 @@ def view_itinerary():
     
     if trip_id:
         # Get itinerary from database
-        itinerary_md = db.generate_markdown_itinerary(trip_id)
         trip = db.get_trip_by_id(trip_id)  # Retrieve the trip details
+        itinerary_md = db.generate_markdown_itinerary(trip_id, trip=trip) if trip else None
         if itinerary_md:
             return render_template("itinerary.html", user=user, itinerary=itinerary_md, trip=trip)
     
@@ -399,12 +734,16 @@ def map_view():
     user = get_current_user()
     trip_id = request.args.get('trip_id')
     
-    if trip_id:
-        map_data = db.get_trip_map_data(trip_id)
-    else:
-        map_data = None
+    map_data = None
+    map_etag = None
+    trip = db.get_trip_by_id(trip_id) if trip_id else None
+    if trip:
+        # Render the same payload the API serves, so the first poll can be a 304
+        body, etag = map_data_payload(trip)
+        map_data = json.loads(body)['mapData']
+        map_etag = quote_etag(etag)
     
-    return render_template('map_view.html', user=user, map_data=map_data)
+    return render_template('map_view.html', user=user, map_data=map_data, map_etag=map_etag)
 
 # Add the dynamic planning route
 @app.route('/dynamic_plan')
@@ -556,7 +895,7 @@ def request_contact():
             return jsonify({"error": "Contact request already exists"}), 400
 
         # Get user details
-        from_user = db.get_user_by_id(session['user_id'])
+        from_user = get_current_user()
         to_user = db.get_user_by_id(traveler_id)
 
         if not to_user or not to_user['email']:
@@ -572,6 +911,173 @@ def request_contact():
         print(f"Error in request_contact: {str(e)}")
         return jsonify({"error": "An error occurred"}), 500
 
+@app.route('/api/expand_search')
+@login_required
+def expand_search():
+    """Find travelers visiting a place or the places nearest to it."""
+    try:
+        place_name = request.args.get('place', '').strip()
+        if not place_name:
+            return jsonify({"error": "No place specified", "travelers": []}), 400
+
+        place = db.get_place_by_name(place_name)
+        if not place:
+            return jsonify({"error": "Place not found", "travelers": []}), 404
+
+        k = min(request.args.get('k', 10, type=int), 50)
+        radius_km = min(request.args.get('radius_km', 5.0, type=float), 50.0)
+        nearby = db.find_nearest_places(
+            place['latitude'], place['longitude'],
+            k=k, initial_radius_km=0.5, max_radius_km=radius_km
+        )
+        distances = {p['id']: p['distance_km'] for p in nearby}
+
+        visitors = db.get_place_visitors(distances, exclude_user_id=session['user_id'])
+        visitors.sort(key=lambda visitor: distances[visitor['place_id']])
+
+        # 'place' is the searched place so map.js lists nearby visitors under it
+        travelers = [{
+            "id": visitor['id'],
+            "name": visitor['name'],
+            "profile_image": visitor['profile_image'],
+            "place": place_name,
+            "visiting": visitor['place_name'],
+            "distance_km": distances[visitor['place_id']],
+            "time": f"{visitor['start_time']} - {visitor['end_time']}"
+        } for visitor in visitors]
+
+        return jsonify({"travelers": travelers})
+
+    except Exception as e:
+        print(f"Error in expand_search: {str(e)}")
+        return jsonify({"error": "An error occurred", "travelers": []}), 500
+
+@app.route('/api/next_place', methods=['POST'])
+@login_required
+def next_place():
+    """Suggest the next place for the dynamic planner."""
+    try:
+        data = request.get_json(silent=True) or {}
+        exclude_ids = {int(place_id) for place_id in data.get('accepted', []) + data.get('rejected', [])}
+        latitude, longitude = data.get('lat'), data.get('lng')
+        if latitude is not None and longitude is not None:
+            latitude, longitude = float(latitude), float(longitude)
+        max_distance_km = data.get('max_distance_km')
+        if max_distance_km is not None:
+            max_distance_km = float(max_distance_km)
+        planned_minutes = float(data.get('planned_minutes', 0))
+
+        preferences = db.get_user_preferences(session['user_id'])
+        place = place_recommender.recommend(
+            latitude, longitude,
+            travel_styles=preferences.get('travel_style', []),
+            exclude_ids=exclude_ids,
+            remaining_minutes=DAY_PLAN_BUDGET_MINUTES - planned_minutes,
+            max_distance_km=max_distance_km
+        )
+        if place is None:
+            return jsonify({"place": None})
+
+        return jsonify({"place": {
+            "id": place['id'],
+            "name": place['name'],
+            "lat": place['latitude'],
+            "lng": place['longitude'],
+            "description": place['description'],
+            "image": place['image_url'],
+            "rating": place['rating'],
+            "address": place['address'],
+            "place_type": place['place_type'],
+            "highlights": place['highlight'],
+            "activities": place['activity'],
+            "distance_km": place['distance_km'],
+            "duration": place['visit_minutes']
+        }})
+
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid request", "place": None}), 400
+    except Exception as e:
+        print(f"Error in next_place: {str(e)}")
+        return jsonify({"error": "An error occurred", "place": None}), 500
+
+@app.route('/api/related_places')
+@login_required
+def related_places():
+    """Places that travelers who visited the given places also visited."""
+    try:
+        place_ids = request.args.getlist('place_id', type=int)
+        if not place_ids:
+            return jsonify({"error": "No place specified", "places": []}), 400
+
+        k = min(request.args.get('k', 10, type=int), 50)
+        preferences = db.get_user_preferences(session['user_id'])
+        places = covisit_recommender.related(
+            place_ids, k=k,
+            travel_styles=preferences.get('travel_style', [])
+        )
+        return jsonify({"places": places})
+
+    except Exception as e:
+        print(f"Error in related_places: {str(e)}")
+        return jsonify({"error": "An error occurred", "places": []}), 500
+
+@app.route('/api/similar_travelers')
+@login_required
+def similar_travelers():
+    """Travelers with similar places and preferences going to a destination."""
+    try:
+        destination = request.args.get('destination', '').strip() or None
+        start_date = request.args.get('start_date') or None
+        end_date = request.args.get('end_date') or None
+        k = min(request.args.get('k', 10, type=int), 50)
+
+        travelers = traveler_index.similar_travelers(
+            session['user_id'], destination=destination,
+            start_date=start_date, end_date=end_date, k=k
+        )
+        return jsonify({"travelers": travelers})
+
+    except Exception as e:
+        print(f"Error in similar_travelers: {str(e)}")
+        return jsonify({"error": "An error occurred", "travelers": []}), 500
+
+@app.route('/api/map_data/<int:trip_id>')
+@login_required
+def api_map_data(trip_id):
+    """Map data for a trip, with an ETag so unchanged polls get a 304."""
+    trip = db.get_trip_by_id(trip_id)
+    if not trip:
+        return jsonify({"success": False, "error": "Trip not found"}), 404
+
+    body, etag = map_data_payload(trip)
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+@app.route('/api/map_clusters')
+@login_required
+def api_map_clusters():
+    """Clustered places and travelers of a destination inside the visible map area."""
+    destination = request.args.get('destination', '').strip()
+    if not destination:
+        return jsonify({"error": "No destination specified", "clusters": []}), 400
+
+    try:
+        west, south, east, north = (float(value) for value in request.args.get('bbox', '').split(','))
+        zoom = request.args.get('zoom', type=int)
+        if zoom is None:
+            raise ValueError("zoom is required")
+    except ValueError:
+        return jsonify({"error": "bbox must be west,south,east,north and zoom an integer", "clusters": []}), 400
+
+    try:
+        clusters = map_clusters.get_clusters(destination, west, south, east, north, zoom)
+        return jsonify({"clusters": clusters})
+    except Exception as e:
+        print(f"Error in map_clusters: {str(e)}")
+        return jsonify({"error": "An error occurred", "clusters": []}), 500
+
 @app.route('/approve_contact/<token>')
 def approve_contact(token):
     """Handle contact request approval."""
@@ -631,6 +1137,17 @@ def send_approval_email(to_email, approved_name, approved_email):
     You can now reach them at: {approved_email}
     """)
 
+@app.route("/api/cache_stats")
+@login_required
+def cache_stats():
+    """Report hit rates of the in-process caches and the connection pool."""
+    return jsonify({
+        "users": db.user_cache_stats(),
+        "renders": db.render_cache_stats(),
+        "llm": llm_cache.stats(),
+        "db_pool": db.pool_stats()
+    })
+
 @app.route("/health_check")
 def health_check():
     return "App Deployed Successfully"
@@ -1,33 +1,157 @@
 import sqlite3
 import os
+import re
 from datetime import datetime
 import json
 from threading import local
 from datetime import timedelta
-from math import radians, cos
-from init_data import create_dummy_data
+import heapq
+import time
+from collections import Counter
+from itertools import permutations
+from migrations import run_migrations, get_schema_version
+from utils.db_pool import get_pool
+from utils.geo import haversine_km, bounding_box
+from utils.cache import LRUCache
+from utils.itinerary_parser import normalize_time, parse_duration_minutes, parse_time_range
+
+# Seconds a rendered map payload may be served before visitors are refreshed
+MAP_DATA_CACHE_TTL = 60
+
+# Stored itinerary times that can be compared as text
+CLOCK_TIME = re.compile(r'[0-2][0-9]:[0-5][0-9]')
+
+# Bound parameters per statement on SQLite builds older than 3.32
+SQLITE_MAX_VARIABLES = 999
+
+# app_meta key recording when the co-visitation counts were last rebuilt
+COVISITS_MARKER = 'covisits_built_at'
+
+# Hot query shapes reported by Database.explain_hot_queries
+HOT_QUERIES = {
+    'get_trip_itinerary': ('''
+        SELECT i.*, p.name, p.latitude, p.longitude, p.image_url, p.rating
+        FROM itinerary_items i
+        JOIN places p ON i.place_id = p.id
+        WHERE i.trip_id = ?
+        ORDER BY i.day, i.order_index
+    ''', (1,)),
+    'get_user_trips': ('''
+        SELECT * FROM trips
+        WHERE user_id = ?
+        ORDER BY start_date DESC
+    ''', (1,)),
+    'get_places_by_ids': ('SELECT * FROM places WHERE id IN (?, ?)', (1, 2)),
+    'get_places_by_ids (details)': ('''
+        SELECT place_id, detail_type, detail_value
+        FROM place_details
+        WHERE place_id IN (?, ?)
+    ''', (1, 2)),
+    'find_nearest_places': ('''
+        SELECT p.*
+        FROM places_rtree r
+        JOIN places p ON p.id = r.id
+        WHERE r.max_lat >= ? AND r.min_lat <= ?
+        AND r.max_lng >= ? AND r.min_lng <= ?
+    ''', (40.7, 40.8, -74.0, -73.9)),
+    'get_place_visitors': ('''
+        SELECT u.id, u.name, u.profile_image, i.place_id, p.name AS place_name,
+               i.start_time, i.end_time
+        FROM itinerary_items i
+        JOIN trips t ON t.id = i.trip_id
+        JOIN users u ON u.id = t.user_id
+        JOIN places p ON p.id = i.place_id
+        WHERE i.place_id IN (?, ?)
+        AND u.id IS NOT ?
+        ORDER BY t.start_date, i.day, i.start_time
+    ''', (1, 2, None)),
+    'get_trip_colocations': ('''
+        SELECT i.trip_id, u.id
+        FROM itinerary_items i
+        JOIN trips t ON t.id = i.trip_id
+        JOIN users u ON u.id = t.user_id
+        WHERE i.place_id = ?
+        AND i.visit_date = ?
+        AND i.start_time <= ?
+        AND i.end_time >= ?
+    ''', (1, '2025-01-01', '12:00', '10:00')),
+    'get_covisited_places': ('''
+        SELECT c.place_id, c.related_place_id, c.trips, n.trips AS related_trips,
+               p.name, p.place_type
+        FROM place_covisits c
+        JOIN place_trip_counts n ON n.place_id = c.related_place_id
+        JOIN places p ON p.id = c.related_place_id
+        WHERE c.place_id IN (?, ?)
+        AND c.trips >= ?
+    ''', (1, 2, 1)),
+    'search_places': ('''
+        SELECT p.*, bm25(places_fts, 10.0, 2.0, 4.0, 1.0) AS rank
+        FROM places_fts
+        JOIN places p ON p.id = places_fts.rowid
+        WHERE places_fts MATCH ?
+        ORDER BY rank
+        LIMIT ?
+    ''', ('"park"*', 10)),
+    'get_chat_messages': ('''
+        SELECT * FROM chat_messages
+        WHERE session_id = ?
+        ORDER BY timestamp
+    ''', (1,)),
+    'get_user_chat_sessions': ('''
+        SELECT * FROM chat_sessions
+        WHERE user_id = ?
+        ORDER BY updated_at DESC
+    ''', (1,)),
+}
+
+def _chunks(values, size=500):
+    """Split a list of query parameters to stay under SQLite's variable limit."""
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def _is_clock_time(value):
+    """Whether a stored time is a zero-padded 'HH:MM' that compares correctly as text."""
+    return bool(value) and CLOCK_TIME.fullmatch(value) is not None
 
-class Database:
-    _thread_local = local()
 
-    def __init__(self, db_path='musafir.db'):
+def _user_cache_key(user_id):
+    """Normalize IDs from sessions, forms and JSON to one cache key."""
+    try:
+        return int(user_id)
+    except (TypeError, ValueError):
+        return user_id
+
+class Database:
+    def __init__(self, db_path='musafir.db', pool_size=8, user_cache_size=1024, user_cache_ttl=300,
+                 render_cache_size=512):
         self.db_path = db_path
+        self.pool = get_pool(db_path, max_idle=pool_size)
+        self._thread_local = local()
+        # Users by ID; rows are immutable, so they can be shared across threads
+        self.user_cache = LRUCache(maxsize=user_cache_size, ttl=user_cache_ttl)
+        # Rendered Markdown and map data keyed by (kind, trip_id, trip version)
+        self.render_cache = LRUCache(maxsize=render_cache_size)
         self.initialize_db()
 
     def get_connection(self):
+        """Get this thread's connection, checking one out of the pool if needed."""
         if not hasattr(self._thread_local, 'connection'):
-            self._thread_local.connection = sqlite3.connect(self.db_path)
-            self._thread_local.connection.row_factory = sqlite3.Row
+            self._thread_local.connection = self.pool.acquire()
         return self._thread_local.connection
 
     def close_connection(self):
+        """Return this thread's connection to the pool."""
         if hasattr(self._thread_local, 'connection'):
-            self._thread_local.connection.close()
+            self.pool.release(self._thread_local.connection)
             del self._thread_local.connection
 
     def __del__(self):
         self.close_connection()
 
+    def pool_stats(self):
+        """Return connection pool metrics."""
+        return self.pool.stats()
+
     def _check_table_schema(self, cursor, table_name, expected_columns):
         """Verify table schema matches expected columns."""
         cursor.execute(f"PRAGMA table_info({table_name})")
@@ -38,152 +162,16 @@ class Database:
             raise Exception(f"Table '{table_name}' is missing columns: {missing_columns}")
 
     def initialize_db(self):
-        """Initialize the database with all required tables if they don't exist."""
+        """Bring the database schema up to date by running pending migrations."""
         conn = self.get_connection()
         cursor = conn.cursor()
 
-        # Users table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT,
-            google_id TEXT UNIQUE,
-            profile_image TEXT,
-            joined_date TEXT NOT NULL,
-            is_active BOOLEAN DEFAULT 1
-        )
-        ''')
-
-        # User preferences table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_preferences (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            preference_type TEXT NOT NULL,
-            preference_value TEXT NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            UNIQUE(user_id, preference_type, preference_value)
-        )
-        ''')
-
-        # Trips table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS trips (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            destination TEXT NOT NULL,
-            start_date TEXT NOT NULL,
-            end_date TEXT NOT NULL,
-            status TEXT NOT NULL,
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-        ''')
-
-        # Places table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS places (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            description TEXT,
-            latitude REAL NOT NULL,
-            longitude REAL NOT NULL,
-            image_url TEXT,
-            rating REAL,
-            address TEXT,
-            place_type TEXT,
-            external_id TEXT,
-            UNIQUE(latitude, longitude, name)
-        )
-        ''')
-
-        # Place details table (for additional data like highlights, activities)
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS place_details (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            place_id INTEGER NOT NULL,
-            detail_type TEXT NOT NULL,
-            detail_value TEXT NOT NULL,
-            FOREIGN KEY (place_id) REFERENCES places (id),
-            UNIQUE(place_id, detail_type, detail_value)
-        )
-        ''')
-
-        # Itinerary items table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS itinerary_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            trip_id INTEGER NOT NULL,
-            place_id INTEGER NOT NULL,
-            day INTEGER NOT NULL,
-            start_time TEXT NOT NULL,
-            end_time TEXT NOT NULL,
-            notes TEXT,
-            order_index INTEGER NOT NULL,
-            FOREIGN KEY (trip_id) REFERENCES trips (id),
-            FOREIGN KEY (place_id) REFERENCES places (id)
-        )
-        ''')
-
-        # Distance matrix for travel times between places
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS distances (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            origin_place_id INTEGER NOT NULL,
-            destination_place_id INTEGER NOT NULL,
-            distance_km REAL NOT NULL,
-            duration_minutes INTEGER NOT NULL,
-            travel_mode TEXT NOT NULL,
-            FOREIGN KEY (origin_place_id) REFERENCES places (id),
-            FOREIGN KEY (destination_place_id) REFERENCES places (id),
-            UNIQUE(origin_place_id, destination_place_id, travel_mode)
-        )
-        ''')
-
-        # Chat sessions for travel planning
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chat_sessions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            trip_id INTEGER,
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (trip_id) REFERENCES trips (id)
-        )
-        ''')
-
-        # Chat messages
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chat_messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id INTEGER NOT NULL,
-            sender TEXT NOT NULL,
-            message TEXT NOT NULL,
-            timestamp TEXT NOT NULL,
-            FOREIGN KEY (session_id) REFERENCES chat_sessions (id)
-        )
-        ''')
+        run_migrations(conn)
 
-        # Contact requests table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS contact_requests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            from_user_id INTEGER NOT NULL,
-            to_user_id INTEGER NOT NULL,
-            status TEXT NOT NULL DEFAULT 'pending',
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL,
-            token TEXT UNIQUE NOT NULL,
-            FOREIGN KEY (from_user_id) REFERENCES users (id),
-            FOREIGN KEY (to_user_id) REFERENCES users (id),
-            UNIQUE(from_user_id, to_user_id)
-        )
-        ''')
+        # The triggers keep co-visitation counts current; backfill them once
+        cursor.execute('SELECT 1 FROM app_meta WHERE key = ?', (COVISITS_MARKER,))
+        if cursor.fetchone() is None:
+            self.rebuild_covisits()
 
         # Verify table schemas
         self._check_table_schema(cursor, 'users', [
@@ -191,92 +179,22 @@ class Database:
             'profile_image', 'joined_date', 'is_active'
         ])
 
-        create_dummy_data(cursor)
-        # Add sample users with trips
-        cursor.execute("SELECT COUNT(*) FROM users")
-        if cursor.fetchone()[0] == 0:
-            self._insert_sample_data()
-
         conn.commit()
 
-    def _insert_sample_data(self):
-        """Insert sample data for testing purposes."""
+    def get_schema_version(self):
+        """Get the version of the latest applied migration."""
+        return get_schema_version(self.get_connection())
+
+    def explain_hot_queries(self):
+        """Return the EXPLAIN QUERY PLAN details for each hot query."""
         conn = self.get_connection()
         cursor = conn.cursor()
-        now = datetime.now()
-
-        # Sample users
-        users = [
-            ('John Doe', 'john@example.com', 'pbkdf2:sha256:150000$abc123'),
-            ('Alice Smith', 'alice@example.com', 'pbkdf2:sha256:150000$def456'),
-            ('Bob Wilson', 'bob@example.com', 'pbkdf2:sha256:150000$ghi789'),
-            ('Emma Davis', 'emma@example.com', 'pbkdf2:sha256:150000$jkl012')
-        ]
-
-        user_ids = []
-        for name, email, password_hash in users:
-            cursor.execute('''
-            INSERT INTO users (name, email, password_hash, joined_date)
-            VALUES (?, ?, ?, ?)
-            ''', (name, email, password_hash, now.strftime('%Y-%m-%d')))
-            user_ids.append(cursor.lastrowid)
-
-        # Sample preferences
-        preferences = ['Adventure', 'Cultural', 'Food', 'Photography']
-        for user_id in user_ids:
-            for pref in preferences:
-                cursor.execute('''
-                INSERT INTO user_preferences (user_id, preference_type, preference_value)
-                VALUES (?, ?, ?)
-                ''', (user_id, 'travel_style', pref))
-
-        # Sample trips for next three days
-        places = [
-            ('Central Park', 'Iconic urban park', 40.7829, -73.9654),
-            ('Times Square', 'Bustling tourist spot', 40.7580, -73.9855),
-            ('Empire State Building', 'Historic skyscraper', 40.7484, -73.9857),
-            ('Statue of Liberty', 'Famous monument', 40.6892, -74.0445),
-            ('Brooklyn Bridge', 'Historic bridge', 40.7061, -73.9969),
-            ('Metropolitan Museum', 'World-class museum', 40.7794, -73.9632)
-        ]
-
-        # Create places
-        place_ids = []
-        for name, desc, lat, lng in places:
-            cursor.execute('''
-            INSERT INTO places (name, description, latitude, longitude)
-            VALUES (?, ?, ?, ?)
-            ''', (name, desc, lat, lng))
-            place_ids.append(cursor.lastrowid)
-
-        # Create trips for each user
-        for user_id in user_ids:
-            # Create a trip for each of the next three days
-            for day_offset in range(3):
-                start_date = (now + timedelta(days=day_offset)).strftime('%Y-%m-%d')
-                end_date = (now + timedelta(days=day_offset + 2)).strftime('%Y-%m-%d')
-                
-                cursor.execute('''
-                INSERT INTO trips (user_id, title, destination, start_date, end_date, status, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (user_id, f'NYC Trip {day_offset + 1}', 'New York', start_date, end_date, 'upcoming', 
-                      now.strftime('%Y-%m-%d %H:%M:%S'), now.strftime('%Y-%m-%d %H:%M:%S')))
-                
-                trip_id = cursor.lastrowid
-
-                # Add random places to the itinerary
-                import random
-                selected_places = random.sample(place_ids, 3)  # Pick 3 random places
-                for i, place_id in enumerate(selected_places):
-                    start_time = f"{9 + i * 3:02d}:00"  # 9:00, 12:00, 15:00
-                    end_time = f"{12 + i * 3:02d}:00"   # 12:00, 15:00, 18:00
-                    
-                    cursor.execute('''
-                    INSERT INTO itinerary_items (trip_id, place_id, day, start_time, end_time, notes, order_index)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', (trip_id, place_id, 1, start_time, end_time, f'Visit {places[place_id-1][0]}', i+1))
 
-        conn.commit()
+        plans = {}
+        for name, (query, params) in HOT_QUERIES.items():
+            cursor.execute(f'EXPLAIN QUERY PLAN {query}', params)
+            plans[name] = [row['detail'] for row in cursor.fetchall()]
+        return plans
 
     # User-related methods
     def create_user(self, name, email, password_hash=None, google_id=None, profile_image=None):
@@ -291,6 +209,7 @@ class Database:
             VALUES (?, ?, ?, ?, ?, ?)
             ''', (name, email, password_hash, google_id, profile_image, joined_date))
             conn.commit()
+            self.user_cache.invalidate(_user_cache_key(cursor.lastrowid))
             return cursor.lastrowid
         except sqlite3.IntegrityError:
             # User already exists
@@ -311,11 +230,19 @@ class Database:
         return cursor.fetchone()
 
     def get_user_by_id(self, user_id):
-        """Get a user by ID."""
+        """Get a user by ID, served from the user cache when possible."""
+        key = _user_cache_key(user_id)
+        user = self.user_cache.get(key)
+        if user is not None:
+            return user
+
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
-        return cursor.fetchone()
+        user = cursor.fetchone()
+        if user is not None:
+            self.user_cache.set(key, user)
+        return user
 
     def update_user(self, user_id, **kwargs):
         """Update user information."""
@@ -332,8 +259,17 @@ class Database:
         WHERE id = ?
         ''', values)
         conn.commit()
+        self.user_cache.invalidate(_user_cache_key(user_id))
         return cursor.rowcount > 0
 
+    def user_cache_stats(self):
+        """Return hit/miss counters for the user cache."""
+        return self.user_cache.stats()
+
+    def render_cache_stats(self):
+        """Return hit/miss counters for the itinerary render cache."""
+        return self.render_cache.stats()
+
     def get_user_preferences(self, user_id):
         """Get all preferences for a user."""
         conn = self.get_connection()
@@ -425,56 +361,120 @@ class Database:
     # Place-related methods
     def create_place(self, name, latitude, longitude, description=None, image_url=None, 
                     rating=None, address=None, place_type=None, external_id=None):
-        """Create a new place."""
+        """Create a new place, or get the ID of the existing one."""
         conn = self.get_connection()
         cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-            INSERT INTO places (name, description, latitude, longitude, address, image_url, rating, place_type, external_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (name, description, latitude, longitude, address, image_url, rating, place_type, external_id))
-            conn.commit()
-            return cursor.lastrowid
-        except sqlite3.IntegrityError:
-            # Place already exists, get its ID
-            cursor.execute('''
-            SELECT id FROM places
-            WHERE latitude = ? AND longitude = ? AND name = ?
-            ''', (latitude, longitude, name))
-            result = cursor.fetchone()
-            return result['id'] if result else None
+        place_id = self._upsert_place(cursor, name, latitude, longitude, description, image_url,
+                                      rating, address, place_type, external_id)
+        conn.commit()
+        return place_id
+
+    def _upsert_place(self, cursor, name, latitude, longitude, description=None, image_url=None,
+                      rating=None, address=None, place_type=None, external_id=None):
+        """Insert a place unless (latitude, longitude, name) exists; return its ID either way."""
+        # The no-op update lets RETURNING yield the existing row's id without
+        # touching any column the spatial or full-text triggers watch
+        cursor.execute('''
+        INSERT INTO places (name, description, latitude, longitude, address, image_url, rating, place_type, external_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (latitude, longitude, name) DO UPDATE SET external_id = places.external_id
+        RETURNING id
+        ''', (name, description, latitude, longitude, address, image_url, rating, place_type, external_id))
+        return cursor.fetchone()[0]
 
     def get_place_by_id(self, place_id):
         """Get a place by ID."""
+        return self.get_places_by_ids([place_id]).get(place_id)
+
+    def get_places_by_ids(self, place_ids):
+        """Get places with their details, keyed by place ID, in two queries."""
+        place_ids = list(dict.fromkeys(place_ids))
+        if not place_ids:
+            return {}
+
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM places WHERE id = ?', (place_id,))
-        place = cursor.fetchone()
-        
-        if place:
-            # Get place details
-            cursor.execute('''
-            SELECT detail_type, detail_value
+
+        places = {}
+        for chunk in _chunks(place_ids):
+            placeholders = ','.join(['?'] * len(chunk))
+            cursor.execute(f'SELECT * FROM places WHERE id IN ({placeholders})', chunk)
+            for row in cursor.fetchall():
+                places[row['id']] = dict(row)
+
+        for place_id, details in self._get_place_details(cursor, list(places)).items():
+            places[place_id].update(details)
+
+        return places
+
+    def _get_place_details(self, cursor, place_ids):
+        """Group place_details rows as {place_id: {detail_type: [values]}}."""
+        details = {}
+        for chunk in _chunks(place_ids):
+            placeholders = ','.join(['?'] * len(chunk))
+            cursor.execute(f'''
+            SELECT place_id, detail_type, detail_value
             FROM place_details
-            WHERE place_id = ?
-            ''', (place_id,))
-            
-            details = {}
+            WHERE place_id IN ({placeholders})
+            ''', chunk)
+
             for row in cursor.fetchall():
-                detail_type = row['detail_type']
-                detail_value = row['detail_value']
-                
-                if detail_type not in details:
-                    details[detail_type] = []
-                
-                details[detail_type].append(detail_value)
-            
-            place_dict = dict(place)
-            place_dict.update(details)
-            return place_dict
-        
-        return None
+                place_details = details.setdefault(row['place_id'], {})
+                place_details.setdefault(row['detail_type'], []).append(row['detail_value'])
+
+        return details
+
+    def get_geocoded_places(self):
+        """Get name, address and coordinates of every place that has been geocoded."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT name, address, latitude, longitude FROM places
+        WHERE NOT (latitude = 0 AND longitude = 0)
+        ''')
+        return cursor.fetchall()
+
+    def get_recommendation_candidates(self):
+        """Get every geocoded place with its highlights and activities, one row per name."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT id, name, description, latitude, longitude, image_url, rating, address, place_type
+        FROM places
+        WHERE NOT (latitude = 0 AND longitude = 0)
+        ORDER BY id
+        ''')
+
+        places = {}
+        seen_names = set()
+        for row in cursor.fetchall():
+            name_key = row['name'].strip().lower()
+            if name_key in seen_names:
+                continue
+            seen_names.add(name_key)
+            place = dict(row)
+            place['highlight'] = []
+            place['activity'] = []
+            places[row['id']] = place
+
+        cursor.execute('''
+        SELECT place_id, detail_type, detail_value
+        FROM place_details
+        WHERE detail_type IN ('highlight', 'activity')
+        ''')
+        for row in cursor.fetchall():
+            place = places.get(row['place_id'])
+            if place is not None:
+                place[row['detail_type']].append(row['detail_value'])
+
+        return list(places.values())
+
+    def get_places_version(self):
+        """Get a cheap fingerprint of the places table that changes when places are added."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*), MAX(id) FROM places')
+        return tuple(cursor.fetchone())
 
     def add_place_detail(self, place_id, detail_type, detail_value):
         """Add a detail to a place."""
@@ -492,12 +492,38 @@ class Database:
             # Detail already exists
             return False
 
-    def search_places(self, query, limit=10):
-        """Search for places by name or description."""
+    def search_places(self, query, limit=10, highlight=('<mark>', '</mark>')):
+        """Search places by name, description, address and details.
+
+        Uses the places_fts index: every word in the query must match, the last
+        one as a prefix, and results are ranked by bm25 with name matches
+        weighted highest. Each row has a 'snippet' with matches wrapped in the
+        highlight markers. Falls back to a LIKE scan if the query has no
+        searchable words or the index is unavailable.
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
+
+        terms = re.findall(r'\w+', query or '')
+        if terms:
+            # Quote each term so FTS5 syntax in user input is matched literally
+            match = ' '.join(f'"{term}"' for term in terms) + '*'
+            try:
+                cursor.execute('''
+                SELECT p.*,
+                       snippet(places_fts, -1, ?, ?, '...', 12) AS snippet,
+                       bm25(places_fts, 10.0, 2.0, 4.0, 1.0) AS rank
+                FROM places_fts
+                JOIN places p ON p.id = places_fts.rowid
+                WHERE places_fts MATCH ?
+                ORDER BY rank
+                LIMIT ?
+                ''', (highlight[0], highlight[1], match, limit))
+                return cursor.fetchall()
+            except sqlite3.OperationalError as e:
+                print(f"Full-text search failed, falling back to LIKE: {str(e)}")
+
         search_term = f"%{query}%"
-        
         cursor.execute('''
         SELECT * FROM places
         WHERE name LIKE ? OR description LIKE ?
@@ -508,9 +534,14 @@ class Database:
 
     # Itinerary-related methods
     def add_itinerary_item(self, trip_id, place_id, day, start_time, end_time, notes=None, order_index=None):
-        """Add an item to an itinerary."""
+        """Add an item to an itinerary.
+
+        Clock times such as '2:00 PM' are stored as zero-padded 'HH:MM'.
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
+        start_time = normalize_time(start_time) or start_time
+        end_time = normalize_time(end_time) or end_time
         
         # If order_index is not provided, put it at the end
         if order_index is None:
@@ -558,6 +589,9 @@ class Database:
         """Update an itinerary item."""
         conn = self.get_connection()
         cursor = conn.cursor()
+        for key in ('start_time', 'end_time'):
+            if key in kwargs:
+                kwargs[key] = normalize_time(kwargs[key]) or kwargs[key]
         
         set_clause = ', '.join([f"{key} = ?" for key in kwargs.keys()])
         values = list(kwargs.values())
@@ -676,6 +710,355 @@ class Database:
         
         return cursor.fetchone()
 
+    def upsert_distances(self, rows):
+        """Bulk insert or update (origin, destination, km, minutes, mode) rows in one transaction."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany('''
+        INSERT INTO distances (origin_place_id, destination_place_id, distance_km, duration_minutes, travel_mode)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (origin_place_id, destination_place_id, travel_mode) DO UPDATE SET
+            distance_km = excluded.distance_km,
+            duration_minutes = excluded.duration_minutes
+        ''', rows)
+        conn.commit()
+        return cursor.rowcount
+
+    def get_place_ids_with_distances(self, place_ids):
+        """Get which of the given places already have distance rows to all the others.
+
+        Rows to places outside place_ids don't count, so a place whose
+        distances were built for another destination is still reported missing.
+        """
+        place_ids = list(place_ids)
+        wanted = set(place_ids)
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        targets = {}
+        for chunk in _chunks(place_ids):
+            placeholders = ','.join(['?'] * len(chunk))
+            cursor.execute(f'''
+            SELECT DISTINCT origin_place_id, destination_place_id FROM distances
+            WHERE origin_place_id IN ({placeholders})
+            ''', chunk)
+            for origin_id, destination_id in cursor.fetchall():
+                if destination_id in wanted:
+                    targets[origin_id] = targets.get(origin_id, 0) + 1
+        return {place_id for place_id, count in targets.items() if count == len(wanted) - 1}
+
+    def get_destinations(self):
+        """Get the distinct trip destinations, normalized to lowercase."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT DISTINCT lower(trim(destination)) AS destination
+        FROM trips
+        WHERE destination IS NOT NULL AND trim(destination) != ''
+        ''')
+        return [row['destination'] for row in cursor.fetchall()]
+
+    def get_destination_places(self, destination):
+        """Get id and coordinates of every geocoded place visited on trips to a destination."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT DISTINCT p.id, p.latitude, p.longitude
+        FROM trips t
+        JOIN itinerary_items i ON i.trip_id = t.id
+        JOIN places p ON p.id = i.place_id
+        WHERE lower(trim(t.destination)) = lower(trim(?))
+        AND NOT (p.latitude = 0 AND p.longitude = 0)
+        ORDER BY p.id
+        ''', (destination,))
+        return cursor.fetchall()
+
+    def get_destination_visitors(self, destination):
+        """Get each (user, place) visit on trips to a destination, with the place's coordinates."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT DISTINCT t.user_id, p.id AS place_id, p.latitude, p.longitude
+        FROM trips t
+        JOIN itinerary_items i ON i.trip_id = t.id
+        JOIN places p ON p.id = i.place_id
+        WHERE lower(trim(t.destination)) = lower(trim(?))
+        AND NOT (p.latitude = 0 AND p.longitude = 0)
+        ''', (destination,))
+        return cursor.fetchall()
+
+    # Co-visitation methods
+    def rebuild_covisits(self, rows_per_chunk=50000, max_pending_pairs=500000):
+        """Recompute place_trip_counts and place_covisits from itinerary_items.
+
+        The items are read in chunks of whole trips (about rows_per_chunk rows
+        each) and pair counts are flushed whenever more than max_pending_pairs
+        are pending, so memory stays bounded however large the table is. The
+        triggers from migration 8 keep the counts current after this.
+        Returns the number of trips counted.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        pair_counts = Counter()
+        place_counts = Counter()
+
+        def flush():
+            cursor.executemany('''
+            INSERT INTO place_covisits (place_id, related_place_id, trips)
+            VALUES (?, ?, ?)
+            ON CONFLICT (place_id, related_place_id) DO UPDATE SET trips = trips + excluded.trips
+            ''', ((a, b, count) for (a, b), count in pair_counts.items()))
+            cursor.executemany('''
+            INSERT INTO place_trip_counts (place_id, trips)
+            VALUES (?, ?)
+            ON CONFLICT (place_id) DO UPDATE SET trips = trips + excluded.trips
+            ''', place_counts.items())
+            pair_counts.clear()
+            place_counts.clear()
+
+        trips_counted = 0
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            cursor.execute('DELETE FROM place_covisits')
+            cursor.execute('DELETE FROM place_trip_counts')
+
+            last_trip_id = -1
+            while True:
+                # The trip at row rows_per_chunk bounds this chunk, so trips are never split
+                cursor.execute('''
+                SELECT trip_id FROM itinerary_items
+                WHERE trip_id > ?
+                ORDER BY trip_id
+                LIMIT 1 OFFSET ?
+                ''', (last_trip_id, rows_per_chunk - 1))
+                bound = cursor.fetchone()
+                if bound is None:
+                    cursor.execute('''
+                    SELECT trip_id, place_id FROM itinerary_items
+                    WHERE trip_id > ?
+                    ORDER BY trip_id
+                    ''', (last_trip_id,))
+                else:
+                    cursor.execute('''
+                    SELECT trip_id, place_id FROM itinerary_items
+                    WHERE trip_id > ? AND trip_id <= ?
+                    ORDER BY trip_id
+                    ''', (last_trip_id, bound[0]))
+
+                trips = {}
+                for trip_id, place_id in cursor.fetchall():
+                    trips.setdefault(trip_id, set()).add(place_id)
+                if not trips:
+                    break
+
+                for place_ids in trips.values():
+                    place_counts.update(place_ids)
+                    pair_counts.update(permutations(place_ids, 2))
+                trips_counted += len(trips)
+                last_trip_id = max(trips)
+
+                if len(pair_counts) > max_pending_pairs:
+                    flush()
+                if bound is None:
+                    break
+
+            flush()
+            cursor.execute('''
+            INSERT OR REPLACE INTO app_meta (key, value) VALUES (?, ?)
+            ''', (COVISITS_MARKER, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+            conn.commit()
+            return trips_counted
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+    def get_place_trip_counts(self, place_ids):
+        """Get how many trips include each of the given places."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        counts = {}
+        for chunk in _chunks(list(place_ids)):
+            placeholders = ','.join(['?'] * len(chunk))
+            cursor.execute(f'''
+            SELECT place_id, trips FROM place_trip_counts
+            WHERE place_id IN ({placeholders})
+            ''', chunk)
+            counts.update((row['place_id'], row['trips']) for row in cursor.fetchall())
+        return counts
+
+    def get_covisited_places(self, place_ids, min_trips=1):
+        """Get the places that share trips with any of the given places.
+
+        Each row has the seed place_id, the related place's id, name and
+        place_type, the number of shared trips, and the related place's own
+        trip count.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        rows = []
+        for chunk in _chunks(list(place_ids)):
+            placeholders = ','.join(['?'] * len(chunk))
+            cursor.execute(f'''
+            SELECT c.place_id, c.related_place_id, c.trips, n.trips AS related_trips,
+                   p.name, p.place_type
+            FROM place_covisits c
+            JOIN place_trip_counts n ON n.place_id = c.related_place_id
+            JOIN places p ON p.id = c.related_place_id
+            WHERE c.place_id IN ({placeholders})
+            AND c.trips >= ?
+            ''', chunk + [min_trips])
+            rows.extend(cursor.fetchall())
+        return rows
+
+    # Similar-traveler methods
+    def get_user_ids(self, after_id=0, limit=1000):
+        """Get up to limit user IDs greater than after_id, in order."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT id FROM users WHERE id > ? ORDER BY id LIMIT ?
+        ''', (after_id, limit))
+        return [row['id'] for row in cursor.fetchall()]
+
+    def get_user_features(self, user_ids):
+        """Get each user's visited places and preferences as a set of string tokens."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        features = {user_id: set() for user_id in user_ids}
+        for chunk in _chunks(list(user_ids)):
+            placeholders = ','.join(['?'] * len(chunk))
+            cursor.execute(f'''
+            SELECT DISTINCT t.user_id, i.place_id
+            FROM trips t
+            JOIN itinerary_items i ON i.trip_id = t.id
+            WHERE t.user_id IN ({placeholders})
+            ''', chunk)
+            for row in cursor.fetchall():
+                features[row['user_id']].add(f"place:{row['place_id']}")
+
+            cursor.execute(f'''
+            SELECT user_id, preference_type, preference_value
+            FROM user_preferences
+            WHERE user_id IN ({placeholders})
+            ''', chunk)
+            for row in cursor.fetchall():
+                features[row['user_id']].add(f"{row['preference_type']}:{row['preference_value'].lower()}")
+        return features
+
+    def save_user_signatures(self, signatures):
+        """Replace the MinHash signature and LSH buckets of each user in one transaction.
+
+        signatures maps user_id to (signature_blob, [(band, bucket), ...]); a
+        value of None removes the user from the index.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            conn.execute('BEGIN')
+            for user_id, entry in signatures.items():
+                cursor.execute('DELETE FROM user_lsh_buckets WHERE user_id = ?', (user_id,))
+                if entry is None:
+                    cursor.execute('DELETE FROM user_minhash WHERE user_id = ?', (user_id,))
+                    continue
+                signature, buckets = entry
+                cursor.execute('''
+                INSERT OR REPLACE INTO user_minhash (user_id, signature, updated_at)
+                VALUES (?, ?, ?)
+                ''', (user_id, signature, now))
+                cursor.executemany('''
+                INSERT OR IGNORE INTO user_lsh_buckets (band, bucket, user_id)
+                VALUES (?, ?, ?)
+                ''', [(band, bucket, user_id) for band, bucket in buckets])
+            conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+    def get_user_signatures(self, user_ids):
+        """Get the stored MinHash signature blob of each user that has one."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        signatures = {}
+        for chunk in _chunks(list(user_ids)):
+            placeholders = ','.join(['?'] * len(chunk))
+            cursor.execute(f'''
+            SELECT user_id, signature FROM user_minhash
+            WHERE user_id IN ({placeholders})
+            ''', chunk)
+            signatures.update((row['user_id'], row['signature']) for row in cursor.fetchall())
+        return signatures
+
+    def get_lsh_candidates(self, buckets, exclude_user_id=None):
+        """Get the IDs of users that share at least one (band, bucket) pair."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        candidates = set()
+        for band, bucket in buckets:
+            cursor.execute('''
+            SELECT user_id FROM user_lsh_buckets
+            WHERE band = ? AND bucket = ? AND user_id IS NOT ?
+            ''', (band, bucket, exclude_user_id))
+            candidates.update(row['user_id'] for row in cursor.fetchall())
+        return candidates
+
+    def get_travelers_trips(self, user_ids, destination=None, start_date=None, end_date=None):
+        """Get the trips of the given users, optionally to a destination and overlapping a date range.
+
+        Rows carry the trip's id, destination and dates plus the traveler's
+        user_id, name and profile_image.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        conditions = []
+        params = []
+        if destination:
+            conditions.append('lower(trim(t.destination)) = lower(trim(?))')
+            params.append(destination)
+        if start_date:
+            conditions.append('t.end_date >= ?')
+            params.append(start_date)
+        if end_date:
+            conditions.append('t.start_date <= ?')
+            params.append(end_date)
+        where = ''.join(f' AND {condition}' for condition in conditions)
+
+        trips = []
+        for chunk in _chunks(list(user_ids)):
+            placeholders = ','.join(['?'] * len(chunk))
+            cursor.execute(f'''
+            SELECT t.id, t.destination, t.start_date, t.end_date,
+                   u.id AS user_id, u.name, u.profile_image
+            FROM trips t
+            JOIN users u ON u.id = t.user_id
+            WHERE t.user_id IN ({placeholders}){where}
+            ORDER BY t.start_date
+            ''', chunk + params)
+            trips.extend(cursor.fetchall())
+        return trips
+
+    # Geocoding cache methods
+    def get_cached_geocode(self, address_key):
+        """Get a cached geocoding result by normalized address."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM geocode_cache WHERE address_key = ?', (address_key,))
+        return cursor.fetchone()
+
+    def cache_geocode(self, address_key, address, latitude, longitude, found):
+        """Store a geocoding result, including lookups that found nothing."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        cursor.execute('''
+        INSERT OR REPLACE INTO geocode_cache (address_key, address, latitude, longitude, found, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', (address_key, address, latitude, longitude, found, now))
+        conn.commit()
+        return True
+
     # Helper methods for profile page
     def get_user_profile_data(self, user_id):
         """Get all data needed for the user profile page."""
@@ -696,13 +1079,24 @@ class Database:
         return profile_data
 
     # Helper methods for map view
-    def get_trip_map_data(self, trip_id):
-        """Get all data needed for the map view."""
-        trip = self.get_trip_by_id(trip_id)
+    def get_trip_map_data(self, trip_id, trip=None):
+        """Get all data needed for the map view.
+
+        Cached by trip ID and version like generate_markdown_itinerary, but
+        only for MAP_DATA_CACHE_TTL seconds because the visitors lists depend
+        on other travelers' trips. The returned dict is shared; don't mutate it.
+        """
+        trip = trip or self.get_trip_by_id(trip_id)
         if not trip:
             return None
+
+        cache_key = ('map_data', trip['id'], trip['version'])
+        map_data = self.render_cache.get(cache_key)
+        if map_data is not None:
+            return map_data
         
         itinerary = self.get_trip_itinerary(trip_id)
+        colocations = self.get_trip_colocations(trip_id)
         
         # Format the data for the template
         map_data = {
@@ -726,82 +1120,245 @@ class Database:
                     'description': item['notes'] or '',
                     'rating': item['rating'],
                     'image': item['image_url'] or '/placeholder.svg?height=200&width=300',
-                    'visitors': []  # This would need to be populated from another source
+                    'visitors': colocations.get(item['id'], [])
                 }
                 day_data['places'].append(place_data)
             
             map_data['days'].append(day_data)
-            print(map_data)
+
+        self.render_cache.set(cache_key, map_data, ttl=MAP_DATA_CACHE_TTL)
         return map_data
 
     # Helper methods for dynamic planning
     def get_place_suggestions(self, latitude, longitude, radius_km=5, limit=10, exclude_place_ids=None):
-        """Get place suggestions for dynamic planning."""
+        """Get the nearest places within radius_km, with details, for dynamic planning."""
         conn = self.get_connection()
         cursor = conn.cursor()
-        
-        # Simple distance calculation (not accurate for large distances)
-        # For production, use a proper geospatial database or API
-        lat_range = radius_km / 111.0  # 1 degree latitude is approximately 111 km
-        lon_range = radius_km / (111.0 * cos(radians(latitude)))
-        
-        query = '''
-        SELECT * FROM places
-        WHERE latitude BETWEEN ? AND ?
-        AND longitude BETWEEN ? AND ?
-        '''
-        
-        params = [
-            latitude - lat_range, latitude + lat_range,
-            longitude - lon_range, longitude + lon_range
-        ]
-        
-        if exclude_place_ids:
-            placeholders = ','.join(['?'] * len(exclude_place_ids))
-            query += f' AND id NOT IN ({placeholders})'
-            params.extend(exclude_place_ids)
-        
-        query += ' LIMIT ?'
-        params.append(limit)
-        
-        cursor.execute(query, params)
-        places = cursor.fetchall()
-        
+
+        places = self.find_nearest_places(
+            latitude, longitude, k=limit,
+            max_radius_km=radius_km,
+            exclude_place_ids=exclude_place_ids
+        )
+
         # Enhance places with details
-        result = []
+        details = self._get_place_details(cursor, [place['id'] for place in places])
         for place in places:
-            place_dict = dict(place)
-            
-            # Get place details
+            place.update(details.get(place['id'], {}))
+
+        return places
+
+    def find_nearest_places(self, latitude, longitude, k=10, initial_radius_km=1.0,
+                            max_radius_km=50.0, exclude_place_ids=None):
+        """Get the k places closest to a point, nearest first.
+
+        Searches the places_rtree index in a box around the point, doubling the
+        radius until k places lie within it or max_radius_km is reached, and
+        ranks candidates by haversine distance (added as 'distance_km').
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        exclude = set(exclude_place_ids or ())
+
+        radius_km = min(initial_radius_km, max_radius_km)
+        while True:
+            within = []
+            for row in self._places_in_box(cursor, *bounding_box(latitude, longitude, radius_km)):
+                if row['id'] in exclude:
+                    continue
+                distance = haversine_km(latitude, longitude, row['latitude'], row['longitude'])
+                if distance <= radius_km:
+                    within.append((distance, row))
+
+            if len(within) >= k or radius_km >= max_radius_km:
+                break
+            radius_km = min(radius_km * 2, max_radius_km)
+
+        places = []
+        for distance, row in heapq.nsmallest(k, within, key=lambda candidate: candidate[0]):
+            place = dict(row)
+            place['distance_km'] = round(distance, 3)
+            places.append(place)
+        return places
+
+    def _places_in_box(self, cursor, min_lat, max_lat, min_lng, max_lng):
+        """Get places inside a bounding box using the R*Tree index."""
+        # Split boxes that cross the antimeridian
+        if min_lng < -180.0:
+            ranges = [(min_lng + 360.0, 180.0), (-180.0, max_lng)]
+        elif max_lng > 180.0:
+            ranges = [(min_lng, 180.0), (-180.0, max_lng - 360.0)]
+        else:
+            ranges = [(min_lng, max_lng)]
+
+        rows = []
+        for range_min_lng, range_max_lng in ranges:
             cursor.execute('''
-            SELECT detail_type, detail_value
-            FROM place_details
-            WHERE place_id = ?
-            ''', (place['id'],))
-            
-            details = {}
+            SELECT p.*
+            FROM places_rtree r
+            JOIN places p ON p.id = r.id
+            WHERE r.max_lat >= ? AND r.min_lat <= ?
+            AND r.max_lng >= ? AND r.min_lng <= ?
+            ''', (min_lat, max_lat, range_min_lng, range_max_lng))
+            rows.extend(cursor.fetchall())
+        return rows
+
+    def get_place_by_name(self, name):
+        """Get the first place with a given name."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM places WHERE name = ? ORDER BY id LIMIT 1', (name,))
+        return cursor.fetchone()
+
+    def get_place_visitors(self, place_ids, exclude_user_id=None, limit=50):
+        """Get users with itinerary items at any of the given places."""
+        place_ids = list(place_ids)
+        if not place_ids:
+            return []
+
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        placeholders = ','.join(['?'] * len(place_ids))
+        cursor.execute(f'''
+        SELECT u.id, u.name, u.profile_image, i.place_id, p.name AS place_name,
+               i.start_time, i.end_time
+        FROM itinerary_items i
+        JOIN trips t ON t.id = i.trip_id
+        JOIN users u ON u.id = t.user_id
+        JOIN places p ON p.id = i.place_id
+        WHERE i.place_id IN ({placeholders})
+        AND u.id IS NOT ?
+        ORDER BY t.start_date, i.day, i.start_time
+        ''', (*place_ids, exclude_user_id))
+
+        # One entry per user and place
+        visitors = []
+        seen = set()
+        for row in cursor.fetchall():
+            key = (row['id'], row['place_id'])
+            if key in seen:
+                continue
+            seen.add(key)
+            visitors.append(dict(row))
+            if len(visitors) >= limit:
+                break
+        return visitors
+
+    def get_trip_colocations(self, trip_id, nearby_radius_km=0.25, limit_per_item=20):
+        """Find other travelers at the same or a nearby place at overlapping times.
+
+        For every item of the trip, matches other users' itinerary items at the
+        item's place, or a place within nearby_radius_km, on the same visit_date
+        whose start/end times overlap (touching intervals count). Lookups go
+        through idx_itinerary_items_place_date, so each window is a range scan
+        over one place and date.
+
+        Times are compared as text, so only items whose start and end are
+        zero-padded 'HH:MM' (as stored by store_json_itinerary and
+        add_itinerary_item) take part; older free-form times are skipped.
+
+        Returns {itinerary_item_id: [visitor, ...]}, nearest place first.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+        SELECT i.id, i.place_id, i.visit_date, i.start_time, i.end_time,
+               t.user_id, p.latitude, p.longitude
+        FROM itinerary_items i
+        JOIN trips t ON t.id = i.trip_id
+        JOIN places p ON p.id = i.place_id
+        WHERE i.trip_id = ? AND i.visit_date IS NOT NULL
+        ''', (trip_id,))
+        items = cursor.fetchall()
+        if not items:
+            return {}
+        owner_id = items[0]['user_id']
+
+        # Places within walking distance of each place on the trip
+        nearby = {}
+        for item in items:
+            if item['place_id'] not in nearby:
+                nearby[item['place_id']] = [
+                    (place['id'], place['distance_km'])
+                    for place in self.find_nearest_places(
+                        item['latitude'], item['longitude'], k=limit_per_item,
+                        initial_radius_km=nearby_radius_km, max_radius_km=nearby_radius_km
+                    )
+                ] or [(item['place_id'], 0.0)]
+
+        windows = [
+            (item['id'], place_id, distance_km, item['visit_date'],
+             item['start_time'], item['end_time'])
+            for item in items
+            if _is_clock_time(item['start_time']) and _is_clock_time(item['end_time'])
+            for place_id, distance_km in nearby[item['place_id']]
+        ]
+
+        colocations = {}
+        seen = set()
+        # Each window binds 6 parameters, plus the trip and owner IDs
+        for chunk in _chunks(windows, size=(SQLITE_MAX_VARIABLES - 2) // 6):
+            values = ','.join(['(?, ?, ?, ?, ?, ?)'] * len(chunk))
+            cursor.execute(f'''
+            WITH windows (item_id, place_id, distance_km, visit_date, start_time, end_time) AS (
+                VALUES {values}
+            )
+            SELECT w.item_id, w.distance_km, u.id, u.name, u.profile_image,
+                   p.name AS place_name, i.start_time, i.end_time
+            FROM windows w
+            JOIN itinerary_items i
+                ON i.place_id = w.place_id
+                AND i.visit_date = w.visit_date
+                AND i.start_time <= w.end_time
+                AND i.end_time >= w.start_time
+                AND i.start_time GLOB '[0-2][0-9]:[0-5][0-9]'
+                AND i.end_time GLOB '[0-2][0-9]:[0-5][0-9]'
+            JOIN trips t ON t.id = i.trip_id
+            JOIN users u ON u.id = t.user_id
+            JOIN places p ON p.id = i.place_id
+            WHERE i.trip_id != ? AND u.id IS NOT ?
+            ORDER BY w.item_id, w.distance_km, i.start_time
+            ''', [value for window in chunk for value in window] + [trip_id, owner_id])
+
             for row in cursor.fetchall():
-                detail_type = row['detail_type']
-                detail_value = row['detail_value']
-                
-                if detail_type not in details:
-                    details[detail_type] = []
-                
-                details[detail_type].append(detail_value)
-            
-            place_dict.update(details)
-            result.append(place_dict)
-        
-        return result
+                key = (row['item_id'], row['id'])
+                visitors = colocations.setdefault(row['item_id'], [])
+                if key in seen or len(visitors) >= limit_per_item:
+                    continue
+                seen.add(key)
+                visitors.append({
+                    'id': row['id'],
+                    'name': row['name'],
+                    'profile_image': row['profile_image'],
+                    'visiting': row['place_name'],
+                    'distance_km': row['distance_km'],
+                    'start_time': row['start_time'],
+                    'end_time': row['end_time']
+                })
+
+        return colocations
 
     # Helper methods for itinerary generation
-    def generate_markdown_itinerary(self, trip_id):
-        """Generate a markdown itinerary for a trip."""
-        trip = self.get_trip_by_id(trip_id)
+    def generate_markdown_itinerary(self, trip_id, trip=None):
+        """Generate a markdown itinerary for a trip.
+
+        Results are cached by trip ID and version, so repeat views only cost
+        the trip lookup (skipped too when the caller passes the trip row).
+        """
+        trip = trip or self.get_trip_by_id(trip_id)
         if not trip:
             return None
+
+        cache_key = ('markdown', trip['id'], trip['version'])
+        md_content = self.render_cache.get(cache_key)
+        if md_content is not None:
+            return md_content
         
         itinerary = self.get_trip_itinerary(trip_id)
+        places = self.get_places_by_ids(
+            item['place_id'] for items in itinerary.values() for item in items
+        )
         
         # Build the markdown content
         md_content = f"# {trip['title']} Itinerary\n\n"
@@ -822,7 +1379,7 @@ class Database:
                     md_content += f"{item['notes']}\n\n"
                 
                 # Add place details if available
-                place = self.get_place_by_id(item['place_id'])
+                place = places.get(item['place_id'])
                 if place and place.get('description'):
                     md_content += f"{place['description']}\n\n"
                 
@@ -838,54 +1395,80 @@ class Database:
                         md_content += f"- {activity}\n"
                     md_content += "\n"
         
+        self.render_cache.set(cache_key, md_content)
         return md_content
 
     def store_json_itinerary(self, json_data, user_id=None):
-        """Store a JSON itinerary in the database."""
+        """Store a JSON itinerary in the database.
+
+        The trip, its places and its items are written in a single transaction,
+        so a failure leaves nothing behind. Returns the trip ID, or None.
+        """
+        conn = self.get_connection()
+        started = time.perf_counter()
         try:
             trip = json_data.get('trip', {})
             destination = trip.get('destination', 'Unknown')
             dates = trip.get('dates', {})
             start_date = dates.get('start')
             end_date = dates.get('end')
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-            # Create trip in database
-            trip_id = self.create_trip(
-                user_id=user_id,
-                title=f"Trip to {destination}",
-                destination=destination,
-                start_date=start_date,
-                end_date=end_date,
-                status='upcoming'
-            )
+            conn.execute('BEGIN')
+            cursor = conn.cursor()
 
-            # Store itinerary items
+            # Create trip in database
+            cursor.execute('''
+            INSERT INTO trips (user_id, title, destination, start_date, end_date, status, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, f"Trip to {destination}", destination, start_date, end_date, 'upcoming', now, now))
+            trip_id = cursor.lastrowid
+
+            # Create or get each distinct place once, then insert all items together
+            place_ids = {}
+            items = []
             for day in trip.get('itinerary', []):
                 day_num = day['day']
-                for activity in day.get('activities', []):
-                    # Create or get place
-                    place_data = {
-                        'name': activity['place'],
-                        'description': activity['description'],
-                        'latitude': activity.get('latitude', 0.0),
-                        'longitude': activity.get('longitude', 0.0),
-                        'address': activity.get('address', '')
-                    }
-                    place_id = self.create_place(**place_data)
-
-                    # Add itinerary item
-                    self.add_itinerary_item(
-                        trip_id=trip_id,
-                        place_id=place_id,
-                        day=day_num,
-                        start_time=activity['time'],
-                        end_time=activity['time'],  # You would calculate this from expected_time
-                        notes=activity['description'],
-                        order_index=day_num
+                for position, activity in enumerate(day.get('activities', []), start=1):
+                    latitude = activity.get('latitude', 0.0)
+                    longitude = activity.get('longitude', 0.0)
+                    key = (latitude, longitude, activity['place'])
+                    if key not in place_ids:
+                        place_ids[key] = self._upsert_place(
+                            cursor,
+                            name=activity['place'],
+                            description=activity['description'],
+                            latitude=latitude,
+                            longitude=longitude,
+                            address=activity.get('address', '')
+                        )
+
+                    # Zero-padded HH:MM so times compare correctly; keep the raw text if unreadable
+                    start_time, end_time = parse_time_range(
+                        activity.get('time'), parse_duration_minutes(activity.get('expected_time'))
                     )
+                    items.append((
+                        trip_id,
+                        place_ids[key],
+                        day_num,
+                        start_time or activity.get('time', ''),
+                        end_time or activity.get('time', ''),
+                        activity['description'],
+                        position
+                    ))
+
+            cursor.executemany('''
+            INSERT INTO itinerary_items (trip_id, place_id, day, start_time, end_time, notes, order_index)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', items)
+            conn.commit()
 
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            print(f"Stored trip {trip_id}: {len(place_ids)} places, {len(items)} items in {elapsed_ms:.1f} ms")
             return trip_id
         except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
             print(f"Error storing itinerary: {str(e)}")
             return None
 
@@ -933,3 +1516,113 @@ class Database:
         conn.commit()
         return cursor.rowcount > 0
 
+    # Finalize job methods
+    def create_finalize_job(self, user_id, itinerary_text):
+        """Create a queued finalize job and return its ID."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        import uuid
+        job_id = uuid.uuid4().hex
+
+        cursor.execute('''
+        INSERT INTO finalize_jobs (id, user_id, status, stage, itinerary_text, created_at, updated_at)
+        VALUES (?, ?, 'queued', 'queued', ?, ?, ?)
+        ''', (job_id, user_id, itinerary_text, now, now))
+        conn.commit()
+        return job_id
+
+    def get_finalize_job(self, job_id):
+        """Get a finalize job by ID."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM finalize_jobs WHERE id = ?', (job_id,))
+        return cursor.fetchone()
+
+    def claim_finalize_job(self, job_id):
+        """Mark a queued job as running. Returns False if another worker claimed it."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        cursor.execute('''
+        UPDATE finalize_jobs
+        SET status = 'running', updated_at = ?
+        WHERE id = ? AND status = 'queued'
+        ''', (now, job_id))
+        conn.commit()
+        return cursor.rowcount > 0
+
+    def update_finalize_job(self, job_id, **kwargs):
+        """Update the status, stage or progress of a finalize job."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        kwargs['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        set_clause = ', '.join([f"{key} = ?" for key in kwargs.keys()])
+        values = list(kwargs.values())
+        values.append(job_id)
+
+        cursor.execute(f'''
+        UPDATE finalize_jobs
+        SET {set_clause}
+        WHERE id = ?
+        ''', values)
+        conn.commit()
+        return cursor.rowcount > 0
+
+    def requeue_stale_finalize_jobs(self, stale_seconds, job_id=None):
+        """Requeue running jobs that stopped reporting progress and return their IDs.
+
+        Live workers touch updated_at on a heartbeat, so only jobs whose worker
+        died go stale. Pass job_id to only check that one job.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        now = datetime.now()
+        cutoff = (now - timedelta(seconds=stale_seconds)).strftime('%Y-%m-%d %H:%M:%S')
+
+        if job_id is None:
+            cursor.execute('''
+            SELECT id FROM finalize_jobs
+            WHERE status = 'running' AND updated_at < ?
+            ORDER BY created_at
+            ''', (cutoff,))
+            job_ids = [row['id'] for row in cursor.fetchall()]
+        else:
+            job_ids = [job_id]
+
+        requeued = []
+        for stale_id in job_ids:
+            # Conditional, so a job requeued by a concurrent poll is not returned twice
+            cursor.execute('''
+            UPDATE finalize_jobs
+            SET status = 'queued', stage = 'queued', activities_geocoded = 0, updated_at = ?
+            WHERE id = ? AND status = 'running' AND updated_at < ?
+            ''', (now.strftime('%Y-%m-%d %H:%M:%S'), stale_id, cutoff))
+            if cursor.rowcount:
+                requeued.append(stale_id)
+        conn.commit()
+        return requeued
+
+    def get_queued_finalize_job_ids(self):
+        """Get the IDs of queued finalize jobs, oldest first."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT id FROM finalize_jobs
+        WHERE status = 'queued'
+        ORDER BY created_at
+        ''')
+        return [row['id'] for row in cursor.fetchall()]
+
+if __name__ == '__main__':
+    db = Database()
+    print(f"Schema version: {db.get_schema_version()}")
+    print(f"Journal mode: {db.get_connection().execute('PRAGMA journal_mode').fetchone()[0]}")
+    for name, plan in db.explain_hot_queries().items():
+        print(f"\n{name}:")
+        for detail in plan:
+            print(f"  {detail}")
+    print(f"\nConnection pool: {db.pool_stats()}")
@@ -129,18 +129,54 @@ def generate_itinerary(places, date):
     
     return itinerary
 
-def create_dummy_data(cursor):
-    """Initialize database with dummy data for testing."""
-    
-    # Insert places
+SEED_MARKER = 'dummy_data_seeded_at'
+
+TRAVEL_STYLES = [
+    "Cultural", "Adventure", "Photography", "Food",
+    "History", "Art", "Architecture", "Nature"
+]
+
+def is_seeded(conn):
+    """Return True if the dummy data has already been loaded."""
+    row = conn.execute('SELECT value FROM app_meta WHERE key = ?', (SEED_MARKER,)).fetchone()
+    return row is not None
+
+def generate_users(count):
+    """Generate random users with unique emails."""
+    users = []
+    seen = set()
+    joined_date = datetime.now().strftime("%Y-%m-%d")
+    dummy_password = "pbkdf2:sha256:150000$dummy"  # Dummy hash
+
+    while len(users) < count:
+        first_name = names.get_first_name()
+        last_name = names.get_last_name()
+        email = f"{first_name.lower()}.{last_name.lower()}@example.com"
+        if email in seen:
+            email = f"{first_name.lower()}.{last_name.lower()}{len(users)}@example.com"
+        seen.add(email)
+        users.append((f"{first_name} {last_name}", email, dummy_password, joined_date))
+
+    return users
+
+def create_dummy_data(conn, num_users=100, check_images=False, force=False):
+    """Load places, users, trips and itineraries for testing.
+
+    Runs in a single transaction and records a seed marker in app_meta, so
+    calling it again is a no-op unless force is set. Image URLs are only
+    checked over the network when check_images is set.
+
+    Returns True if data was loaded.
+    """
+    if is_seeded(conn) and not force:
+        return False
+
+    places = []
     for place in NYC_PLACES:
         image_url = place.get("image_url")
-        if not image_url or not is_image_url_valid(image_url):
+        if not image_url or (check_images and not is_image_url_valid(image_url)):
             image_url = DEFAULT_IMAGE_URL
-        cursor.execute("""
-            INSERT OR IGNORE INTO places (name, description, latitude, longitude, image_url, address, place_type)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (
+        places.append((
             place["name"],
             place["description"],
             place["lat"],
@@ -149,66 +185,110 @@ def create_dummy_data(cursor):
             place["address"],
             place["category"]
         ))
-    
-    # Generate 100 users with trips and itineraries for the next three days in NYC
-    for _ in range(100):
-        first_name = names.get_first_name()
-        last_name = names.get_last_name()
-        email = f"{first_name.lower()}.{last_name.lower()}@example.com"
-        full_name = f"{first_name} {last_name}"
-        joined_date = datetime.now().strftime("%Y-%m-%d")
-        dummy_password = "pbkdf2:sha256:150000$dummy"  # Dummy hash
-        
-        cursor.execute("""
-            INSERT INTO users (name, email, password_hash, joined_date)
-            VALUES (?, ?, ?, ?)
-        """, (full_name, email, dummy_password, joined_date))
-        user_id = cursor.lastrowid
-        
-        # Assign 2-4 random preferences
-        preferences = random.sample([
-            "Cultural", "Adventure", "Photography", "Food",
-            "History", "Art", "Architecture", "Nature"
-        ], random.randint(2, 4))
-        for pref in preferences:
+
+    users = generate_users(num_users)
+    now = datetime.now()
+    start_date = (now + timedelta(days=1)).strftime("%Y-%m-%d")
+    end_date = (now + timedelta(days=3)).strftime("%Y-%m-%d")
+    now_str = now.strftime("%Y-%m-%d %H:%M:%S")
+
+    try:
+        conn.execute('BEGIN')
+        cursor = conn.cursor()
+
+        cursor.executemany("""
+            INSERT OR IGNORE INTO places (name, description, latitude, longitude, image_url, address, place_type)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, places)
+
+        place_ids = {}
+        for place in NYC_PLACES:
             cursor.execute("""
-                INSERT INTO user_preferences (user_id, preference_type, preference_value)
-                VALUES (?, ?, ?)
-            """, (user_id, "travel_style", pref))
-        
-        # Create one trip per user spanning the next three days
-        now = datetime.now()
-        start_date = (now + timedelta(days=1)).strftime("%Y-%m-%d")
-        end_date = (now + timedelta(days=3)).strftime("%Y-%m-%d")
-        now_str = now.strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute("""
+                SELECT id FROM places WHERE latitude = ? AND longitude = ? AND name = ?
+            """, (place["lat"], place["lng"], place["name"]))
+            place_ids[place["name"]] = cursor.fetchone()[0]
+
+        # Rows added below are picked up by id, since executemany has no lastrowid
+        last_user_id = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0]
+        last_trip_id = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM trips").fetchone()[0]
+
+        cursor.executemany("""
+            INSERT OR IGNORE INTO users (name, email, password_hash, joined_date)
+            VALUES (?, ?, ?, ?)
+        """, users)
+        new_users = cursor.execute(
+            "SELECT id, name FROM users WHERE id > ? ORDER BY id", (last_user_id,)
+        ).fetchall()
+
+        # Assign 2-4 random preferences and one trip spanning the next three days
+        preferences = []
+        trips = []
+        for user_id, full_name in new_users:
+            for pref in random.sample(TRAVEL_STYLES, random.randint(2, 4)):
+                preferences.append((user_id, "travel_style", pref))
+            trips.append((user_id, f"NYC Trip by {full_name}", "New York",
+                          start_date, end_date, "upcoming", now_str, now_str))
+
+        cursor.executemany("""
+            INSERT INTO user_preferences (user_id, preference_type, preference_value)
+            VALUES (?, ?, ?)
+        """, preferences)
+        cursor.executemany("""
             INSERT INTO trips (user_id, title, destination, start_date, end_date, status, created_at, updated_at)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (user_id, f"NYC Trip by {full_name}", "New York", start_date, end_date, "upcoming", now_str, now_str))
-        trip_id = cursor.lastrowid
-        
+        """, trips)
+        new_trips = cursor.execute(
+            "SELECT id FROM trips WHERE id > ? ORDER BY id", (last_trip_id,)
+        ).fetchall()
+
         # For each of the three days, generate itinerary items
-        for day_offset in range(3):
-            trip_date = now + timedelta(days=1+day_offset)
-            itinerary = generate_itinerary(NYC_PLACES, trip_date)
-            for i, item in enumerate(itinerary):
-                # Retrieve the place id based on the name
-                cursor.execute("SELECT id FROM places WHERE name = ?", (item["place"]["name"],))
-                row = cursor.fetchone()
-                if row:
-                    place_id = row["id"]
-                    cursor.execute("""
-                        INSERT INTO itinerary_items (trip_id, place_id, day, start_time, end_time, notes, order_index)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    """, (
+        items = []
+        for (trip_id,) in new_trips:
+            for day_offset in range(3):
+                trip_date = now + timedelta(days=1+day_offset)
+                itinerary = generate_itinerary(NYC_PLACES, trip_date)
+                for i, item in enumerate(itinerary):
+                    items.append((
                         trip_id,
-                        place_id,
+                        place_ids[item["place"]["name"]],
                         day_offset + 1,
                         item["start_time"],
                         item["end_time"],
                         f"Visit {item['place']['name']}",
                         i + 1
                     ))
-    
-    cursor.connection.commit()
-    print("Successfully initialized database with dummy data")
+
+        cursor.executemany("""
+            INSERT INTO itinerary_items (trip_id, place_id, day, start_time, end_time, notes, order_index)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, items)
+
+        cursor.execute("""
+            INSERT OR REPLACE INTO app_meta (key, value) VALUES (?, ?)
+        """, (SEED_MARKER, now_str))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return True
+
+if __name__ == '__main__':
+    import argparse
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Seed the database with dummy data.")
+    parser.add_argument('--db', default='musafir.db', help="Path to the SQLite database")
+    parser.add_argument('--users', type=int, default=100, help="Number of random users to create")
+    parser.add_argument('--check-images', action='store_true',
+                        help="Check place image URLs over the network")
+    parser.add_argument('--force', action='store_true',
+                        help="Load the data even if the database was already seeded")
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    if create_dummy_data(db.get_connection(), num_users=args.users,
+                         check_images=args.check_images, force=args.force):
+        print("Successfully initialized database with dummy data")
+    else:
+        print("Database already seeded; use --force to load the dummy data again")
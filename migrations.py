@@ -0,0 +1,581 @@
+import sqlite3
+from datetime import datetime
+
+# Ordered schema migrations. Each entry is (version, description, statements).
+# Append new migrations at the end; never edit one that has been released.
+MIGRATIONS = [
+    (1, 'Initial schema', [
+        # Users table
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password_hash TEXT,
+            google_id TEXT UNIQUE,
+            profile_image TEXT,
+            joined_date TEXT NOT NULL,
+            is_active BOOLEAN DEFAULT 1
+        )
+        ''',
+        # User preferences table
+        '''
+        CREATE TABLE IF NOT EXISTS user_preferences (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            preference_type TEXT NOT NULL,
+            preference_value TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            UNIQUE(user_id, preference_type, preference_value)
+        )
+        ''',
+        # Trips table
+        '''
+        CREATE TABLE IF NOT EXISTS trips (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            destination TEXT NOT NULL,
+            start_date TEXT NOT NULL,
+            end_date TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        # Places table
+        '''
+        CREATE TABLE IF NOT EXISTS places (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            image_url TEXT,
+            rating REAL,
+            address TEXT,
+            place_type TEXT,
+            external_id TEXT,
+            UNIQUE(latitude, longitude, name)
+        )
+        ''',
+        # Place details table (for additional data like highlights, activities)
+        '''
+        CREATE TABLE IF NOT EXISTS place_details (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            place_id INTEGER NOT NULL,
+            detail_type TEXT NOT NULL,
+            detail_value TEXT NOT NULL,
+            FOREIGN KEY (place_id) REFERENCES places (id),
+            UNIQUE(place_id, detail_type, detail_value)
+        )
+        ''',
+        # Itinerary items table
+        '''
+        CREATE TABLE IF NOT EXISTS itinerary_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            trip_id INTEGER NOT NULL,
+            place_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            notes TEXT,
+            order_index INTEGER NOT NULL,
+            FOREIGN KEY (trip_id) REFERENCES trips (id),
+            FOREIGN KEY (place_id) REFERENCES places (id)
+        )
+        ''',
+        # Distance matrix for travel times between places
+        '''
+        CREATE TABLE IF NOT EXISTS distances (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            origin_place_id INTEGER NOT NULL,
+            destination_place_id INTEGER NOT NULL,
+            distance_km REAL NOT NULL,
+            duration_minutes INTEGER NOT NULL,
+            travel_mode TEXT NOT NULL,
+            FOREIGN KEY (origin_place_id) REFERENCES places (id),
+            FOREIGN KEY (destination_place_id) REFERENCES places (id),
+            UNIQUE(origin_place_id, destination_place_id, travel_mode)
+        )
+        ''',
+        # Chat sessions for travel planning
+        '''
+        CREATE TABLE IF NOT EXISTS chat_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            trip_id INTEGER,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (trip_id) REFERENCES trips (id)
+        )
+        ''',
+        # Chat messages
+        '''
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER NOT NULL,
+            sender TEXT NOT NULL,
+            message TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            FOREIGN KEY (session_id) REFERENCES chat_sessions (id)
+        )
+        ''',
+        # Contact requests table
+        '''
+        CREATE TABLE IF NOT EXISTS contact_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_user_id INTEGER NOT NULL,
+            to_user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            token TEXT UNIQUE NOT NULL,
+            FOREIGN KEY (from_user_id) REFERENCES users (id),
+            FOREIGN KEY (to_user_id) REFERENCES users (id),
+            UNIQUE(from_user_id, to_user_id)
+        )
+        ''',
+        # Background jobs for the finalize pipeline
+        '''
+        CREATE TABLE IF NOT EXISTS finalize_jobs (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'queued',
+            stage TEXT NOT NULL DEFAULT 'queued',
+            itinerary_text TEXT NOT NULL,
+            activities_total INTEGER NOT NULL DEFAULT 0,
+            activities_geocoded INTEGER NOT NULL DEFAULT 0,
+            trip_id INTEGER,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (trip_id) REFERENCES trips (id)
+        )
+        ''',
+        # Geocoding results keyed by normalized address
+        '''
+        CREATE TABLE IF NOT EXISTS geocode_cache (
+            address_key TEXT PRIMARY KEY,
+            address TEXT NOT NULL,
+            latitude REAL,
+            longitude REAL,
+            found BOOLEAN NOT NULL,
+            created_at TEXT NOT NULL
+        )
+        '''
+    ]),
+    (2, 'Indexes for hot queries', [
+        # get_trip_itinerary: itinerary items by trip, ordered by day and order_index
+        '''
+        CREATE INDEX IF NOT EXISTS idx_itinerary_items_trip_day_order
+        ON itinerary_items (trip_id, day, order_index)
+        ''',
+        # get_user_trips: trips by user, ordered by start_date
+        '''
+        CREATE INDEX IF NOT EXISTS idx_trips_user_start_date
+        ON trips (user_id, start_date)
+        ''',
+        # get_chat_messages: messages by session, ordered by timestamp
+        '''
+        CREATE INDEX IF NOT EXISTS idx_chat_messages_session_timestamp
+        ON chat_messages (session_id, timestamp)
+        ''',
+        # get_user_chat_sessions: sessions by user, ordered by updated_at
+        '''
+        CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_updated
+        ON chat_sessions (user_id, updated_at)
+        ''',
+        # Place lookups by name when seeding and matching itinerary places
+        '''
+        CREATE INDEX IF NOT EXISTS idx_places_name
+        ON places (name)
+        ''',
+        # requeue_stale_finalize_jobs: unfinished jobs by status
+        '''
+        CREATE INDEX IF NOT EXISTS idx_finalize_jobs_status_created
+        ON finalize_jobs (status, created_at)
+        '''
+    ]),
+    (3, "App metadata", [
+        # Key/value markers such as when the dummy data was seeded
+        '''
+        CREATE TABLE IF NOT EXISTS app_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        '''
+    ]),
+    (4, "Spatial index on places", [
+        # R*Tree mirror of place coordinates for bounding-box and nearest-neighbour search
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS places_rtree USING rtree(
+            id,
+            min_lat, max_lat,
+            min_lng, max_lng
+        )
+        ''',
+        '''
+        INSERT OR REPLACE INTO places_rtree (id, min_lat, max_lat, min_lng, max_lng)
+        SELECT id, latitude, latitude, longitude, longitude FROM places
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS places_rtree_insert AFTER INSERT ON places
+        BEGIN
+            INSERT OR REPLACE INTO places_rtree (id, min_lat, max_lat, min_lng, max_lng)
+            VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS places_rtree_update AFTER UPDATE OF id, latitude, longitude ON places
+        BEGIN
+            DELETE FROM places_rtree WHERE id = old.id;
+            INSERT OR REPLACE INTO places_rtree (id, min_lat, max_lat, min_lng, max_lng)
+            VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS places_rtree_delete AFTER DELETE ON places
+        BEGIN
+            DELETE FROM places_rtree WHERE id = old.id;
+        END
+        ''',
+        # Visitors of a set of places (expand_search)
+        '''
+        CREATE INDEX IF NOT EXISTS idx_itinerary_items_place
+        ON itinerary_items (place_id, trip_id)
+        '''
+    ]),
+    (5, "Itinerary visit dates for co-location", [
+        # Calendar date of each item, derived from the trip start date and day number
+        '''
+        ALTER TABLE itinerary_items ADD COLUMN visit_date TEXT
+        ''',
+        '''
+        UPDATE itinerary_items
+        SET visit_date = (
+            SELECT date(t.start_date, printf('%+d days', itinerary_items.day - 1))
+            FROM trips t WHERE t.id = itinerary_items.trip_id
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS itinerary_items_visit_date_insert
+        AFTER INSERT ON itinerary_items
+        WHEN new.visit_date IS NULL
+        BEGIN
+            UPDATE itinerary_items
+            SET visit_date = (
+                SELECT date(t.start_date, printf('%+d days', new.day - 1))
+                FROM trips t WHERE t.id = new.trip_id
+            )
+            WHERE id = new.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS itinerary_items_visit_date_update
+        AFTER UPDATE OF trip_id, day ON itinerary_items
+        BEGIN
+            UPDATE itinerary_items
+            SET visit_date = (
+                SELECT date(t.start_date, printf('%+d days', new.day - 1))
+                FROM trips t WHERE t.id = new.trip_id
+            )
+            WHERE id = new.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trips_visit_date_update
+        AFTER UPDATE OF start_date ON trips
+        BEGIN
+            UPDATE itinerary_items
+            SET visit_date = date(new.start_date, printf('%+d days', day - 1))
+            WHERE trip_id = new.id;
+        END
+        ''',
+        # Interval index: items at a place on a date, ordered by start time.
+        # Supersedes the place_id prefix of idx_itinerary_items_place.
+        '''
+        DROP INDEX IF EXISTS idx_itinerary_items_place
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_itinerary_items_place_date
+        ON itinerary_items (place_id, visit_date, start_time, end_time)
+        '''
+    ]),
+    (6, "Full-text search over places", [
+        # One row per place (rowid = places.id); details holds all place_details values
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS places_fts USING fts5(
+            name, description, address, details,
+            tokenize = 'porter unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+        ''',
+        '''
+        INSERT INTO places_fts (rowid, name, description, address, details)
+        SELECT p.id, p.name, p.description, p.address,
+               (SELECT group_concat(d.detail_value, ' ') FROM place_details d WHERE d.place_id = p.id)
+        FROM places p
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS places_fts_insert AFTER INSERT ON places
+        BEGIN
+            INSERT INTO places_fts (rowid, name, description, address, details)
+            VALUES (
+                new.id, new.name, new.description, new.address,
+                (SELECT group_concat(detail_value, ' ') FROM place_details WHERE place_id = new.id)
+            );
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS places_fts_update
+        AFTER UPDATE OF id, name, description, address ON places
+        BEGIN
+            DELETE FROM places_fts WHERE rowid = old.id;
+            INSERT INTO places_fts (rowid, name, description, address, details)
+            VALUES (
+                new.id, new.name, new.description, new.address,
+                (SELECT group_concat(detail_value, ' ') FROM place_details WHERE place_id = new.id)
+            );
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS places_fts_delete AFTER DELETE ON places
+        BEGIN
+            DELETE FROM places_fts WHERE rowid = old.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS place_details_fts_insert AFTER INSERT ON place_details
+        BEGIN
+            UPDATE places_fts
+            SET details = (SELECT group_concat(detail_value, ' ') FROM place_details WHERE place_id = new.place_id)
+            WHERE rowid = new.place_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS place_details_fts_update AFTER UPDATE ON place_details
+        BEGIN
+            UPDATE places_fts
+            SET details = (SELECT group_concat(detail_value, ' ') FROM place_details WHERE place_id = old.place_id)
+            WHERE rowid = old.place_id;
+            UPDATE places_fts
+            SET details = (SELECT group_concat(detail_value, ' ') FROM place_details WHERE place_id = new.place_id)
+            WHERE rowid = new.place_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS place_details_fts_delete AFTER DELETE ON place_details
+        BEGIN
+            UPDATE places_fts
+            SET details = (SELECT group_concat(detail_value, ' ') FROM place_details WHERE place_id = old.place_id)
+            WHERE rowid = old.place_id;
+        END
+        '''
+    ]),
+    (7, "Trip versions for render caching", [
+        # Bumped whenever a trip or its itinerary changes; part of the render cache key
+        '''
+        ALTER TABLE trips ADD COLUMN version INTEGER NOT NULL DEFAULT 1
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trips_version_update
+        AFTER UPDATE OF title, destination, start_date, end_date, status ON trips
+        BEGIN
+            UPDATE trips SET version = version + 1 WHERE id = new.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS itinerary_items_version_insert AFTER INSERT ON itinerary_items
+        BEGIN
+            UPDATE trips SET version = version + 1 WHERE id = new.trip_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS itinerary_items_version_update AFTER UPDATE ON itinerary_items
+        BEGIN
+            UPDATE trips SET version = version + 1 WHERE id IN (old.trip_id, new.trip_id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS itinerary_items_version_delete AFTER DELETE ON itinerary_items
+        BEGIN
+            UPDATE trips SET version = version + 1 WHERE id = old.trip_id;
+        END
+        '''
+    ]),
+    (8, "Place co-visitation counts", [
+        # Number of trips that include each place
+        '''
+        CREATE TABLE IF NOT EXISTS place_trip_counts (
+            place_id INTEGER PRIMARY KEY,
+            trips INTEGER NOT NULL
+        )
+        ''',
+        # Number of trips that include both places; stored in both directions
+        '''
+        CREATE TABLE IF NOT EXISTS place_covisits (
+            place_id INTEGER NOT NULL,
+            related_place_id INTEGER NOT NULL,
+            trips INTEGER NOT NULL,
+            PRIMARY KEY (place_id, related_place_id)
+        ) WITHOUT ROWID
+        ''',
+        # A place joins a trip when its first item for that trip is inserted
+        '''
+        CREATE TRIGGER IF NOT EXISTS itinerary_items_covisits_insert AFTER INSERT ON itinerary_items
+        WHEN NOT EXISTS (
+            SELECT 1 FROM itinerary_items
+            WHERE trip_id = new.trip_id AND place_id = new.place_id AND id <> new.id
+        )
+        BEGIN
+            INSERT INTO place_trip_counts (place_id, trips) VALUES (new.place_id, 1)
+            ON CONFLICT (place_id) DO UPDATE SET trips = trips + 1;
+            INSERT INTO place_covisits (place_id, related_place_id, trips)
+            SELECT DISTINCT new.place_id, place_id, 1 FROM itinerary_items
+            WHERE trip_id = new.trip_id AND place_id <> new.place_id
+            ON CONFLICT (place_id, related_place_id) DO UPDATE SET trips = trips + 1;
+            INSERT INTO place_covisits (place_id, related_place_id, trips)
+            SELECT DISTINCT place_id, new.place_id, 1 FROM itinerary_items
+            WHERE trip_id = new.trip_id AND place_id <> new.place_id
+            ON CONFLICT (place_id, related_place_id) DO UPDATE SET trips = trips + 1;
+        END
+        ''',
+        # ...and leaves it when its last item for that trip is deleted
+        '''
+        CREATE TRIGGER IF NOT EXISTS itinerary_items_covisits_delete AFTER DELETE ON itinerary_items
+        WHEN NOT EXISTS (
+            SELECT 1 FROM itinerary_items
+            WHERE trip_id = old.trip_id AND place_id = old.place_id
+        )
+        BEGIN
+            UPDATE place_trip_counts SET trips = trips - 1 WHERE place_id = old.place_id;
+            DELETE FROM place_trip_counts WHERE place_id = old.place_id AND trips <= 0;
+            UPDATE place_covisits SET trips = trips - 1
+            WHERE (place_id = old.place_id AND related_place_id IN (
+                SELECT place_id FROM itinerary_items WHERE trip_id = old.trip_id
+            )) OR (related_place_id = old.place_id AND place_id IN (
+                SELECT place_id FROM itinerary_items WHERE trip_id = old.trip_id
+            ));
+            DELETE FROM place_covisits WHERE place_id = old.place_id AND trips <= 0;
+            DELETE FROM place_covisits WHERE related_place_id = old.place_id AND trips <= 0 AND place_id IN (
+                SELECT place_id FROM itinerary_items WHERE trip_id = old.trip_id
+            );
+        END
+        ''',
+        # Moving an item is a delete from its old trip and place (seen before the
+        # update) followed by an insert into the new ones
+        '''
+        CREATE TRIGGER IF NOT EXISTS itinerary_items_covisits_update_old
+        BEFORE UPDATE OF trip_id, place_id ON itinerary_items
+        WHEN (old.trip_id IS NOT new.trip_id OR old.place_id IS NOT new.place_id) AND NOT EXISTS (
+            SELECT 1 FROM itinerary_items
+            WHERE trip_id = old.trip_id AND place_id = old.place_id AND id <> old.id
+        )
+        BEGIN
+            UPDATE place_trip_counts SET trips = trips - 1 WHERE place_id = old.place_id;
+            DELETE FROM place_trip_counts WHERE place_id = old.place_id AND trips <= 0;
+            UPDATE place_covisits SET trips = trips - 1
+            WHERE (place_id = old.place_id AND related_place_id IN (
+                SELECT place_id FROM itinerary_items WHERE trip_id = old.trip_id AND id <> old.id
+            )) OR (related_place_id = old.place_id AND place_id IN (
+                SELECT place_id FROM itinerary_items WHERE trip_id = old.trip_id AND id <> old.id
+            ));
+            DELETE FROM place_covisits WHERE place_id = old.place_id AND trips <= 0;
+            DELETE FROM place_covisits WHERE related_place_id = old.place_id AND trips <= 0 AND place_id IN (
+                SELECT place_id FROM itinerary_items WHERE trip_id = old.trip_id AND id <> old.id
+            );
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS itinerary_items_covisits_update_new
+        AFTER UPDATE OF trip_id, place_id ON itinerary_items
+        WHEN (old.trip_id IS NOT new.trip_id OR old.place_id IS NOT new.place_id) AND NOT EXISTS (
+            SELECT 1 FROM itinerary_items
+            WHERE trip_id = new.trip_id AND place_id = new.place_id AND id <> new.id
+        )
+        BEGIN
+            INSERT INTO place_trip_counts (place_id, trips) VALUES (new.place_id, 1)
+            ON CONFLICT (place_id) DO UPDATE SET trips = trips + 1;
+            INSERT INTO place_covisits (place_id, related_place_id, trips)
+            SELECT DISTINCT new.place_id, place_id, 1 FROM itinerary_items
+            WHERE trip_id = new.trip_id AND place_id <> new.place_id
+            ON CONFLICT (place_id, related_place_id) DO UPDATE SET trips = trips + 1;
+            INSERT INTO place_covisits (place_id, related_place_id, trips)
+            SELECT DISTINCT place_id, new.place_id, 1 FROM itinerary_items
+            WHERE trip_id = new.trip_id AND place_id <> new.place_id
+            ON CONFLICT (place_id, related_place_id) DO UPDATE SET trips = trips + 1;
+        END
+        '''
+    ]),
+    (9, "MinHash signatures for similar travelers", [
+        '''
+        CREATE TABLE IF NOT EXISTS user_minhash (
+            user_id INTEGER PRIMARY KEY,
+            signature BLOB NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        # One row per LSH band; users sharing a (band, bucket) are candidate matches
+        '''
+        CREATE TABLE IF NOT EXISTS user_lsh_buckets (
+            band INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (band, bucket, user_id)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_user_lsh_buckets_user
+        ON user_lsh_buckets (user_id)
+        '''
+    ]),
+]
+
+
+def get_schema_version(conn):
+    """Return the highest applied migration version, or 0 for a new database."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TEXT NOT NULL
+    )
+    ''')
+    conn.commit()
+    row = conn.execute('SELECT MAX(version) FROM schema_migrations').fetchone()
+    return row[0] or 0
+
+
+def run_migrations(conn, migrations=MIGRATIONS):
+    """Apply pending migrations in order, each in its own transaction.
+
+    Returns the list of versions that were applied.
+    """
+    current_version = get_schema_version(conn)
+    applied = []
+
+    for version, description, statements in migrations:
+        if version <= current_version:
+            continue
+
+        try:
+            conn.execute('BEGIN')
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute('''
+            INSERT INTO schema_migrations (version, description, applied_at)
+            VALUES (?, ?, ?)
+            ''', (version, description, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            raise Exception(f"Migration {version} ({description}) failed: {e}")
+
+        applied.append(version)
+
+    return applied
@@ -0,0 +1,129 @@
+import time
+from itertools import repeat
+
+import numpy as np
+
+from utils.geo import EARTH_RADIUS_KM
+
+# Per travel mode: average speed (km/h), detour factor from straight-line to
+# street distance, and fixed minutes per trip (waiting, parking, walking to stops)
+SPEED_PROFILES = {
+    'walking': {'speed_kmh': 4.8, 'detour': 1.25, 'overhead_minutes': 0},
+    'transit': {'speed_kmh': 20.0, 'detour': 1.35, 'overhead_minutes': 8},
+    'driving': {'speed_kmh': 22.0, 'detour': 1.4, 'overhead_minutes': 5},
+}
+
+
+def haversine_matrix(lat_a, lng_a, lat_b=None, lng_b=None):
+    """Great-circle distances in km between every point of a and every point of b.
+
+    Inputs are 1-D arrays in degrees; b defaults to a. Returns a len(a) x len(b) array.
+    """
+    lat_a = np.radians(np.asarray(lat_a, dtype=float))[:, None]
+    lng_a = np.radians(np.asarray(lng_a, dtype=float))[:, None]
+    lat_b = lat_a.T if lat_b is None else np.radians(np.asarray(lat_b, dtype=float))[None, :]
+    lng_b = lng_a.T if lng_b is None else np.radians(np.asarray(lng_b, dtype=float))[None, :]
+
+    a = (np.sin((lat_b - lat_a) / 2) ** 2
+         + np.cos(lat_a) * np.cos(lat_b) * np.sin((lng_b - lng_a) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def estimate_durations(distance_km, profile):
+    """Estimated travel minutes for a distance array under a speed profile."""
+    minutes = distance_km * profile['detour'] / profile['speed_kmh'] * 60
+    return np.where(distance_km > 0, minutes + profile['overhead_minutes'], 0.0)
+
+
+class DistanceMatrixBuilder:
+    """Fills the distances table with all-pairs estimates for each destination.
+
+    Distances are haversine (straight-line) km computed for a whole city in one
+    NumPy pass; durations come from the speed profile of each travel mode.
+    """
+
+    def __init__(self, db, profiles=None):
+        self.db = db
+        self.profiles = SPEED_PROFILES if profiles is None else profiles
+
+    def matrix(self, latitudes, longitudes, travel_mode='walking'):
+        """Return (distance_km, duration_minutes) matrices for a list of points."""
+        distance_km = haversine_matrix(latitudes, longitudes)
+        return distance_km, estimate_durations(distance_km, self.profiles[travel_mode])
+
+    def _rows(self, origin_ids, destination_ids, distance_km):
+        """Build distances rows for every mode, skipping a place's distance to itself."""
+        origins, destinations = np.meshgrid(origin_ids, destination_ids, indexing='ij')
+        mask = origins != destinations
+        origins = origins[mask].tolist()
+        destinations = destinations[mask].tolist()
+        km = np.round(distance_km[mask], 3).tolist()
+
+        rows = []
+        for mode, profile in self.profiles.items():
+            # duration_minutes is an INTEGER column; round up so short hops aren't free
+            minutes = np.ceil(estimate_durations(distance_km[mask], profile)).astype(int).tolist()
+            rows.extend(zip(origins, destinations, km, minutes, repeat(mode)))
+        return rows
+
+    def build_destination(self, destination, incremental=True):
+        """Compute and store distances between the places of one destination.
+
+        With incremental set, only rows and columns for places that are missing
+        distances to some other place of this destination are computed. Returns the number of place pairs written.
+        """
+        places = self.db.get_destination_places(destination)
+        if len(places) < 2:
+            return 0
+
+        ids = np.array([place['id'] for place in places])
+        lat = np.array([place['latitude'] for place in places], dtype=float)
+        lng = np.array([place['longitude'] for place in places], dtype=float)
+
+        if incremental:
+            existing = self.db.get_place_ids_with_distances(ids.tolist())
+            new = np.array([place_id not in existing for place_id in ids.tolist()])
+        else:
+            new = np.ones(len(ids), dtype=bool)
+        if not new.any():
+            return 0
+
+        # New places to every place, and every existing place to the new ones
+        distance_km = haversine_matrix(lat[new], lng[new], lat, lng)
+        rows = self._rows(ids[new], ids, distance_km)
+        old = ~new
+        if old.any():
+            rows.extend(self._rows(ids[old], ids[new], distance_km[:, old].T))
+
+        self.db.upsert_distances(rows)
+        return len(rows) // len(self.profiles)
+
+    def build_all(self, incremental=True):
+        """Build distances for every trip destination; returns pairs written per destination."""
+        return {
+            destination: self.build_destination(destination, incremental=incremental)
+            for destination in self.db.get_destinations()
+        }
+
+
+if __name__ == '__main__':
+    # Run from the project root: python -m models.distance_model
+    import argparse
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Populate the distances table.")
+    parser.add_argument('destination', nargs='?', help="Only build this destination")
+    parser.add_argument('--db', default='musafir.db', help="Path to the SQLite database")
+    parser.add_argument('--full', action='store_true', help="Recompute every pair, not just new places")
+    args = parser.parse_args()
+
+    builder = DistanceMatrixBuilder(Database(args.db))
+    started = time.perf_counter()
+    if args.destination:
+        results = {args.destination: builder.build_destination(args.destination, incremental=not args.full)}
+    else:
+        results = builder.build_all(incremental=not args.full)
+
+    for destination, pairs in results.items():
+        print(f"{destination}: {pairs} place pairs")
+    print(f"Done in {time.perf_counter() - started:.2f}s")
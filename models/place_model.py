@@ -0,0 +1,251 @@
+import heapq
+import math
+import time
+from threading import Lock
+
+import numpy as np
+
+from models.distance_model import SPEED_PROFILES, estimate_durations, haversine_matrix
+from utils.cache import LRUCache
+from utils.map_clusters import ClusterIndex
+
+# place_type values that suit each travel_style preference, keyed by lowercase
+# style; signup stores the lowercase radio values, the seed data capitalized ones
+STYLE_PLACE_TYPES = {
+    'adventure': {'Park', 'Outdoor', 'Sports'},
+    'relaxation': {'Park', 'Garden', 'Cafe', 'Viewpoint'},
+    'cultural': {'Museum', 'Landmark', 'Entertainment', 'Theater'},
+    'family': {'Park', 'Museum', 'Entertainment'},
+    'nightlife': {'Entertainment', 'Theater', 'Restaurant'},
+    'photography': {'Landmark', 'Park', 'Viewpoint'},
+    'food': {'Restaurant', 'Cafe', 'Food', 'Market'},
+    'history': {'Museum', 'Landmark', 'Historic Site'},
+    'art': {'Museum', 'Gallery'},
+    'architecture': {'Landmark'},
+    'nature': {'Park', 'Garden'},
+}
+
+
+def preferred_place_types(travel_styles):
+    """Return the place types that suit any of the given travel styles, ignoring case."""
+    matched_types = set()
+    for style in travel_styles:
+        matched_types |= STYLE_PLACE_TYPES.get(style.strip().lower(), set())
+    return matched_types
+
+# Typical visit length by place_type, used to check the remaining time budget
+VISIT_MINUTES = {
+    'Museum': 150,
+    'Park': 120,
+    'Landmark': 90,
+    'Entertainment': 90,
+    'Restaurant': 75,
+    'Cafe': 45,
+}
+DEFAULT_VISIT_MINUTES = 90
+
+# Relative weight of each score component
+WEIGHTS = {'distance': 0.45, 'preference': 0.3, 'rating': 0.25}
+
+
+class PlaceRecommender:
+    """Picks the next place to suggest in the dynamic planner.
+
+    Candidate features (coordinates, type, rating, visit length) are held in
+    NumPy arrays and rebuilt only when the places table changes, so scoring a
+    request is a handful of vectorized operations over all candidates.
+    """
+
+    def __init__(self, db, travel_mode='walking', distance_scale_km=2.0, refresh_interval=60):
+        self.db = db
+        self.profile = SPEED_PROFILES[travel_mode]
+        self.distance_scale_km = distance_scale_km
+        self.refresh_interval = refresh_interval
+        self._lock = Lock()
+        self._features = None
+        self._places_version = None
+        self._checked_at = 0.0
+
+    def _build_features(self):
+        """Load candidate places and precompute their feature arrays."""
+        places = self.db.get_recommendation_candidates()
+        place_types = [place['place_type'] or '' for place in places]
+        ratings = np.array([place['rating'] if place['rating'] is not None else np.nan
+                            for place in places], dtype=float)
+
+        features = {
+            'places': places,
+            'ids': np.array([place['id'] for place in places], dtype=np.int64),
+            'lat': np.array([place['latitude'] for place in places], dtype=float),
+            'lng': np.array([place['longitude'] for place in places], dtype=float),
+            'types': np.array(place_types, dtype=object),
+            # Unrated places score as 3/5
+            'rating': np.where(np.isnan(ratings), 0.6, ratings / 5.0),
+            'visit_minutes': np.array([VISIT_MINUTES.get(t, DEFAULT_VISIT_MINUTES)
+                                       for t in place_types], dtype=float),
+        }
+
+        with self._lock:
+            self._features = features
+            self._places_version = self.db.get_places_version()
+            self._checked_at = time.monotonic()
+
+    def refresh(self, force=False):
+        """Rebuild the features if the places table changed since the last build."""
+        if not force and self._features is not None and \
+                time.monotonic() - self._checked_at < self.refresh_interval:
+            return
+
+        self._checked_at = time.monotonic()
+        if force or self._features is None or self.db.get_places_version() != self._places_version:
+            self._build_features()
+
+    def recommend(self, latitude=None, longitude=None, travel_styles=(), exclude_ids=(),
+                  remaining_minutes=None, max_distance_km=None):
+        """Return the best next place as a dict with 'score' and 'distance_km', or None.
+
+        Places are scored by closeness to (latitude, longitude), match with the
+        user's travel styles, and rating. Excluded places, places further than
+        max_distance_km, and places whose travel plus visit time exceeds
+        remaining_minutes are skipped.
+        """
+        self.refresh()
+        with self._lock:
+            features = self._features
+        if not features['places']:
+            return None
+
+        eligible = ~np.isin(features['ids'], np.fromiter(exclude_ids, dtype=np.int64))
+
+        if latitude is not None and longitude is not None:
+            distance_km = haversine_matrix([latitude], [longitude], features['lat'], features['lng'])[0]
+            proximity = np.exp(-distance_km / self.distance_scale_km)
+            travel_minutes = estimate_durations(distance_km, self.profile)
+            if max_distance_km is not None:
+                eligible &= distance_km <= max_distance_km
+        else:
+            distance_km = np.full(len(features['ids']), np.nan)
+            proximity = np.full(len(features['ids']), 0.5)
+            travel_minutes = np.zeros(len(features['ids']))
+
+        if remaining_minutes is not None:
+            eligible &= travel_minutes + features['visit_minutes'] <= remaining_minutes
+
+        matched_types = preferred_place_types(travel_styles)
+        preference = np.isin(features['types'], list(matched_types)).astype(float)
+
+        scores = (WEIGHTS['distance'] * proximity
+                  + WEIGHTS['preference'] * preference
+                  + WEIGHTS['rating'] * features['rating'])
+        scores = np.where(eligible, scores, -np.inf)
+
+        best = int(np.argmax(scores))
+        if not np.isfinite(scores[best]):
+            return None
+
+        place = dict(features['places'][best])
+        place['score'] = round(float(scores[best]), 4)
+        place['distance_km'] = None if np.isnan(distance_km[best]) else round(float(distance_km[best]), 3)
+        place['visit_minutes'] = int(features['visit_minutes'][best])
+        return place
+
+
+class CovisitRecommender:
+    """"People who visited X also visited Y" from trip co-occurrence counts.
+
+    The counts live in place_covisits and place_trip_counts, which the
+    itinerary_items triggers keep current. Related places are ranked by the
+    cosine similarity of their trip sets, summed over the seed places, with a
+    boost for place types that match the user's travel styles.
+    """
+
+    def __init__(self, db, preference_boost=0.5, min_trips=1):
+        self.db = db
+        self.preference_boost = preference_boost
+        self.min_trips = min_trips
+
+    def related(self, place_ids, k=10, travel_styles=(), exclude_ids=()):
+        """Return the top k places related to place_ids, best first."""
+        place_ids = list(place_ids)
+        seed_counts = self.db.get_place_trip_counts(place_ids)
+        excluded = set(place_ids) | set(exclude_ids)
+
+        matched_types = preferred_place_types(travel_styles)
+
+        candidates = {}
+        for row in self.db.get_covisited_places(place_ids, min_trips=self.min_trips):
+            related_id = row['related_place_id']
+            if related_id in excluded:
+                continue
+            similarity = row['trips'] / math.sqrt(seed_counts[row['place_id']] * row['related_trips'])
+            candidate = candidates.get(related_id)
+            if candidate is None:
+                candidate = candidates[related_id] = {
+                    'id': related_id,
+                    'name': row['name'],
+                    'place_type': row['place_type'],
+                    'shared_trips': 0,
+                    'score': 0.0
+                }
+            candidate['shared_trips'] += row['trips']
+            candidate['score'] += similarity
+
+        for candidate in candidates.values():
+            if candidate['place_type'] in matched_types:
+                candidate['score'] *= 1 + self.preference_boost
+            candidate['score'] = round(candidate['score'], 4)
+
+        return heapq.nlargest(k, candidates.values(), key=lambda candidate: candidate['score'])
+
+
+class DestinationClusters:
+    """Map marker clusters for the places and travelers of each destination.
+
+    A ClusterIndex is built per destination on first request and reused for
+    ttl seconds, so panning and zooming only query precomputed levels.
+    """
+
+    def __init__(self, db, cache_size=64, ttl=300, max_zoom=16, radius_px=60):
+        self.db = db
+        self.max_zoom = max_zoom
+        self.radius_px = radius_px
+        self.cache = LRUCache(maxsize=cache_size, ttl=ttl)
+
+    def _build(self, destination):
+        places = self.db.get_destination_places(destination)
+        visitors = self.db.get_destination_visitors(destination)
+        return ClusterIndex(
+            [place['latitude'] for place in places] + [visit['latitude'] for visit in visitors],
+            [place['longitude'] for place in places] + [visit['longitude'] for visit in visitors],
+            ['place'] * len(places) + ['traveler'] * len(visitors),
+            [place['id'] for place in places] + [visit['user_id'] for visit in visitors],
+            max_zoom=self.max_zoom, radius_px=self.radius_px
+        )
+
+    def get_index(self, destination):
+        """Return the cluster index of a destination, building it if needed."""
+        key = destination.strip().lower()
+        index = self.cache.get(key)
+        if index is None:
+            index = self._build(destination)
+            self.cache.set(key, index)
+        return index
+
+    def get_clusters(self, destination, west, south, east, north, zoom):
+        """Return the clusters of a destination inside a bounding box at a zoom level."""
+        return self.get_index(destination).get_clusters(west, south, east, north, zoom)
+
+
+if __name__ == '__main__':
+    # Run from the project root: python -m models.place_model
+    import argparse
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Rebuild the place co-visitation counts.")
+    parser.add_argument('--db', default='musafir.db', help="Path to the SQLite database")
+    parser.add_argument('--chunk-rows', type=int, default=50000, help="Itinerary rows read per chunk")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    trips = Database(args.db).rebuild_covisits(rows_per_chunk=args.chunk_rows)
+    print(f"Counted {trips} trips in {time.perf_counter() - started:.2f}s")
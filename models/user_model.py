@@ -0,0 +1,152 @@
+import hashlib
+import time
+import zlib
+
+import numpy as np
+
+# Mersenne prime for the universal hash family; a * x stays below 2**62
+MINHASH_PRIME = (1 << 31) - 1
+
+
+class TravelerIndex:
+    """Finds travelers with similar tastes using MinHash and LSH.
+
+    Each user is a set of tokens (the places on their trips and their
+    preference values). A MinHash signature of num_perm hashes estimates the
+    Jaccard similarity between two sets, and the signature is split into
+    bands of rows_per_band hashes; users whose band hashes to the same bucket
+    are candidate matches. Only candidates are compared, so a query never
+    scans every user. Signatures and buckets are stored in the database;
+    changing num_perm or bands requires rebuilding them with build_all().
+    """
+
+    def __init__(self, db, num_perm=64, bands=16, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.db = db
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, MINHASH_PRIME, size=num_perm, dtype=np.int64)
+        self._b = rng.integers(0, MINHASH_PRIME, size=num_perm, dtype=np.int64)
+
+    def signature(self, tokens):
+        """Return the MinHash signature of a set of tokens, or None if it is empty."""
+        if not tokens:
+            return None
+        # crc32 is stable across processes, unlike hash()
+        x = np.fromiter((zlib.crc32(token.encode('utf-8')) for token in tokens),
+                        dtype=np.int64, count=len(tokens)) % MINHASH_PRIME
+        hashes = (self._a[:, None] * x[None, :] + self._b[:, None]) % MINHASH_PRIME
+        return hashes.min(axis=1).astype(np.uint32)
+
+    def buckets(self, signature):
+        """Return the (band, bucket) pairs of a signature."""
+        pairs = []
+        for band in range(self.bands):
+            rows = signature[band * self.rows_per_band:(band + 1) * self.rows_per_band]
+            digest = hashlib.blake2b(rows.tobytes(), digest_size=8).digest()
+            pairs.append((band, int.from_bytes(digest, 'little', signed=True)))
+        return pairs
+
+    def _decode(self, blob):
+        signature = np.frombuffer(blob, dtype='<u4')
+        return signature if len(signature) == self.num_perm else None
+
+    def update_users(self, user_ids):
+        """Recompute and store the signatures of the given users."""
+        entries = {}
+        for user_id, tokens in self.db.get_user_features(user_ids).items():
+            signature = self.signature(tokens)
+            if signature is None:
+                entries[user_id] = None
+            else:
+                entries[user_id] = (signature.astype('<u4').tobytes(), self.buckets(signature))
+        self.db.save_user_signatures(entries)
+
+    def update_user(self, user_id):
+        """Recompute and store one user's signature, e.g. after they store a trip."""
+        self.update_users([user_id])
+
+    def build_all(self, chunk_size=1000):
+        """Recompute the signatures of every user; returns the number of users indexed."""
+        indexed = 0
+        last_id = 0
+        while True:
+            user_ids = self.db.get_user_ids(after_id=last_id, limit=chunk_size)
+            if not user_ids:
+                return indexed
+            self.update_users(user_ids)
+            indexed += len(user_ids)
+            last_id = user_ids[-1]
+
+    def get_signature(self, user_id):
+        """Return the user's stored signature, computing and storing it if missing."""
+        blob = self.db.get_user_signatures([user_id]).get(user_id)
+        signature = self._decode(blob) if blob is not None else None
+        if signature is None:
+            self.update_user(user_id)
+            blob = self.db.get_user_signatures([user_id]).get(user_id)
+            signature = self._decode(blob) if blob is not None else None
+        return signature
+
+    def similar_travelers(self, user_id, destination=None, start_date=None, end_date=None,
+                          k=10, min_similarity=0.05):
+        """Return the k travelers most similar to user_id, best first.
+
+        Only LSH candidates with a trip to destination overlapping
+        [start_date, end_date] are considered; each result is a dict with the
+        traveler's id, name, profile_image, estimated similarity and trip.
+        """
+        signature = self.get_signature(user_id)
+        if signature is None:
+            return []
+
+        candidates = self.db.get_lsh_candidates(self.buckets(signature), exclude_user_id=user_id)
+        if not candidates:
+            return []
+
+        # One entry per traveler: their earliest matching trip
+        trips = {}
+        for trip in self.db.get_travelers_trips(candidates, destination, start_date, end_date):
+            trips.setdefault(trip['user_id'], trip)
+
+        results = []
+        for candidate_id, blob in self.db.get_user_signatures(trips).items():
+            other = self._decode(blob)
+            if other is None:
+                continue
+            similarity = float(np.mean(signature == other))
+            if similarity < min_similarity:
+                continue
+            trip = trips[candidate_id]
+            results.append({
+                'id': candidate_id,
+                'name': trip['name'],
+                'profile_image': trip['profile_image'],
+                'similarity': round(similarity, 3),
+                'trip': {
+                    'id': trip['id'],
+                    'destination': trip['destination'],
+                    'start_date': trip['start_date'],
+                    'end_date': trip['end_date']
+                }
+            })
+
+        results.sort(key=lambda result: result['similarity'], reverse=True)
+        return results[:k]
+
+
+if __name__ == '__main__':
+    # Run from the project root: python -m models.user_model
+    import argparse
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Rebuild the similar-traveler MinHash index.")
+    parser.add_argument('--db', default='musafir.db', help="Path to the SQLite database")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    indexed = TravelerIndex(Database(args.db)).build_all()
+    print(f"Indexed {indexed} users in {time.perf_counter() - started:.2f}s")
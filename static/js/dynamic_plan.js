@@ -1,61 +1,7 @@
-const dummyPlaces = [
-  {
-    name: "Central Park",
-    lat: 40.7829,
-    lng: -73.9654,
-    description:
-      "Iconic urban park with various attractions including the Belvedere Castle, Bethesda Fountain, and Central Park Zoo.",
-    image: "/static/images/centralPark.jpg",
-    rating: 4.8,
-    highlights: ["Bethesda Fountain", "Belvedere Castle", "The Lake"],
-    activities: ["Walking Tours", "Boating", "Zoo Visit"],
-  },
-  {
-    name: "Metropolitan Museum of Art",
-    lat: 40.7794,
-    lng: -73.9632,
-    description:
-      "One of the world's largest and most comprehensive art museums, featuring over 2 million works of art.",
-    image: "/static/images/MET.jpg",
-    rating: 4.9,
-    highlights: ["Egyptian Collection", "European Paintings", "Rooftop Garden"],
-    activities: ["Guided Tours", "Art Workshops", "Rooftop Views"],
-  },
-  {
-    name: "Times Square",
-    lat: 40.758,
-    lng: -73.9855,
-    description: "Iconic intersection known for its bright lights, Broadway theaters, and vibrant atmosphere.",
-    image: "/static/images/TS.jpg",
-    rating: 4.6,
-    highlights: ["Broadway Theaters", "TKTS Booth", "Street Performances"],
-    activities: ["Shopping", "Theater Shows", "Photo Ops"],
-  },
-  {
-    name: "Statue of Liberty",
-    lat: 40.6892,
-    lng: -74.0445,
-    description: "Iconic symbol of freedom and democracy, offering harbor views and historical exhibits.",
-    image: "/static/images/StatueOfLiberty.jpg",
-    rating: 4.7,
-    highlights: ["Crown Access", "Ellis Island", "Harbor Views"],
-    activities: ["Guided Tours", "Museum Visit", "Ferry Ride"],
-  },
-  {
-    name: "Empire State Building",
-    lat: 40.7484,
-    lng: -73.9857,
-    description: "Historic 102-story skyscraper with observation decks offering panoramic city views.",
-    image: "/static/images/empirestate.jpg",
-    rating: 4.8,
-    highlights: ["Observation Deck", "Art Deco Lobby", "Night Views"],
-    activities: ["Observation", "Historical Tour", "Photography"],
-  },
-]
-
 let map
 let currentPlace
 const acceptedPlaces = []
+const rejectedPlaceIds = []
 const markers = []
 let currentMarker = null
 let routeLine = null
@@ -100,13 +46,49 @@ function initMap() {
   }
 }
 
-function showNextPlace() {
+// Ask the server for the best next place, starting from the last accepted stop
+function fetchNextPlace() {
+  const origin = acceptedPlaces.length > 0 ? acceptedPlaces[acceptedPlaces.length - 1] : map.getCenter()
+  const maxDistance = Number.parseFloat(document.getElementById("travel-distance").value)
+
+  return fetch("/api/next_place", {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+    },
+    body: JSON.stringify({
+      accepted: acceptedPlaces.map((place) => place.id),
+      rejected: rejectedPlaceIds,
+      lat: origin.lat,
+      lng: origin.lng,
+      planned_minutes: calculateTotalTime() * 60,
+      max_distance_km: Number.isNaN(maxDistance) ? null : maxDistance,
+    }),
+  })
+    .then((response) => response.json())
+    .then((data) => data.place)
+}
+
+async function showNextPlace() {
   if (currentMarker) {
     map.removeLayer(currentMarker)
+    currentMarker = null
+  }
+
+  let nextPlace = null
+  try {
+    nextPlace = await fetchNextPlace()
+  } catch (error) {
+    console.error("Error fetching next place:", error)
   }
 
-  if (dummyPlaces.length > 0) {
-    currentPlace = dummyPlaces.shift()
+  if (nextPlace) {
+    currentPlace = {
+      ...nextPlace,
+      image: nextPlace.image || "/placeholder.svg",
+      highlights: nextPlace.highlights || [],
+      activities: nextPlace.activities || [],
+    }
 
     // Update place details with animation
     const placeCard = document.getElementById("current-place")
@@ -116,7 +98,12 @@ function showNextPlace() {
       document.getElementById("place-name").textContent = currentPlace.name
       document.getElementById("place-description").textContent = currentPlace.description
       document.getElementById("place-image").src = currentPlace.image
-      document.getElementById("place-rating").textContent = currentPlace.rating.toFixed(1)
+      document.getElementById("place-rating").textContent =
+        currentPlace.rating != null ? currentPlace.rating.toFixed(1) : "N/A"
+
+      document.querySelectorAll(".place-details .place-highlights, .place-details .place-activities").forEach((el) =>
+        el.remove(),
+      )
 
       // Add highlights and activities
       const detailsHtml = `
@@ -159,6 +146,8 @@ function showNextPlace() {
     // Update timeline
     updateTimeline()
   } else {
+    currentPlace = null
+    updateRoute()
     showCompletionMessage()
   }
 }
@@ -281,10 +270,14 @@ function finishPlanning() {
     description: place.description,
     time: calculateTimeSlot(0, place.timeSpent),
     timeSpent: place.timeSpent,
+    lat: place.lat,
+    lng: place.lng,
     address: place.address || `${place.name}, New York, NY`, // Add default address if none provided
   }))
 
-  // Send to backend
+  const progressText = loadingOverlay.querySelector("p")
+
+  // Send to backend; the itinerary is generated by a background job we poll
   fetch("/finalize_trip", {
     method: "POST",
     headers: {
@@ -296,6 +289,14 @@ function finishPlanning() {
     }),
   })
     .then((response) => response.json())
+    .then((data) => {
+      if (!data.status_url) {
+        return data
+      }
+      return pollFinalizeJob(data.status_url, (progress) => {
+        progressText.textContent = progress
+      })
+    })
     .then((data) => {
       document.body.removeChild(loadingOverlay)
       if (data.finalized) {
@@ -379,6 +380,9 @@ document.head.appendChild(style)
 
 // Event Listeners
 document.getElementById("accept-place").addEventListener("click", () => {
+  if (!currentPlace) {
+    return
+  }
   const timeSpent = document.getElementById("time-spent").value
   const travelDistance = document.getElementById("travel-distance").value
 
@@ -404,7 +408,12 @@ document.getElementById("accept-place").addEventListener("click", () => {
   showNextPlace()
 })
 
-document.getElementById("reject-place").addEventListener("click", showNextPlace)
+document.getElementById("reject-place").addEventListener("click", () => {
+  if (currentPlace) {
+    rejectedPlaceIds.push(currentPlace.id)
+  }
+  showNextPlace()
+})
 
 document.getElementById("end-day").addEventListener("click", () => {
   if (acceptedPlaces.length > 0) {
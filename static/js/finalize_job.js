@@ -0,0 +1,12 @@
+// Poll a finalize job until it is done or failed, reporting progress along the way
+function pollFinalizeJob(statusUrl, onProgress) {
+  return fetch(statusUrl)
+    .then((response) => response.json())
+    .then((data) => {
+      if (data.status === "done" || data.status === "failed" || data.error === "Job not found") {
+        return data
+      }
+      onProgress(data.progress)
+      return new Promise((resolve) => setTimeout(resolve, 1000)).then(() => pollFinalizeJob(statusUrl, onProgress))
+    })
+}
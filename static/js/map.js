@@ -5,8 +5,15 @@ let currentDay = 0
 let polyline = null
 let mapData = null
 let nearbyTravelers = []
+let mapDataEtag = null
+let clusterLayer = null
+let clusterRequest = 0
+let boundsFitted = false
 
-function initMap(initialMapData) {
+// How often to check the server for map data changes
+const MAP_POLL_INTERVAL_MS = 30000
+
+function initMap(initialMapData, initialEtag) {
   try {
     // Check if Leaflet is loaded
     if (typeof L === "undefined") {
@@ -17,6 +24,8 @@ function initMap(initialMapData) {
     // Store the map data
     if (initialMapData) {
       mapData = initialMapData
+      // The page was rendered with this ETag, so the first poll can be a 304
+      mapDataEtag = initialEtag || null
       console.log("Received map data:", mapData)
     }
 
@@ -35,6 +44,10 @@ function initMap(initialMapData) {
       })
       .addTo(map)
 
+    // City-wide places and travelers, clustered on the server for the visible area
+    clusterLayer = L.layerGroup().addTo(map)
+    map.on("moveend", updateClusters)
+
     // If we have map data, update the map immediately
     if (mapData) {
       updateMap()
@@ -45,6 +58,9 @@ function initMap(initialMapData) {
       fetchMapData()
     }
 
+    // Pick up itinerary and visitor changes; unchanged polls are answered with a 304
+    setInterval(fetchMapData, MAP_POLL_INTERVAL_MS)
+
     // Log success
     console.log("Map initialized successfully")
   } catch (error) {
@@ -57,13 +73,19 @@ async function fetchMapData() {
     const tripId = new URLSearchParams(window.location.search).get("trip_id")
     if (!tripId) return
 
-    const response = await fetch(`/api/map_data/${tripId}`)
+    // Unchanged data comes back as an empty 304
+    const headers = mapDataEtag ? { "If-None-Match": mapDataEtag } : {}
+    const response = await fetch(`/api/map_data/${tripId}`, { headers, cache: "no-store" })
+    if (response.status === 304) return
+
     const data = await response.json()
 
     if (data.success) {
+      mapDataEtag = response.headers.get("ETag")
       mapData = data.mapData
-      nearbyTravelers = data.nearbyTravelers
-      updateMap()
+      nearbyTravelers = collectVisitors()
+      // Refreshes keep the user's pan and zoom; only the first load fits the bounds
+      updateMap(!boundsFitted)
       updateTimeline()
       updateNearbyTravelersList()
     }
@@ -72,7 +94,53 @@ async function fetchMapData() {
   }
 }
 
-function updateMap() {
+// Decode an encoded polyline into [lat, lng] pairs
+function decodePolyline(encoded, precision = 5) {
+  const factor = Math.pow(10, precision)
+  const coordinates = []
+  let index = 0
+  let lat = 0
+  let lng = 0
+
+  while (index < encoded.length) {
+    const deltas = []
+    for (let i = 0; i < 2; i++) {
+      let shift = 0
+      let result = 0
+      let byte
+      do {
+        byte = encoded.charCodeAt(index++) - 63
+        result |= (byte & 0x1f) << shift
+        shift += 5
+      } while (byte >= 0x20)
+      deltas.push(result & 1 ? ~(result >> 1) : result >> 1)
+    }
+    lat += deltas[0]
+    lng += deltas[1]
+    coordinates.push([lat / factor, lng / factor])
+  }
+  return coordinates
+}
+
+// Coordinates of a day's places, from its encoded route when the API sent one
+function dayCoordinates(day) {
+  return day.route ? decodePolyline(day.route) : day.places.map((place) => [place.lat, place.lng])
+}
+
+// Every visitor of every place, labelled with the place they share
+function collectVisitors() {
+  const travelers = []
+  mapData.days.forEach((day) => {
+    day.places.forEach((place) => {
+      ;(place.visitors || []).forEach((visitor) => {
+        travelers.push({ ...visitor, place: place.name, time: place.time })
+      })
+    })
+  })
+  return travelers
+}
+
+function updateMap(fitToMarkers = true) {
   try {
     // Clear existing markers and polyline
     markers.forEach((marker) => map.removeLayer(marker))
@@ -87,12 +155,12 @@ function updateMap() {
     console.log("Updating map with data:", mapData.days[currentDay])
 
     const places = mapData.days[currentDay].places
-    const coordinates = places.map((place) => [place.lat, place.lng])
+    const coordinates = dayCoordinates(mapData.days[currentDay])
 
     // Add markers for each place
     places.forEach((place, index) => {
       console.log("Adding marker for place:", place)
-      const marker = L.marker([place.lat, place.lng], {
+      const marker = L.marker(coordinates[index], {
         icon: L.divIcon({
           className: "custom-marker",
           html: `<div class="marker-content">${index + 1}</div>`,
@@ -117,9 +185,10 @@ function updateMap() {
     }
 
     // Fit map bounds to show all markers
-    if (markers.length > 0) {
+    if (markers.length > 0 && fitToMarkers) {
       const bounds = L.latLngBounds(coordinates)
       map.fitBounds(bounds, { padding: [50, 50] })
+      boundsFitted = true
     }
 
     // Update the day display
@@ -129,6 +198,48 @@ function updateMap() {
   }
 }
 
+async function updateClusters() {
+  if (!mapData || !mapData.trip || !mapData.trip.destination) return
+
+  // Ignore responses that arrive after a newer request was made
+  const request = ++clusterRequest
+  try {
+    const params = new URLSearchParams({
+      destination: mapData.trip.destination,
+      bbox: map.getBounds().toBBoxString(),
+      zoom: map.getZoom(),
+    })
+    const response = await fetch(`/api/map_clusters?${params}`)
+    const data = await response.json()
+    if (request !== clusterRequest || !data.clusters) return
+
+    clusterLayer.clearLayers()
+    data.clusters.forEach((cluster) => {
+      if (cluster.count) {
+        const size = Math.min(24 + 6 * Math.log10(cluster.count), 48)
+        L.marker([cluster.lat, cluster.lng], {
+          icon: L.divIcon({
+            className: "cluster-marker",
+            html: `<span>${cluster.count}</span>`,
+            iconSize: [size, size],
+          }),
+        })
+          .on("click", () => map.setView([cluster.lat, cluster.lng], cluster.expansion_zoom))
+          .addTo(clusterLayer)
+      } else {
+        L.circleMarker([cluster.lat, cluster.lng], {
+          radius: 5,
+          weight: 1,
+          color: cluster.kind === "traveler" ? "#e67e22" : "#3388ff",
+          fillOpacity: 0.6,
+        }).addTo(clusterLayer)
+      }
+    })
+  } catch (error) {
+    console.error("Error fetching map clusters:", error)
+  }
+}
+
 // Update the createPopupContent function to remove the popup button
 function createPopupContent(place) {
   return `
@@ -379,6 +490,6 @@ document.getElementById("close-popup").addEventListener("click", () => {
 document.addEventListener("DOMContentLoaded", () => {
   const mapDataElement = document.getElementById("map-data")
   const initialMapData = mapDataElement ? JSON.parse(mapDataElement.textContent) : null
-  initMap(initialMapData)
+  initMap(initialMapData, mapDataElement ? mapDataElement.dataset.etag : null)
 })
 
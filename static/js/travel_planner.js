@@ -1,3 +1,5 @@
+// pollFinalizeJob comes from finalize_job.js, which must be loaded first
+
 // Update the finalizeTrip function
 function finalizeTrip() {
     const loadingOverlay = document.createElement("div")
@@ -9,6 +11,7 @@ function finalizeTrip() {
       </div>
     `
     document.body.appendChild(loadingOverlay)
+    const progressText = loadingOverlay.querySelector("p")
   
     fetch("/finalize_trip", {
       method: "POST",
@@ -16,6 +19,14 @@ function finalizeTrip() {
       body: JSON.stringify({ finalize: true }),
     })
       .then((response) => response.json())
+      .then((data) => {
+        if (!data.status_url) {
+          return data
+        }
+        return pollFinalizeJob(data.status_url, (progress) => {
+          progressText.textContent = progress
+        })
+      })
       .then((data) => {
         document.body.removeChild(loadingOverlay)
   
@@ -23,7 +34,7 @@ function finalizeTrip() {
           // Redirect to the itinerary view page with the trip ID
           window.location.href = `/view_itinerary?trip_id=${data.trip_id}`
         } else {
-          alert(data.message || "No final itinerary was generated. Please try again.")
+          alert(data.error || "No final itinerary was generated. Please try again.")
         }
       })
       .catch((error) => {
@@ -33,4 +44,3 @@ function finalizeTrip() {
       })
   }
   
-  
\ No newline at end of file
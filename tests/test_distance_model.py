@@ -0,0 +1,28 @@
+from models.distance_model import DistanceMatrixBuilder
+
+
+def visit(db, user_id, destination, places):
+    trip_id = db.create_trip(user_id, destination, destination, '2025-05-01', '2025-05-02')
+    for order, place_id in enumerate(places):
+        db.add_itinerary_item(trip_id, place_id, 1, '09:00', '10:00', order_index=order)
+
+
+def test_incremental_build_ignores_distances_from_other_destinations(db):
+    user_id = db.create_user('Alice', 'alice@example.com')
+    museum = db.create_place('Museum', 40.7794, -73.9632)
+    park = db.create_place('Park', 40.7829, -73.9654)
+    bridge = db.create_place('Bridge', 40.7061, -73.9969)
+    dumbo = db.create_place('Dumbo', 40.7033, -73.9881)
+    visit(db, user_id, 'Manhattan', [museum, park])
+    visit(db, user_id, 'Brooklyn', [bridge, dumbo])
+
+    builder = DistanceMatrixBuilder(db)
+    builder.build_all()
+    assert db.get_distance(museum, bridge) is None
+
+    # Both places already have distances, but not to each other
+    visit(db, user_id, 'New York', [museum, bridge])
+    assert builder.build_destination('New York') == 2
+    assert db.get_distance(museum, bridge) is not None
+    assert db.get_distance(bridge, museum) is not None
+    assert builder.build_destination('New York') == 0
@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+
+
+def age_job(db, job_id, seconds):
+    updated_at = (datetime.now() - timedelta(seconds=seconds)).strftime('%Y-%m-%d %H:%M:%S')
+    db.update_finalize_job(job_id, status='running')
+    conn = db.get_connection()
+    conn.execute('UPDATE finalize_jobs SET updated_at = ? WHERE id = ?', (updated_at, job_id))
+    conn.commit()
+
+
+def test_requeue_returns_only_stale_jobs(db):
+    queued = db.create_finalize_job(None, 'queued')
+    live = db.create_finalize_job(None, 'live')
+    stale = db.create_finalize_job(None, 'stale')
+    age_job(db, live, 10)
+    age_job(db, stale, 600)
+
+    assert db.requeue_stale_finalize_jobs(300) == [stale]
+    assert db.get_finalize_job(live)['status'] == 'running'
+    assert set(db.get_queued_finalize_job_ids()) == {queued, stale}
+    # Already requeued, so a second poll does not resubmit it
+    assert db.requeue_stale_finalize_jobs(300) == []
+
+
+def test_requeue_one_job(db):
+    first = db.create_finalize_job(None, 'first')
+    second = db.create_finalize_job(None, 'second')
+    age_job(db, first, 600)
+    age_job(db, second, 600)
+
+    assert db.requeue_stale_finalize_jobs(300, job_id=second) == [second]
+    assert db.get_finalize_job(first)['status'] == 'running'
+
+
+def test_heartbeat_keeps_job_fresh(db):
+    job_id = db.create_finalize_job(None, 'slow')
+    age_job(db, job_id, 600)
+    db.update_finalize_job(job_id)
+    assert db.requeue_stale_finalize_jobs(300, job_id=job_id) == []
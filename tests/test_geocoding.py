@@ -0,0 +1,48 @@
+import pytest
+
+from utils.geocoding import Geocoder, GeocodingProvider, LocalGeocoder
+
+
+@pytest.fixture(scope='module')
+def local():
+    return LocalGeocoder()
+
+
+@pytest.mark.parametrize('query', [
+    'Central Park, Denver, CO',
+    'Bridge Street, Brooklyn, NY',
+    'Brooklyn, NY',
+    'New York, NY',
+    'Times Square, New York, NY 10001',
+    'Prospect Park, Manhattan, NY',
+])
+def test_search_rejects_other_localities(local, query):
+    assert local.search(query) == []
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('Central Park', (40.7829, -73.9654)),
+    ('Central Park, New York', (40.7829, -73.9654)),
+    ('Metropolitn Museum of Art, New York', (40.7794, -73.9632)),
+    # The example address in the finalize prompt
+    ('Central Park, New York, NY 10022, USA', (40.7829, -73.9654)),
+    ('Times Square, New York, NY 10036', (40.758, -73.9855)),
+    ('Times Square, NYC', (40.758, -73.9855)),
+    ('Brooklyn Museum, Brooklyn, NY 11238, USA', (40.6712, -73.9636)),
+])
+def test_search_accepts_matching_names(local, query, expected):
+    assert local.lookup(query) == expected
+
+
+def test_uncached_provider_hits_are_not_stored(db):
+    calls = []
+
+    def lookup(address, timeout=None):
+        calls.append(address)
+        return 1.0, 2.0
+
+    geocoder = Geocoder(db, providers=[GeocodingProvider('local', lookup, cache=False)])
+    assert geocoder.geocode('Somewhere, NY') == (1.0, 2.0)
+    assert geocoder.geocode('Somewhere, NY') == (1.0, 2.0)
+    assert len(calls) == 2
+    assert db.get_cached_geocode('somewhere ny') is None
@@ -0,0 +1,65 @@
+import sqlite3
+
+import pytest
+
+from utils.itinerary_parser import parse_duration_minutes, parse_time_range
+
+
+@pytest.mark.parametrize('text, duration, expected', [
+    ('2:00 PM', None, ('14:00', '15:00')),
+    ('14:00', '2 hours', ('14:00', '16:00')),
+    ('09:00 - 10:30', None, ('09:00', '10:30')),
+    ('9 - 11 AM', None, ('09:00', '11:00')),
+    ('Morning', None, ('09:00', '12:00')),
+    ('11:30 PM', '3 hours', ('23:30', '23:59')),
+    ('Whenever', None, (None, None)),
+])
+def test_parse_time_range(text, duration, expected):
+    assert parse_time_range(text, parse_duration_minutes(duration)) == expected
+
+
+def itinerary(time, expected_time='1 hour'):
+    return {'trip': {
+        'destination': 'New York',
+        'dates': {'start': '2025-05-01', 'end': '2025-05-01'},
+        'itinerary': [{'day': 1, 'activities': [{
+            'time': time, 'expected_time': expected_time, 'place': 'Central Park',
+            'description': 'Walk', 'latitude': 40.7829, 'longitude': -73.9654
+        }]}]
+    }}
+
+
+def test_colocations_compare_normalized_times(db):
+    alice = db.create_user('Alice', 'alice@example.com')
+    bob = db.create_user('Bob', 'bob@example.com')
+    carol = db.create_user('Carol', 'carol@example.com')
+
+    trip_id = db.store_json_itinerary(itinerary('2:00 PM', '2 hours'), alice)
+    db.store_json_itinerary(itinerary('15:00'), bob)     # overlaps 14:00-16:00
+    db.store_json_itinerary(itinerary('9:00 AM'), carol)  # "09:00" sorts before "2:00 PM" as raw text
+
+    items = db.get_trip_itinerary(trip_id)[1]
+    assert (items[0]['start_time'], items[0]['end_time']) == ('14:00', '16:00')
+
+    visitors = db.get_trip_colocations(trip_id)[items[0]['id']]
+    assert [visitor['name'] for visitor in visitors] == ['Bob']
+
+
+def test_colocations_stay_under_the_variable_limit(db):
+    conn = db.get_connection()
+    conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+
+    alice = db.create_user('Alice', 'alice@example.com')
+    bob = db.create_user('Bob', 'bob@example.com')
+    # 20 places within a few metres of each other, so every item has 20 nearby windows
+    places = [db.create_place(f'Stall {n}', 40.7580 + n * 0.00001, -73.9855) for n in range(20)]
+
+    trip_id = db.create_trip(alice, 'Market', 'New York', '2025-05-01', '2025-05-01')
+    for order, place_id in enumerate(places):
+        db.add_itinerary_item(trip_id, place_id, 1, '10:00', '11:00', order_index=order)
+    other_trip = db.create_trip(bob, 'Market', 'New York', '2025-05-01', '2025-05-01')
+    db.add_itinerary_item(other_trip, places[0], 1, '10:30', '11:30')
+
+    colocations = db.get_trip_colocations(trip_id)
+    assert len(colocations) == len(places)
+    assert all(visitors[0]['name'] == 'Bob' for visitors in colocations.values())
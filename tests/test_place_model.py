@@ -0,0 +1,46 @@
+from models.place_model import CovisitRecommender, PlaceRecommender, preferred_place_types
+
+
+def test_preferred_place_types_ignores_case():
+    assert preferred_place_types(['adventure']) == preferred_place_types(['Adventure'])
+    assert 'Park' in preferred_place_types(['relaxation'])
+    assert preferred_place_types(['unknown']) == set()
+
+
+def test_recommend_uses_stored_signup_preference(db):
+    user_id = db.create_user('Test User', 'test@example.com')
+    # Signup stores the lowercase radio value
+    db.add_user_preference(user_id, 'travel_style', 'adventure')
+
+    db.create_place('Nearby Tower', 40.7500, -73.9850, rating=5.0, place_type='Landmark')
+    park_id = db.create_place('Riverside Park', 40.7550, -73.9850, rating=4.0, place_type='Park')
+
+    recommender = PlaceRecommender(db)
+    travel_styles = db.get_user_preferences(user_id)['travel_style']
+    assert travel_styles == ['adventure']
+
+    without_preference = recommender.recommend(40.7500, -73.9850)
+    assert without_preference['name'] == 'Nearby Tower'
+
+    place = recommender.recommend(40.7500, -73.9850, travel_styles=travel_styles)
+    assert place['id'] == park_id
+
+
+def test_related_boosts_stored_signup_preference(db):
+    user_id = db.create_user('Test User', 'test@example.com')
+    db.add_user_preference(user_id, 'travel_style', 'cultural')
+    seed_id = db.create_place('Seed Park', 40.75, -73.98, place_type='Park')
+    museum_id = db.create_place('City Museum', 40.76, -73.98, place_type='Museum')
+    garden_id = db.create_place('City Garden', 40.77, -73.98, place_type='Garden')
+
+    # The garden shares more trips with the seed than the museum does
+    for places in ([seed_id, garden_id], [seed_id, garden_id], [seed_id, museum_id]):
+        trip_id = db.create_trip(user_id, 'Trip', 'New York', '2025-01-01', '2025-01-01')
+        for place_id in places:
+            db.add_itinerary_item(trip_id, place_id, 1, '10:00', '11:00')
+
+    recommender = CovisitRecommender(db, preference_boost=1.0)
+    assert recommender.related([seed_id])[0]['id'] == garden_id
+
+    travel_styles = db.get_user_preferences(user_id)['travel_style']
+    assert recommender.related([seed_id], travel_styles=travel_styles)[0]['id'] == museum_id
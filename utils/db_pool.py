@@ -0,0 +1,139 @@
+import os
+import sqlite3
+import time
+from threading import Lock
+
+# Applied once to every new connection
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,        # 16 MB page cache (negative means KiB)
+    'mmap_size': 128 * 1024 * 1024,
+    'busy_timeout': 5000,        # ms to wait on a locked database
+    'temp_store': 'MEMORY'
+}
+
+_pools = {}
+_pools_lock = Lock()
+
+
+class ConnectionPool:
+    """Pool of configured sqlite3 connections to a single database file.
+
+    Connections are handed out with acquire() and given back with release().
+    The pool never blocks: if no idle connection is available a new one is
+    opened, and connections released while max_idle are already idle are
+    closed. Idle connections are checked with SELECT 1 before reuse once they
+    have been idle longer than health_check_interval seconds.
+    """
+
+    def __init__(self, db_path, max_idle=8, pragmas=None, health_check_interval=30):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self.health_check_interval = health_check_interval
+        self._idle = []
+        self._lock = Lock()
+        self.created = 0
+        self.reused = 0
+        self.closed = 0
+        self.in_use = 0
+        self.health_check_failures = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _is_healthy(self, conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self.closed += 1
+
+    def acquire(self):
+        """Return an idle connection, or open a new one."""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, released_at = self._idle.pop()
+
+            if (time.monotonic() - released_at < self.health_check_interval
+                    or self._is_healthy(conn)):
+                with self._lock:
+                    self.reused += 1
+                    self.in_use += 1
+                return conn
+
+            with self._lock:
+                self.health_check_failures += 1
+            self._close(conn)
+
+        conn = self._connect()
+        with self._lock:
+            self.created += 1
+            self.in_use += 1
+        return conn
+
+    def release(self, conn):
+        """Give a connection back to the pool, rolling back any open transaction."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            with self._lock:
+                self.in_use -= 1
+                self.health_check_failures += 1
+            self._close(conn)
+            return
+
+        with self._lock:
+            self.in_use -= 1
+            if len(self._idle) < self.max_idle:
+                self._idle.append((conn, time.monotonic()))
+                return
+        self._close(conn)
+
+    def close_all(self):
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        """Return connection counters and the current pool size."""
+        with self._lock:
+            acquired = self.created + self.reused
+            return {
+                'created': self.created,
+                'reused': self.reused,
+                'reuse_rate': self.reused / acquired if acquired else 0.0,
+                'in_use': self.in_use,
+                'idle': len(self._idle),
+                'max_idle': self.max_idle,
+                'closed': self.closed,
+                'health_check_failures': self.health_check_failures
+            }
+
+
+def get_pool(db_path, **kwargs):
+    """Return the shared pool for a database file, creating it on first use."""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(db_path, **kwargs)
+        return pool
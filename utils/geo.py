@@ -0,0 +1,75 @@
+from math import radians, degrees, sin, cos, asin, sqrt
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in kilometres."""
+    lat1, lng1, lat2, lng2 = map(radians, (lat1, lng1, lat2, lng2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(min(1.0, sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """Return (min_lat, max_lat, min_lng, max_lng) enclosing a circle of radius_km.
+
+    The box always contains the circle, so it can be used as a coarse index
+    filter before ranking candidates by haversine distance.
+    """
+    lat_delta = degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat = max(-90.0, latitude - lat_delta)
+    max_lat = min(90.0, latitude + lat_delta)
+
+    # Near the poles the circle covers every longitude
+    if max_lat >= 90.0 or min_lat <= -90.0:
+        return min_lat, max_lat, -180.0, 180.0
+
+    lng_delta = degrees(asin(min(1.0, sin(radius_km / EARTH_RADIUS_KM) / cos(radians(latitude)))))
+    return min_lat, max_lat, longitude - lng_delta, longitude + lng_delta
+
+
+def _encode_value(value):
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+
+def encode_polyline(coordinates, precision=5):
+    """Encode (lat, lng) pairs with the encoded polyline algorithm."""
+    factor = 10 ** precision
+    encoded = []
+    previous_lat = previous_lng = 0
+    for latitude, longitude in coordinates:
+        lat = int(round(latitude * factor))
+        lng = int(round(longitude * factor))
+        encoded.append(_encode_value(lat - previous_lat))
+        encoded.append(_encode_value(lng - previous_lng))
+        previous_lat, previous_lng = lat, lng
+    return ''.join(encoded)
+
+
+def decode_polyline(encoded, precision=5):
+    """Decode an encoded polyline into a list of (lat, lng) pairs."""
+    factor = 10 ** precision
+    coordinates = []
+    index = lat = lng = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        coordinates.append((lat / factor, lng / factor))
+    return coordinates
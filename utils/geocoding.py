@@ -0,0 +1,463 @@
+import os
+import re
+import json
+import time
+import requests
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from datetime import datetime, timedelta
+from threading import Lock
+from utils.cache import LRUCache
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'gazetteer.json')
+
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+NOMINATIM_HEADERS = {
+    'User-Agent': 'Musafir Travel App (your_email@example.com)'  # Replace with your app name and email
+}
+
+# USPS-style abbreviations applied to each address token
+ADDRESS_ABBREVIATIONS = {
+    'street': 'st', 'str': 'st', 'saint': 'st',
+    'avenue': 'ave', 'av': 'ave', 'avn': 'ave',
+    'boulevard': 'blvd', 'boul': 'blvd',
+    'road': 'rd', 'drive': 'dr', 'lane': 'ln', 'place': 'pl',
+    'square': 'sq', 'court': 'ct', 'terrace': 'ter', 'parkway': 'pkwy',
+    'highway': 'hwy', 'expressway': 'expy', 'freeway': 'fwy',
+    'plaza': 'plz', 'circle': 'cir', 'bridge': 'brg', 'center': 'ctr',
+    'centre': 'ctr', 'heights': 'hts', 'island': 'is', 'mount': 'mt',
+    'north': 'n', 'south': 's', 'east': 'e', 'west': 'w',
+    'northeast': 'ne', 'northwest': 'nw', 'southeast': 'se', 'southwest': 'sw',
+    'suite': 'ste', 'floor': 'fl', 'apartment': 'apt', 'building': 'bldg',
+    'first': '1st', 'second': '2nd', 'third': '3rd', 'fourth': '4th',
+    'fifth': '5th', 'sixth': '6th', 'seventh': '7th', 'eighth': '8th',
+    'ninth': '9th', 'tenth': '10th', 'eleventh': '11th', 'twelfth': '12th',
+}
+
+COUNTRY_SUFFIXES = re.compile(r'\b(united states of america|united states|usa|u s a|us)\s*$')
+# Country words left mid-address, which say nothing about the locality
+COUNTRY_TOKENS = {'usa', 'us', 'united', 'states', 'america'}
+
+
+def normalize_address(address):
+    """Normalize an address into a cache key (case, whitespace, punctuation, abbreviations)."""
+    if not address:
+        return ''
+
+    text = address.lower().replace('&', ' and ')
+    text = re.sub(r"[^\w\s]", ' ', text)
+    text = ' '.join(text.split())
+    text = COUNTRY_SUFFIXES.sub('', text).strip()
+
+    tokens = [ADDRESS_ABBREVIATIONS.get(token, token) for token in text.split()]
+    return ' '.join(tokens)
+
+
+def nominatim_lookup(address, timeout=10):
+    """Look up an address with Nominatim.
+
+    Returns (latitude, longitude), or (None, None) when there are no results.
+    Raises requests.exceptions.RequestException or ValueError on failure.
+    """
+    params = {
+        'q': address,
+        'format': 'json',
+        'limit': 1
+    }
+
+    response = requests.get(NOMINATIM_URL, params=params, headers=NOMINATIM_HEADERS, timeout=timeout)
+    response.raise_for_status()
+    data = response.json()
+
+    if data:
+        return float(data[0]['lat']), float(data[0]['lon'])
+    return None, None
+
+
+def _trigrams(text):
+    """Return the set of character trigrams of a normalized string."""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _dice(a, b):
+    """Dice similarity of two trigram sets."""
+    return 2.0 * len(a & b) / (len(a) + len(b))
+
+
+def _covers(tokens, others):
+    """Whether every token matches one of others, allowing small typos in longer words."""
+    for token in tokens:
+        if token in others:
+            continue
+        if len(token) < 4 or not any(
+                len(other) >= 4 and _dice(_trigrams(token), _trigrams(other)) >= 0.7 for other in others):
+            return False
+    return True
+
+
+def _address_numbers(text):
+    """Return the house number and ZIP code of a normalized address, if present."""
+    tokens = text.split()
+    house_number = tokens[0] if tokens and tokens[0].isdigit() and len(tokens[0]) < 5 else None
+    zip_codes = [token for token in tokens if token.isdigit() and len(token) == 5]
+    return house_number, (zip_codes[-1] if zip_codes else None)
+
+
+class LocalGeocoder:
+    """Offline geocoder over the bundled gazetteer and the places table.
+
+    Names and addresses are normalized and indexed by character trigrams.
+    A lookup tries an exact match first, then ranks candidates sharing
+    trigrams with the query by Dice similarity. A fuzzy candidate is only
+    accepted if the query contains its whole name and every other query word
+    (city, state, street) appears in the candidate's name, address or
+    localities, so "Central Park, Denver, CO" does not resolve to New York's
+    Central Park.
+    Candidates whose house number or ZIP code contradicts the query are
+    rejected, and a query with a house number only matches candidates with
+    the same house number.
+    """
+
+    def __init__(self, db=None, gazetteer_path=GAZETTEER_PATH, min_score=0.7, refresh_interval=60):
+        self.db = db
+        self.gazetteer_path = gazetteer_path
+        self.min_score = min_score
+        self.refresh_interval = refresh_interval
+        self._lock = Lock()
+        self._places_version = None
+        self._checked_at = 0
+        self._build_index()
+
+    def _load_entries(self):
+        """Load (name, address, lat, lng, aliases, localities) entries from the gazetteer and places table."""
+        entries = []
+
+        if self.gazetteer_path and os.path.exists(self.gazetteer_path):
+            with open(self.gazetteer_path) as f:
+                for place in json.load(f):
+                    entries.append((place['name'], place.get('address'), place['lat'],
+                                    place['lng'], place.get('aliases', []), place.get('localities', [])))
+
+        if self.db is not None:
+            for place in self.db.get_geocoded_places():
+                entries.append((place['name'], place['address'], place['latitude'],
+                                place['longitude'], [], []))
+
+        return entries
+
+    def _build_index(self):
+        """Rebuild the exact-match table and trigram index."""
+        exact = {}
+        keys = []
+        trigram_index = {}
+
+        for name, address, lat, lng, aliases, localities in self._load_entries():
+            names = [normalize_address(name)] + [normalize_address(alias) for alias in aliases]
+            names = [n for n in names if n]
+            normalized_address = normalize_address(address)
+            localities = [normalize_address(locality) for locality in localities]
+            # Every word that describes this entry, for checking the rest of a query
+            context = frozenset(' '.join(names + [normalized_address] + localities).split())
+            entry_zip_code = _address_numbers(normalized_address)[1]
+
+            # (key, the words a query must contain to match it)
+            candidates = [(n, n) for n in names]
+            if normalized_address:
+                candidates.append((normalized_address, normalized_address))
+                candidates.extend((f"{n} {normalized_address}", n) for n in names)
+            candidates.extend((f"{n} {locality}", n) for n in names for locality in localities if locality)
+
+            for key, required in candidates:
+                if key in exact:
+                    continue
+                exact[key] = (lat, lng)
+                key_id = len(keys)
+                keys.append((key, _trigrams(key), lat, lng, frozenset(required.split()), context,
+                             entry_zip_code))
+                for trigram in keys[key_id][1]:
+                    trigram_index.setdefault(trigram, []).append(key_id)
+
+        with self._lock:
+            self._exact = exact
+            self._keys = keys
+            self._trigram_index = trigram_index
+            if self.db is not None:
+                self._places_version = self.db.get_places_version()
+            self._checked_at = time.monotonic()
+
+    def refresh(self, force=False):
+        """Rebuild the index if the places table changed since the last build."""
+        if self.db is None:
+            return
+        if not force and time.monotonic() - self._checked_at < self.refresh_interval:
+            return
+
+        self._checked_at = time.monotonic()
+        if force or self.db.get_places_version() != self._places_version:
+            self._build_index()
+
+    def search(self, query, limit=5):
+        """Return up to limit (score, normalized_key, lat, lng) matches for a query."""
+        normalized = normalize_address(query)
+        if not normalized:
+            return []
+
+        self.refresh()
+        with self._lock:
+            exact, keys, trigram_index = self._exact, self._keys, self._trigram_index
+
+        if normalized in exact:
+            lat, lng = exact[normalized]
+            return [(1.0, normalized, lat, lng)]
+
+        query_trigrams = _trigrams(normalized)
+        overlaps = Counter()
+        for trigram in query_trigrams:
+            for key_id in trigram_index.get(trigram, ()):
+                overlaps[key_id] += 1
+
+        house_number, zip_code = _address_numbers(normalized)
+        # ZIP codes are checked against the candidate's below, not required in it
+        query_tokens = {token for token in normalized.split()
+                        if token not in COUNTRY_TOKENS and not (token.isdigit() and len(token) == 5)}
+        matches = []
+        for key_id, overlap in overlaps.items():
+            key, key_trigrams, lat, lng, required, context, entry_zip_code = keys[key_id]
+            score = 2.0 * overlap / (len(query_trigrams) + len(key_trigrams))
+            if score < self.min_score:
+                continue
+
+            # The whole name must be in the query, and the rest of the query must agree
+            if not _covers(required, query_tokens) or not _covers(query_tokens, context):
+                continue
+
+            # Keys without the address (name plus locality) still carry the entry's ZIP
+            key_house_number = _address_numbers(key)[0]
+            if house_number and house_number != key_house_number:
+                continue
+            if zip_code and entry_zip_code and zip_code != entry_zip_code:
+                continue
+
+            matches.append((score, key, lat, lng))
+
+        matches.sort(key=lambda match: match[0], reverse=True)
+        return matches[:limit]
+
+    def lookup(self, address, timeout=None):
+        """Return (latitude, longitude) of the best local match, or (None, None)."""
+        matches = self.search(address, limit=1)
+        if matches:
+            return matches[0][2], matches[0][3]
+        return None, None
+
+
+class GeocodingTimeout(Exception):
+    """Raised when a lookup can't start or finish within its time budget."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = Lock()
+
+    def acquire(self, timeout=None):
+        """Take a token, waiting up to timeout seconds. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+class GeocodingProvider:
+    """A geocoding lookup with its own rate limit and per-call timeout.
+
+    Set cache to False for providers whose answers shouldn't be kept in the
+    geocode cache, such as the fuzzy local index, which is cheap to ask again
+    and improves as places are added.
+    """
+
+    def __init__(self, name, lookup, rate=None, burst=1, timeout=None, cache=True):
+        self.name = name
+        self.lookup = lookup
+        self.timeout = timeout
+        self.cache = cache
+        self.bucket = TokenBucket(rate, burst) if rate else None
+
+    def _time_left(self, deadline):
+        if deadline is None:
+            return self.timeout
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise GeocodingTimeout(f"{self.name}: batch deadline exceeded")
+        return min(self.timeout, remaining) if self.timeout else remaining
+
+    def __call__(self, address, deadline=None):
+        """Look up an address once the rate limit allows, within the deadline."""
+        if self.bucket and not self.bucket.acquire(self._time_left(deadline)):
+            raise GeocodingTimeout(f"{self.name}: rate limit wait exceeded the deadline")
+        return self.lookup(address, timeout=self._time_left(deadline))
+
+
+class Geocoder:
+    """Geocoder with an in-process LRU in front of the geocode_cache table.
+
+    Providers are tried in order until one returns coordinates, so the local
+    geocoder answers first and Nominatim is only the fallback. Addresses that
+    no provider can resolve are cached for negative_ttl seconds so they aren't
+    retried on every finalize. Connection errors, timeouts and answers from
+    providers created with cache=False are not cached.
+    """
+
+    def __init__(self, db, providers=None, ttl=90 * 24 * 3600,
+                 negative_ttl=24 * 3600, lru_size=4096, max_workers=8, batch_deadline=30):
+        self.db = db
+        self.providers = [
+            provider if isinstance(provider, GeocodingProvider)
+            else GeocodingProvider(getattr(provider, '__name__', 'provider'), provider)
+            for provider in (providers if providers is not None else [
+                GeocodingProvider('nominatim', nominatim_lookup, rate=1.0, timeout=10)
+            ])
+        ]
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.lru = LRUCache(maxsize=lru_size)
+        self.batch_deadline = batch_deadline
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='geocode')
+
+    def _is_fresh(self, row):
+        created_at = datetime.strptime(row['created_at'], '%Y-%m-%d %H:%M:%S')
+        ttl = self.ttl if row['found'] else self.negative_ttl
+        return datetime.now() - created_at < timedelta(seconds=ttl)
+
+    def get_cached(self, address_key):
+        """Return cached coordinates for a normalized key, or None if not cached."""
+        cached = self.lru.get(address_key)
+        if cached is not None:
+            return cached
+
+        row = self.db.get_cached_geocode(address_key)
+        if row and self._is_fresh(row):
+            result = (row['latitude'], row['longitude']) if row['found'] else (None, None)
+            self.lru.set(address_key, result, ttl=self.ttl if row['found'] else self.negative_ttl)
+            return result
+
+        return None
+
+    def store(self, address_key, address, latitude, longitude):
+        """Cache a lookup result in the table and the LRU."""
+        found = latitude is not None and longitude is not None
+        self.db.cache_geocode(address_key, address, latitude, longitude, found)
+        self.lru.set(address_key, (latitude, longitude), ttl=self.ttl if found else self.negative_ttl)
+
+    def _resolve(self, address, deadline=None):
+        """Ask each provider in turn. Returns (latitude, longitude, cacheable).
+
+        cacheable is False when a provider failed or the answer came from a
+        provider that isn't cached.
+        """
+        latitude, longitude = None, None
+        failed = False
+        for provider in self.providers:
+            try:
+                latitude, longitude = provider(address, deadline=deadline)
+            except GeocodingTimeout as e:
+                print(f"Error: Geocoding timed out for address: {address}. Details: {e}")
+                failed = True
+                break
+            except requests.exceptions.RequestException as e:
+                print(f"Error: Unable to connect to the geocoding service. Details: {e}")
+                failed = True
+                continue
+            except ValueError as ve:
+                print(f"Error: {ve}")
+                failed = True
+                continue
+
+            if latitude is not None and longitude is not None:
+                return latitude, longitude, provider.cache
+
+        if not failed:
+            print(f"No geocoding results found for address: {address}")
+        return None, None, not failed
+
+    def geocode(self, address):
+        """Convert an address to (latitude, longitude), or (None, None)."""
+        address_key = normalize_address(address)
+        if not address_key:
+            return None, None
+
+        cached = self.get_cached(address_key)
+        if cached is not None:
+            return cached
+
+        latitude, longitude, cacheable = self._resolve(address)
+        if cacheable:
+            self.store(address_key, address, latitude, longitude)
+        return latitude, longitude
+
+    def geocode_batch(self, addresses, deadline=None, on_progress=None):
+        """Geocode many addresses concurrently and return results in input order.
+
+        Duplicate addresses are looked up once. Lookups still running when the
+        batch deadline passes resolve to (None, None). on_progress is called
+        with the number of addresses resolved so far.
+        """
+        deadline_at = time.monotonic() + (deadline if deadline is not None else self.batch_deadline)
+        keys = [normalize_address(address) for address in addresses]
+        results = {}
+        positions = Counter(key for key in keys if key)
+
+        pending = {}
+        submitted = set()
+        for address, key in zip(addresses, keys):
+            if not key or key in results or key in submitted:
+                continue
+            cached = self.get_cached(key)
+            if cached is not None:
+                results[key] = cached
+            else:
+                submitted.add(key)
+                pending[self._executor.submit(self._resolve, address, deadline_at)] = key
+
+        done = sum(positions[key] for key in results)
+        if on_progress and done:
+            on_progress(done)
+
+        addresses_by_key = dict(zip(keys, addresses))
+        try:
+            for future in as_completed(pending, timeout=max(0, deadline_at - time.monotonic())):
+                key = pending[future]
+                latitude, longitude, cacheable = future.result()
+                results[key] = (latitude, longitude)
+                if cacheable:
+                    self.store(key, addresses_by_key[key], latitude, longitude)
+
+                done += positions[key]
+                if on_progress:
+                    on_progress(done)
+        except FuturesTimeoutError:
+            unresolved = len(submitted - set(results))
+            print(f"Geocoding batch deadline exceeded; {unresolved} addresses unresolved")
+
+        return [results.get(key, (None, None)) for key in keys]
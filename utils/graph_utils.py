@@ -0,0 +1,239 @@
+"""Route optimization and day planning for itinerary stops.
+
+Routes are open paths through every stop, optionally pinned to a start and/or
+end stop. The matrix is assumed symmetric, as the haversine estimates from
+models.distance_model are.
+"""
+
+import math
+
+import numpy as np
+
+EPSILON = 1e-9
+
+
+def route_cost(route, matrix):
+    """Total cost of visiting the stops of route in order."""
+    return sum(matrix[a][b] for a, b in zip(route, route[1:]))
+
+
+def _edge(matrix, a, b):
+    """Cost of an edge; a missing endpoint (None) costs nothing."""
+    if a is None or b is None:
+        return 0.0
+    return matrix[a][b]
+
+
+def nearest_neighbour_route(matrix, start=None, end=None):
+    """Build a route by always moving to the closest unvisited stop.
+
+    Without a fixed start every stop is tried as the first one and the
+    cheapest route is kept.
+    """
+    n = len(matrix)
+    middle = [stop for stop in range(n) if stop not in (start, end)]
+    starts = [start] if start is not None else middle
+
+    best_route, best_cost = None, None
+    for first in starts:
+        route = [first]
+        unvisited = set(middle) - {first}
+        while unvisited:
+            current = route[-1]
+            nearest = min(unvisited, key=lambda stop: matrix[current][stop])
+            route.append(nearest)
+            unvisited.remove(nearest)
+        if end is not None and end != first:
+            route.append(end)
+
+        cost = route_cost(route, matrix)
+        if best_cost is None or cost < best_cost:
+            best_route, best_cost = route, cost
+
+    return best_route
+
+
+def two_opt(route, matrix, fixed_start=False, fixed_end=False):
+    """Reverse segments of the route while that shortens it."""
+    route = list(route)
+    n = len(route)
+    first = 1 if fixed_start else 0
+    last = n - 2 if fixed_end else n - 1
+
+    improved = True
+    while improved:
+        improved = False
+        for i in range(first, last):
+            before = route[i - 1] if i > 0 else None
+            for k in range(i + 1, last + 1):
+                after = route[k + 1] if k + 1 < n else None
+                delta = (_edge(matrix, before, route[k]) + _edge(matrix, route[i], after)
+                         - _edge(matrix, before, route[i]) - _edge(matrix, route[k], after))
+                if delta < -EPSILON:
+                    route[i:k + 1] = reversed(route[i:k + 1])
+                    improved = True
+    return route
+
+
+def or_opt(route, matrix, fixed_start=False, fixed_end=False, max_segment=3):
+    """Move runs of 1 to max_segment consecutive stops elsewhere while that shortens the route."""
+    route = list(route)
+    n = len(route)
+
+    improved = True
+    while improved:
+        improved = False
+        for length in range(1, max_segment + 1):
+            first = 1 if fixed_start else 0
+            last = n - length - (1 if fixed_end else 0)
+            for i in range(first, last + 1):
+                j = i + length - 1
+                head, tail = route[i], route[j]
+                before = route[i - 1] if i > 0 else None
+                after = route[j + 1] if j + 1 < n else None
+                removed = (_edge(matrix, before, head) + _edge(matrix, tail, after)
+                           - _edge(matrix, before, after))
+
+                rest = route[:i] + route[j + 1:]
+                lowest = 1 if fixed_start else 0
+                highest = len(rest) - 1 if fixed_end else len(rest)
+                best_position, best_delta = None, -EPSILON
+                for position in range(lowest, highest + 1):
+                    if position == i:
+                        continue
+                    a = rest[position - 1] if position > 0 else None
+                    b = rest[position] if position < len(rest) else None
+                    delta = (_edge(matrix, a, head) + _edge(matrix, tail, b)
+                             - _edge(matrix, a, b) - removed)
+                    if delta < best_delta:
+                        best_position, best_delta = position, delta
+
+                if best_position is not None:
+                    route = rest[:best_position] + route[i:j + 1] + rest[best_position:]
+                    improved = True
+                    break
+            if improved:
+                break
+    return route
+
+
+def optimize_route(matrix, start=None, end=None):
+    """Reorder stops to minimize total cost.
+
+    matrix is a square cost matrix (nested lists or a NumPy array) indexed by
+    stop; the current order is 0..n-1. start and end optionally pin a stop to
+    the first or last position. Returns a dict with the new 'order' and the
+    'original_cost', 'optimized_cost' and 'saved' totals.
+    """
+    if hasattr(matrix, 'tolist'):
+        matrix = matrix.tolist()
+    n = len(matrix)
+    original = list(range(n))
+    if start is not None and end is not None and start == end:
+        raise ValueError("start and end must be different stops")
+
+    # The current order, with pinned stops moved into place
+    current = [stop for stop in original if stop not in (start, end)]
+    if start is not None:
+        current.insert(0, start)
+    if end is not None:
+        current.append(end)
+
+    if n < 3:
+        route = current
+    else:
+        fixed_start, fixed_end = start is not None, end is not None
+        route = nearest_neighbour_route(matrix, start, end)
+        while True:
+            cost = route_cost(route, matrix)
+            route = two_opt(route, matrix, fixed_start, fixed_end)
+            route = or_opt(route, matrix, fixed_start, fixed_end)
+            if route_cost(route, matrix) >= cost - EPSILON:
+                break
+
+        # Never return something worse than the order we were given
+        if route_cost(current, matrix) <= route_cost(route, matrix):
+            route = current
+
+    original_cost = route_cost(original, matrix)
+    optimized_cost = route_cost(route, matrix)
+    return {
+        'order': route,
+        'original_cost': original_cost,
+        'optimized_cost': optimized_cost,
+        'saved': original_cost - optimized_cost
+    }
+
+
+def _project_km(latitudes, longitudes):
+    """Project coordinates onto a local plane in km (fine at city scale)."""
+    lat = np.asarray(latitudes, dtype=float)
+    lng = np.asarray(longitudes, dtype=float)
+    scale = math.cos(math.radians(float(lat.mean())))
+    return np.column_stack((lng * 111.32 * scale, lat * 110.57))
+
+
+def cluster_days(latitudes, longitudes, visit_minutes, num_days,
+                 day_budget_minutes=480, travel_minutes_per_stop=20, max_iterations=25):
+    """Split stops into compact day groups that each fit a daily time budget.
+
+    Capacity-constrained k-means: centroids are the visit-time weighted means
+    of their stops, and stops are assigned in order of regret (how much worse
+    their second-nearest day is) to the nearest day that still has room for
+    the visit plus travel_minutes_per_stop. Seeding is deterministic.
+
+    Returns (days, unassigned): num_days lists of stop indices, and the stops
+    that did not fit into any day.
+    """
+    if num_days < 1:
+        raise ValueError("num_days must be at least 1")
+
+    n = len(latitudes)
+    if n == 0:
+        return [[] for _ in range(num_days)], []
+
+    points = _project_km(latitudes, longitudes)
+    weights = np.maximum(np.asarray(visit_minutes, dtype=float), 1.0)
+    costs = weights + travel_minutes_per_stop
+
+    # Farthest-first seeds, starting from the stop farthest from the weighted centre
+    centre = np.average(points, axis=0, weights=weights)
+    seeds = [int(np.argmax(np.linalg.norm(points - centre, axis=1)))]
+    nearest_seed = np.linalg.norm(points - points[seeds[0]], axis=1)
+    while len(seeds) < min(num_days, n):
+        seeds.append(int(np.argmax(nearest_seed)))
+        nearest_seed = np.minimum(nearest_seed, np.linalg.norm(points - points[seeds[-1]], axis=1))
+    centroids = points[seeds]
+    if len(centroids) < num_days:
+        centroids = np.vstack([centroids, np.repeat(centre[None, :], num_days - len(centroids), axis=0)])
+
+    assignment = None
+    for _ in range(max_iterations):
+        distances = np.linalg.norm(points[:, None, :] - centroids[None, :, :], axis=2)
+        ranked = np.argsort(distances, axis=1)
+        if num_days > 1:
+            regret = distances[np.arange(n), ranked[:, 1]] - distances[np.arange(n), ranked[:, 0]]
+        else:
+            regret = np.zeros(n)
+
+        remaining = np.full(num_days, float(day_budget_minutes))
+        new_assignment = np.full(n, -1)
+        for stop in np.lexsort((-costs, -regret)):
+            for day in ranked[stop]:
+                if costs[stop] <= remaining[day] + EPSILON:
+                    new_assignment[stop] = day
+                    remaining[day] -= costs[stop]
+                    break
+
+        if assignment is not None and np.array_equal(new_assignment, assignment):
+            break
+        assignment = new_assignment
+
+        for day in range(num_days):
+            members = assignment == day
+            if members.any():
+                centroids[day] = np.average(points[members], axis=0, weights=weights[members])
+
+    days = [np.flatnonzero(assignment == day).tolist() for day in range(num_days)]
+    unassigned = np.flatnonzero(assignment == -1).tolist()
+    return days, unassigned
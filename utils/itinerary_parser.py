@@ -0,0 +1,165 @@
+import json
+import re
+from datetime import datetime, timedelta
+
+
+def extract_json_itinerary(text):
+    """Extract the JSON itinerary object from an LLM response."""
+    if not text:
+        return None
+
+    json_match = re.search(r'(\{[\s\S]*\})', text)
+    if not json_match:
+        return None
+
+    try:
+        return json.loads(json_match.group(1))
+    except ValueError as e:
+        print(f"Error parsing itinerary JSON: {str(e)}")
+        return None
+
+
+# Clock ranges for vague times of day
+TIMES_OF_DAY = {
+    'morning': ('09:00', '12:00'),
+    'noon': ('12:00', '13:00'),
+    'lunch': ('12:00', '13:30'),
+    'afternoon': ('13:00', '17:00'),
+    'evening': ('18:00', '21:00'),
+    'dinner': ('19:00', '21:00'),
+    'night': ('20:00', '23:00'),
+}
+
+DEFAULT_VISIT_MINUTES = 60
+
+_CLOCK_TIME = re.compile(r'(\d{1,2})(?:[:.](\d{2}))?\s*(am|pm|a\.m\.|p\.m\.)?', re.IGNORECASE)
+_DURATION = re.compile(r'(\d+(?:\.\d+)?)\s*(?:-\s*(\d+(?:\.\d+)?)\s*)?(hours?|hrs?|h|minutes?|mins?|m)\b',
+                       re.IGNORECASE)
+
+
+def normalize_time(text):
+    """Convert a clock time such as '2:00 PM', '14:00' or '9am' to 'HH:MM', or None."""
+    if not text:
+        return None
+    match = _CLOCK_TIME.fullmatch(str(text).strip())
+    if not match:
+        return None
+    hour, minute, meridiem = int(match.group(1)), int(match.group(2) or 0), match.group(3)
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem.lower().startswith('p') else 0)
+    elif match.group(2) is None:
+        # A bare number is too ambiguous to be a time
+        return None
+    if hour > 23 or minute > 59:
+        return None
+    return f"{hour:02d}:{minute:02d}"
+
+
+def parse_duration_minutes(text):
+    """Convert a duration such as '2 hours', '90 mins' or '1-2 hours' to minutes, or None.
+
+    For a range the midpoint is used.
+    """
+    if not text:
+        return None
+    match = _DURATION.search(str(text))
+    if not match:
+        return None
+    low = float(match.group(1))
+    high = float(match.group(2)) if match.group(2) else low
+    value = (low + high) / 2
+    return round(value * 60) if match.group(3).lower().startswith('h') else round(value)
+
+
+def parse_time_range(text, duration_minutes=None):
+    """Convert an itinerary time to zero-padded ('HH:MM', 'HH:MM') start and end times.
+
+    Accepts a single clock time ('2:00 PM'), a range ('09:00 - 10:30',
+    '9 AM to 11 AM') or a time of day ('Morning'). A single time ends
+    duration_minutes (default DEFAULT_VISIT_MINUTES) later, capped at 23:59.
+    Returns (None, None) when the text can't be read as a time.
+    """
+    if not text:
+        return None, None
+    text = str(text).strip()
+
+    parts = re.split(r'\s*(?:-|–|—|\bto\b)\s*', text, maxsplit=1)
+    if len(parts) == 2:
+        start, end = normalize_time(parts[0]), normalize_time(parts[1])
+        # '9 - 11 AM' shares the meridiem of the end time
+        if start is None and end is not None:
+            meridiem = re.search(r'(am|pm|a\.m\.|p\.m\.)\s*$', parts[1], re.IGNORECASE)
+            if meridiem:
+                start = normalize_time(f"{parts[0]} {meridiem.group(1)}")
+        if start and end:
+            return start, end
+
+    start = normalize_time(text)
+    if start is None:
+        for name, (range_start, range_end) in TIMES_OF_DAY.items():
+            if re.search(rf'\b{name}\b', text, re.IGNORECASE):
+                return range_start, range_end
+        return None, None
+
+    minutes = duration_minutes or DEFAULT_VISIT_MINUTES
+    started = datetime.strptime(start, '%H:%M')
+    ended = min(started + timedelta(minutes=minutes), started.replace(hour=23, minute=59))
+    return start, ended.strftime('%H:%M')
+
+
+def _day_heading(day, start_date):
+    """Build the heading for a day, including the weekday when the date is known."""
+    day_num = day.get('day')
+    day_date = day.get('date')
+
+    if not day_date and start_date and isinstance(day_num, int):
+        try:
+            day_date = (datetime.strptime(start_date, '%Y-%m-%d') +
+                        timedelta(days=day_num - 1)).strftime('%Y-%m-%d')
+        except ValueError:
+            day_date = None
+
+    if day_date:
+        try:
+            day_name = datetime.strptime(day_date, '%Y-%m-%d').strftime('%A')
+            return f"## Day {day_num}: {day_name}, {day_date}\n\n"
+        except ValueError:
+            return f"## Day {day_num}: {day_date}\n\n"
+
+    return f"## Day {day_num}\n\n"
+
+
+def render_markdown_itinerary(json_data):
+    """Render a parsed JSON itinerary as Markdown."""
+    trip = (json_data or {}).get('trip', {})
+    destination = trip.get('destination', 'Unknown')
+    dates = trip.get('dates', {}) or {}
+    start_date = dates.get('start')
+    end_date = dates.get('end')
+
+    md_content = f"# Trip to {destination} Itinerary\n\n"
+    md_content += f"**Destination:** {destination}\n"
+    if start_date and end_date:
+        md_content += f"**Dates:** {start_date} to {end_date}\n"
+    md_content += "\n"
+
+    for day in trip.get('itinerary', []):
+        md_content += _day_heading(day, start_date)
+
+        for activity in day.get('activities', []):
+            heading = activity.get('place', 'Activity')
+            if activity.get('address'):
+                heading += f" ({activity['address']})"
+            if activity.get('time'):
+                heading = f"{activity['time']}: {heading}"
+            md_content += f"### {heading}\n\n"
+
+            if activity.get('description'):
+                md_content += f"{activity['description']}\n\n"
+
+            if activity.get('expected_time'):
+                md_content += f"**Expected time:** {activity['expected_time']}\n\n"
+
+    return md_content
@@ -0,0 +1,143 @@
+import sqlite3
+import json
+import hashlib
+import time
+from threading import Lock
+
+from utils.db_pool import get_pool
+
+
+class LLMCache:
+    """Content-addressed SQLite cache for LLM completions."""
+
+    def __init__(self, db_path='llm_cache.db', ttl_seconds=24 * 3600, max_entries=5000):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self.pool = get_pool(db_path)
+        self.initialize_db()
+
+    def get_connection(self):
+        return self.pool.acquire()
+
+    def initialize_db(self):
+        """Create the cache table if it doesn't exist."""
+        conn = self.get_connection()
+        try:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                cache_key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed REAL NOT NULL,
+                hit_count INTEGER NOT NULL DEFAULT 0
+            )
+            ''')
+            conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_llm_cache_last_accessed
+            ON llm_cache (last_accessed)
+            ''')
+            conn.commit()
+        finally:
+            self.pool.release(conn)
+
+    @staticmethod
+    def make_key(messages, model):
+        """Hash the normalized messages and model name into a cache key."""
+        normalized = [
+            {
+                'role': str(message.get('role', '')).strip().lower(),
+                'content': ' '.join(str(message.get('content', '')).split())
+            }
+            for message in messages
+        ]
+        payload = json.dumps({'model': model, 'messages': normalized}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached response for a key, or None on a miss."""
+        now = time.time()
+        conn = self.get_connection()
+        try:
+            row = conn.execute(
+                'SELECT response, created_at FROM llm_cache WHERE cache_key = ?', (key,)
+            ).fetchone()
+
+            if row and now - row['created_at'] <= self.ttl_seconds:
+                conn.execute('''
+                UPDATE llm_cache
+                SET last_accessed = ?, hit_count = hit_count + 1
+                WHERE cache_key = ?
+                ''', (now, key))
+                conn.commit()
+                self._count(hit=True)
+                return row['response']
+
+            if row:
+                # Expired entry
+                conn.execute('DELETE FROM llm_cache WHERE cache_key = ?', (key,))
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error reading LLM cache: {str(e)}")
+        finally:
+            self.pool.release(conn)
+
+        self._count(hit=False)
+        return None
+
+    def set(self, key, model, response):
+        """Store a response and evict least recently used entries over the limit."""
+        if not response or response.startswith('Error:'):
+            return False
+
+        now = time.time()
+        conn = self.get_connection()
+        try:
+            conn.execute('''
+            INSERT OR REPLACE INTO llm_cache (cache_key, model, response, created_at, last_accessed, hit_count)
+            VALUES (?, ?, ?, ?, ?, 0)
+            ''', (key, model, response, now, now))
+
+            conn.execute('DELETE FROM llm_cache WHERE created_at < ?', (now - self.ttl_seconds,))
+            conn.execute('''
+            DELETE FROM llm_cache
+            WHERE cache_key IN (
+                SELECT cache_key FROM llm_cache
+                ORDER BY last_accessed DESC
+                LIMIT -1 OFFSET ?
+            )
+            ''', (self.max_entries,))
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Error writing LLM cache: {str(e)}")
+            return False
+        finally:
+            self.pool.release(conn)
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        """Return hit/miss counters and the number of stored entries."""
+        conn = self.get_connection()
+        try:
+            entries = conn.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0]
+        finally:
+            self.pool.release(conn)
+
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': entries
+        }
@@ -0,0 +1,125 @@
+"""Hierarchical grid clustering of map points, supercluster style.
+
+Points are projected to Web Mercator world coordinates in [0, 1). For every
+zoom level from max_zoom down to min_zoom, the clusters of the level below
+are merged by a grid of cells radius_px screen pixels wide, so each level is
+built from the previous one in a single vectorized pass. A query only looks
+at the one level for its zoom, and a viewport holds a bounded number of
+cells, so the response size does not grow with the number of points.
+"""
+
+import math
+
+import numpy as np
+
+TILE_EXTENT = 256
+MAX_LATITUDE = 85.05112878
+
+
+def _project(latitudes, longitudes):
+    lat = np.radians(np.clip(np.asarray(latitudes, dtype=float), -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(longitudes, dtype=float) + 180.0) / 360.0
+    y = 0.5 - np.log((1 + np.sin(lat)) / (1 - np.sin(lat))) / (4 * math.pi)
+    return np.clip(x, 0.0, 1.0 - 1e-12), y
+
+
+def _latitude(y):
+    return np.degrees(np.arctan(np.sinh(math.pi * (1 - 2 * y))))
+
+
+class ClusterIndex:
+    """Clusters of points for every zoom level.
+
+    kinds labels each point (e.g. 'place' or 'traveler'); clusters report how
+    many points of each kind they hold. ids are returned for unclustered points.
+    """
+
+    def __init__(self, latitudes, longitudes, kinds, ids, min_zoom=0, max_zoom=16, radius_px=60):
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.kind_names = sorted(set(kinds))
+        self.ids = list(ids)
+        self.kinds = list(kinds)
+
+        x, y = _project(latitudes, longitudes)
+        n = len(x)
+        kind_index = {kind: i for i, kind in enumerate(self.kind_names)}
+        kind_counts = np.zeros((n, len(self.kind_names)))
+        if n:
+            kind_counts[np.arange(n), [kind_index[kind] for kind in kinds]] = 1
+
+        # The level past max_zoom holds the points themselves
+        self.levels = {max_zoom + 1: {
+            'x': x, 'y': y,
+            'count': np.ones(n),
+            'kinds': kind_counts,
+            'point': np.arange(n),
+            'child_count': np.ones(n, dtype=int),
+            'first_child': np.arange(n)
+        }}
+
+        for zoom in range(max_zoom, min_zoom - 1, -1):
+            below = self.levels[zoom + 1]
+            cells_per_side = max(1, math.ceil(TILE_EXTENT * 2 ** zoom / radius_px))
+            cell_x = np.minimum((below['x'] * cells_per_side).astype(np.int64), cells_per_side - 1)
+            cell_y = np.clip((below['y'] * cells_per_side).astype(np.int64), 0, cells_per_side - 1)
+            _, parent = np.unique(cell_x * cells_per_side + cell_y, return_inverse=True)
+            clusters = parent.max() + 1 if n else 0
+
+            count = np.bincount(parent, weights=below['count'], minlength=clusters)
+            first_child = np.zeros(clusters, dtype=int)
+            # Later assignments win, so writing in reverse keeps the first child
+            first_child[parent[::-1]] = np.arange(len(parent))[::-1]
+            self.levels[zoom] = {
+                'x': np.bincount(parent, weights=below['x'] * below['count'], minlength=clusters) / np.maximum(count, 1),
+                'y': np.bincount(parent, weights=below['y'] * below['count'], minlength=clusters) / np.maximum(count, 1),
+                'count': count,
+                'kinds': np.column_stack([
+                    np.bincount(parent, weights=below['kinds'][:, i], minlength=clusters)
+                    for i in range(len(self.kind_names))
+                ]) if self.kind_names else np.zeros((clusters, 0)),
+                'point': below['point'][first_child],
+                'child_count': np.bincount(parent, minlength=clusters),
+                'first_child': first_child
+            }
+
+    def _expansion_zoom(self, zoom, index):
+        """The zoom at which a cluster first splits into several."""
+        while zoom <= self.max_zoom and self.levels[zoom]['child_count'][index] == 1:
+            index = self.levels[zoom]['first_child'][index]
+            zoom += 1
+        return min(zoom + 1, self.max_zoom + 1)
+
+    def get_clusters(self, west, south, east, north, zoom):
+        """Return the clusters and single points inside a bounding box at a zoom level.
+
+        Single points are dicts with 'lat', 'lng', 'kind' and 'id'; clusters
+        have 'lat', 'lng', 'count', a count per kind and 'expansion_zoom'.
+        """
+        zoom = min(max(int(zoom), self.min_zoom), self.max_zoom + 1)
+        level = self.levels[zoom]
+
+        min_x, max_y = _project([south], [west])
+        max_x, min_y = _project([north], [east])
+        in_y = (level['y'] >= min_y[0]) & (level['y'] <= max_y[0])
+        if west <= east:
+            in_x = (level['x'] >= min_x[0]) & (level['x'] <= max_x[0])
+        else:
+            # The box crosses the antimeridian
+            in_x = (level['x'] >= min_x[0]) | (level['x'] <= max_x[0])
+
+        results = []
+        for index in np.flatnonzero(in_x & in_y):
+            lat = round(float(_latitude(level['y'][index])), 5)
+            lng = round(float(level['x'][index] * 360.0 - 180.0), 5)
+            if level['count'][index] == 1:
+                point = int(level['point'][index])
+                results.append({'lat': lat, 'lng': lng, 'kind': self.kinds[point], 'id': self.ids[point]})
+                continue
+
+            cluster = {'lat': lat, 'lng': lng, 'count': int(level['count'][index])}
+            for i, kind in enumerate(self.kind_names):
+                cluster[f'{kind}s'] = int(level['kinds'][index, i])
+            cluster['expansion_zoom'] = self._expansion_zoom(zoom, index)
+            results.append(cluster)
+        return results